@@ -0,0 +1,425 @@
+"""
+Author:  Phil Morefield
+Purpose: Time and memory benchmarks for the LORAX projection engine and the
+         heaviest input scripts
+Created: October 19th, 2026
+
+Every benchmark runs in a fresh (spawned) process so that peak resident
+memory can be measured per benchmark and nothing is cached between them.
+Results are appended to results/benchmark_history.csv together with the git
+commit and host, so runs on the same machine can be compared over time.
+
+Usage:
+    python benchmark_lorax_p1v0.py                      # default suite
+    python benchmark_lorax_p1v0.py --only migration     # name filter
+    python benchmark_lorax_p1v0.py --list
+    python benchmark_lorax_p1v0.py --compare            # latest vs previous
+"""
+import argparse
+import atexit
+import csv
+import datetime
+import importlib.util
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+
+POPULATION_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODELS_FOLDER = os.path.join(POPULATION_FOLDER, 'models')
+SCRIPTS_FOLDER = os.path.join(POPULATION_FOLDER, 'inputs', 'scripts')
+RESULTS_FOLDER = os.path.join(POPULATION_FOLDER, 'benchmarks', 'results')
+HISTORY_CSV = os.path.join(RESULTS_FOLDER, 'benchmark_history.csv')
+SYNTHETIC_CACHE = os.path.join(tempfile.gettempdir(), 'lorax_synthetic')
+
+HISTORY_COLUMNS = ['TIMESTAMP', 'COMMIT', 'HOST', 'BENCHMARK', 'REPEAT',
+                   'SECONDS_MIN', 'SECONDS_MEAN', 'SETUP_RSS_MB', 'PEAK_RSS_MB']
+
+STATE_COMPONENTS = ['mortality', 'immigration', 'migration', 'fertility', 'advance_age_groups']
+MIGRATION_GEOGRAPHIES = [51, 3100, 85000]
+TRACT_GEOGRAPHIES = [3100, 85000]
+COUNTY_GEOGRAPHIES = [300]
+TRACT_MEMORY_BUDGET_GB = 8.0
+REGRESSION_THRESHOLD = 0.10  # flag anything 10% slower or larger
+
+
+def load_module(path, name=None):
+    '''
+    Import a model or input script from its file path. The models folder is
+    put on sys.path so the models can import the shared engine module.
+    '''
+    if MODELS_FOLDER not in sys.path:
+        sys.path.insert(0, MODELS_FOLDER)
+    name = name or os.path.splitext(os.path.basename(path))[0]
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    return module
+
+
+def relocate(module, population_folder):
+    '''
+    Point a script's module-level folder constants at population_folder.
+    The scripts build their paths from a hard-coded Windows BASE_FOLDER, so
+    every string constant under it is rebased and its separators fixed.
+    '''
+    old_base = module.BASE_FOLDER
+    for name, value in list(vars(module).items()):
+        if not name.isupper() or not isinstance(value, str):
+            continue
+        if value.startswith(old_base):
+            value = population_folder + value[len(old_base):]
+        elif '\\' not in value:
+            continue
+        setattr(module, name, value.replace('\\', os.sep))
+    module.BASE_FOLDER = population_folder
+
+
+def mirror_population_folder(processed_files=None):
+    '''
+    Build a scratch population folder whose inputs point at the real raw
+    files (symlinked) but whose processed files and outputs are private
+    copies, so benchmarks never overwrite anything in the repository.
+    Synthetic processed files are only read, so they are symlinked instead.
+    '''
+    scratch = tempfile.mkdtemp(prefix='lorax_bench_')
+    atexit.register(shutil.rmtree, scratch, ignore_errors=True)
+    inputs = os.path.join(scratch, 'inputs')
+    os.makedirs(inputs)
+    os.makedirs(os.path.join(scratch, 'outputs'))
+
+    real_inputs = os.path.join(POPULATION_FOLDER, 'inputs')
+    for entry in os.listdir(real_inputs):
+        if entry == 'processed_files':
+            continue
+        os.symlink(os.path.join(real_inputs, entry), os.path.join(inputs, entry))
+    if processed_files is None:
+        shutil.copytree(os.path.join(real_inputs, 'processed_files'), os.path.join(inputs, 'processed_files'))
+    else:
+        os.symlink(processed_files, os.path.join(inputs, 'processed_files'))
+
+    return scratch
+
+
+def synthetic_inputs(n_geo, ages='group'):
+    '''
+    Return a folder of synthetic inputs for n_geo geographies, generating it
+    on first use.
+    '''
+    folder = os.path.join(SYNTHETIC_CACHE, f'{n_geo}_{ages}')
+    if not os.path.isdir(folder):
+        generator = load_module(os.path.join(SCRIPTS_FOLDER, 'Synthetic', 'create_synthetic_inputs_p1v0.py'))
+        generator.main(n_geo=n_geo, ages=ages, folder=folder)
+
+    return folder
+
+
+def state_model(processed_files=None):
+    '''
+    Import the state model and point it at a scratch population folder.
+    '''
+    model = load_module(os.path.join(MODELS_FOLDER, 'state_lorax_model_p1v0.py'))
+    relocate(model, mirror_population_folder(processed_files))
+
+    return model
+
+
+def state_projector(model, launch_population=None):
+    import polars as pl
+
+    projector = model.Projector(scenario='CBO', version='p1v0')
+    if launch_population is None:
+        projector.current_pop = model.set_launch_population()
+    else:
+        projector.current_pop = pl.read_csv(launch_population, schema_overrides={'GEOID': pl.String})
+
+    return projector
+
+
+####################
+## BENCHMARK SETUP ##
+####################
+#
+# Each setup function does all of the untimed work and returns the callable
+# that is timed.
+
+def setup_state_set_launch_population():
+    model = state_model()
+    return model.set_launch_population
+
+
+def setup_state_step(component):
+    model = state_model()
+    projector = state_projector(model)
+
+    return getattr(projector, component)
+
+
+def setup_state_run(final_projection_year):
+    model = state_model()
+    projector = model.Projector(scenario='CBO', version='p1v0')
+
+    return lambda: projector.run(final_projection_year=final_projection_year)
+
+
+def setup_migration(n_geo):
+    folder = synthetic_inputs(n_geo, ages='group')
+    model = state_model(processed_files=os.path.join(folder, 'processed_files'))
+    projector = state_projector(model, os.path.join(folder, 'processed_files', 'launch_population_2024.csv'))
+
+    return projector.migration
+
+
+def setup_tract_step(n_geo):
+    folder = synthetic_inputs(n_geo, ages='single')
+    model = load_module(os.path.join(MODELS_FOLDER, 'county_lorax_model_p1v0.py'))
+    relocate(model, mirror_population_folder())
+    model.TRACT_DATABASE_FOLDER = os.path.join(folder, 'databases')
+
+    projector = model.Projector(scenario='CBO', version='p1v1', fert_calibr=0.0, mort_calibr=0.0,
+                                geography='tract', memory_budget_gb=TRACT_MEMORY_BUDGET_GB)
+    engine = model.DenseEngine(rates=projector.rates,
+                               immigration=projector.immigration_tensor,
+                               immigration_years=projector.immigration_years,
+                               migration=projector.build_migration_chunks(),
+                               male_birth_fraction=model.MALE_BIRTH_FRACTION,
+                               remainder_mode='carry')
+    pop, remainder = model.set_tract_launch_population(projector.rates.index)
+    year = projector.immigration_years[0]
+
+    return lambda: engine.step(pop, year, remainder, first_step=True)
+
+
+def setup_county_step(n_geo, compiled):
+    import numpy as np
+    import polars as pl
+
+    folder = synthetic_inputs(n_geo, ages='single')
+    model = load_module(os.path.join(MODELS_FOLDER, 'county_lorax_model_p1v0.py'))
+    relocate(model, mirror_population_folder())
+    model.DATABASE_FOLDER = os.path.join(folder, 'databases')
+
+    projector = model.Projector(scenario='CBO', version='p1v1', fert_calibr=0.0, mort_calibr=0.0)
+    engine = model.DenseEngine(rates=projector.rates,
+                               immigration=projector.immigration_tensor,
+                               immigration_years=projector.immigration_years,
+                               migration=projector.build_migration_operator(),
+                               male_birth_fraction=model.MALE_BIRTH_FRACTION,
+                               remainder_mode='carry')
+    if compiled:
+        engine = model.CompiledEngine(engine)
+    launch = pl.read_csv(os.path.join(folder, 'databases', 'launch_population_2024.csv'),
+                         schema_overrides={'GEOID': pl.String})
+    pop = projector.rates.index.to_array(launch, 'POPULATION')
+    remainder = np.zeros_like(pop)
+    year = projector.immigration_years[0]
+    # compile outside of the timed call
+    engine.step(pop, year, remainder, first_step=True)
+
+    return lambda: engine.step(pop, year, remainder, first_step=True)
+
+
+def setup_input_script(relative_path, required):
+    module = load_module(os.path.join(SCRIPTS_FOLDER, relative_path))
+    scratch = mirror_population_folder()
+    relocate(module, scratch)
+
+    missing = [path for path in required if not os.path.exists(os.path.join(scratch, path))]
+    if missing:
+        raise FileNotFoundError(f"Raw inputs not available: {', '.join(missing)}")
+
+    return module.main
+
+
+def benchmarks():
+    '''
+    Registry of benchmark name -> (setup function, args, default repeat).
+    '''
+    registry = {'state_set_launch_population': (setup_state_set_launch_population, (), 3)}
+
+    for component in STATE_COMPONENTS:
+        registry[f'state_step_{component}'] = (setup_state_step, (component,), 3)
+
+    registry['state_run_10_year'] = (setup_state_run, (2034,), 1)
+    registry['state_run_full_horizon'] = (setup_state_run, (2098,), 1)
+
+    for n_geo in MIGRATION_GEOGRAPHIES:
+        registry[f'migration_{n_geo}'] = (setup_migration, (n_geo,), 1)
+
+    for n_geo in TRACT_GEOGRAPHIES:
+        registry[f'tract_step_{n_geo}'] = (setup_tract_step, (n_geo,), 1)
+
+    for n_geo in COUNTY_GEOGRAPHIES:
+        registry[f'county_step_{n_geo}'] = (setup_county_step, (n_geo, False), 3)
+        registry[f'county_step_{n_geo}_compiled'] = (setup_county_step, (n_geo, True), 3)
+
+    registry['script_state_create_migration_cohort_fractions'] = (
+        setup_input_script,
+        (os.path.join('ACS', 'migration', 'state_create_migration_cohort_fractions_p1v0.py'),
+         [os.path.join('inputs', 'raw_files', 'ACS', '2018_2022'),
+          os.path.join('inputs', 'raw_files', 'ACS', '2011_2015', 'migration', 'county-to-county-by-age-2011-2015-current-residence-sort.xlsx')]),
+        1)
+    registry['script_process_mortality_projected'] = (
+        setup_input_script,
+        (os.path.join('CBO', 'mortality', 'process_mortality_projected_p1v0.py'),
+         [os.path.join('inputs', 'raw_files', 'CBO', '57059-2025-09-Demographic-Projections')]),
+        1)
+
+    return registry
+
+
+##############
+## RUNNING ##
+##############
+
+def max_rss_mb():
+    # ru_maxrss is reported in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def _child(name, repeat, queue):
+    '''
+    Run one benchmark inside a spawned process and report the timings and
+    peak resident memory back to the parent.
+    '''
+    setup, args, _ = benchmarks()[name]
+    seconds = []
+    setup_rss = None
+    try:
+        for _ in range(repeat):
+            func = setup(*args)
+            if setup_rss is None:
+                setup_rss = max_rss_mb()
+            start = time.perf_counter()
+            func()
+            seconds.append(time.perf_counter() - start)
+    except Exception as e:
+        queue.put({'error': f'{type(e).__name__}: {e}'})
+        return
+
+    queue.put({'seconds': seconds, 'setup_rss_mb': setup_rss, 'peak_rss_mb': max_rss_mb()})
+
+
+def run_benchmark(name, repeat):
+    ctx = multiprocessing.get_context('spawn')
+    queue = ctx.Queue()
+    process = ctx.Process(target=_child, args=(name, repeat, queue))
+    process.start()
+    process.join()
+
+    if queue.empty():
+        return {'error': f'process exited with code {process.exitcode}'}
+
+    return queue.get()
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                              cwd=POPULATION_FOLDER,
+                              capture_output=True,
+                              text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def append_history(rows):
+    os.makedirs(RESULTS_FOLDER, exist_ok=True)
+    new_file = not os.path.isfile(HISTORY_CSV)
+    with open(HISTORY_CSV, 'a', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=HISTORY_COLUMNS)
+        if new_file:
+            writer.writeheader()
+        writer.writerows(rows)
+
+
+def read_history():
+    if not os.path.isfile(HISTORY_CSV):
+        return []
+    with open(HISTORY_CSV, newline='') as f:
+        return list(csv.DictReader(f))
+
+
+def compare(host=None, threshold=REGRESSION_THRESHOLD):
+    '''
+    Print the latest result of every benchmark on this host against the
+    previous one, flagging time or memory regressions above threshold.
+    '''
+    host = host or platform.node()
+    history = [row for row in read_history() if row['HOST'] == host]
+
+    by_name = {}
+    for row in history:
+        by_name.setdefault(row['BENCHMARK'], []).append(row)
+
+    print(f"{'BENCHMARK':<50}{'PREV':>10}{'LATEST':>10}{'TIME':>9}{'PEAK MB':>10}{'MEM':>9}")
+    for name, rows in sorted(by_name.items()):
+        if len(rows) < 2:
+            continue
+        prev, latest = rows[-2], rows[-1]
+        time_ratio = float(latest['SECONDS_MIN']) / float(prev['SECONDS_MIN']) - 1.0
+        mem_ratio = float(latest['PEAK_RSS_MB']) / float(prev['PEAK_RSS_MB']) - 1.0
+        flag = '  <-- REGRESSION' if time_ratio > threshold or mem_ratio > threshold else ''
+        print(f"{name:<50}{prev['COMMIT']:>10}{latest['COMMIT']:>10}{time_ratio:>+9.1%}"
+              f"{float(latest['PEAK_RSS_MB']):>10,.0f}{mem_ratio:>+9.1%}{flag}")
+
+
+def main(only=None, repeat=None, skip_large=False):
+    registry = benchmarks()
+    names = [name for name in registry if only is None or any(pattern in name for pattern in only)]
+    if skip_large:
+        large = (f'migration_{MIGRATION_GEOGRAPHIES[-1]}', f'tract_step_{TRACT_GEOGRAPHIES[-1]}')
+        names = [name for name in names if not name.startswith(large)]
+
+    commit = git_commit()
+    host = platform.node()
+    rows = []
+    for name in names:
+        n = repeat or registry[name][2]
+        print(f"{name}...", end='', flush=True)
+        result = run_benchmark(name, n)
+        if 'error' in result:
+            print(f"skipped ({result['error']})")
+            continue
+
+        seconds = result['seconds']
+        row = {'TIMESTAMP': datetime.datetime.now().isoformat(timespec='seconds'),
+               'COMMIT': commit,
+               'HOST': host,
+               'BENCHMARK': name,
+               'REPEAT': n,
+               'SECONDS_MIN': round(min(seconds), 4),
+               'SECONDS_MEAN': round(sum(seconds) / len(seconds), 4),
+               'SETUP_RSS_MB': round(result['setup_rss_mb'], 1),
+               'PEAK_RSS_MB': round(result['peak_rss_mb'], 1)}
+        rows.append(row)
+        print(f"{row['SECONDS_MIN']:,.3f} s (peak {row['PEAK_RSS_MB']:,.0f} MB)")
+
+    append_history(rows)
+
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the LORAX projection engine.')
+    parser.add_argument('--only', nargs='*', default=None, help='run benchmarks whose name contains any of these')
+    parser.add_argument('--repeat', type=int, default=None)
+    parser.add_argument('--skip-large', action='store_true', help=f'skip the {MIGRATION_GEOGRAPHIES[-1]:,} geography benchmarks')
+    parser.add_argument('--list', action='store_true')
+    parser.add_argument('--compare', action='store_true')
+    args = parser.parse_args()
+
+    if args.list:
+        print('\n'.join(benchmarks()))
+    elif args.compare:
+        compare()
+    else:
+        main(only=args.only, repeat=args.repeat, skip_large=args.skip_large)
@@ -1,6 +1,7 @@
 import os
 # import sqlite3
 
+import numpy as np
 import pandas as pd
 
 
@@ -8,6 +9,11 @@ BASE_FOLDER = 'D:\\OneDrive\\lorax_p1v0\\population'
 if os.path.isdir('C:\\Users\\philm\\OneDrive\\lorax_p1v0\\population'):
     BASE_FOLDER = 'C:\\Users\\philm\\OneDrive\\lorax_p1v0\\population'
 PROCESSED_FILES = os.path.join(BASE_FOLDER, 'inputs\\processed_files')
+# the county model reads the replicates from the ICLUS_v3 databases folder
+COUNTY_BASE_FOLDER = 'D:\\OneDrive\\ICLUS_v3\\population'
+if os.path.isdir('C:\\Users\\philm\\OneDrive\\ICLUS_v3\\population'):
+    COUNTY_BASE_FOLDER = 'C:\\Users\\philm\\OneDrive\\ICLUS_v3\\population'
+DATABASE_FOLDER = os.path.join(COUNTY_BASE_FOLDER, 'inputs\\databases')
 
 AGE_MAP = {1: '1_to_4',
            2: '5_to_17',
@@ -25,6 +31,12 @@ AGE_MAP = {1: '1_to_4',
            14: '70_to_74',
            15: '75+'}
 
+# bootstrap replicates of the immigration weights drawn from the ACS margins
+# of error (90% confidence, so SE = MOE / 1.645)
+N_REPLICATES = 100
+REPLICATE_SEED = 20111016
+ACS_MOE_Z = 1.645
+
 
 def parse_age_groups(s):
 
@@ -39,7 +51,12 @@ def parse_age_groups(s):
         raise Exception
 
 
-def main():
+def read_acs_flows_from_abroad(keep_moe=False):
+    '''
+    Flows from abroad by destination county and age group. With keep_moe,
+    the sampling variance of each flow (from the ACS margin of error) is
+    kept as TOTAL_FLOW_VAR.
+    '''
     columns = ('D_STFIPS', 'D_COFIPS', 'O_STFIPS', 'O_COFIPS', 'AGE', 'D_STATE', 'D_COUNTY', 'D_POP',
                 'D_POP_MOE', 'D_NONMOVERS', 'D_NONMOVERS_MOE', 'D_MOVERS',
                 'D_MOVERS_MOE', 'D_MOVERS_SAME_CY', 'D_MOVERS_SAME_CY_MOE',
@@ -62,18 +79,57 @@ def main():
     df = df[~df.O_STFIPS.str.contains('XXX')]
 
     foreign = ['EUR', 'ASI', 'SAM', 'ISL', 'NAM', 'CAM', 'CAR', 'AFR', 'OCE']
-    df = df.loc[df.O_STFIPS.isin(foreign), ['D_STFIPS', 'D_COFIPS', 'AGE', 'TOTAL_FLOW']]
+    df = df.loc[df.O_STFIPS.isin(foreign), ['D_STFIPS', 'D_COFIPS', 'AGE', 'TOTAL_FLOW', 'TOTAL_FLOW_MOE']]
+    df['TOTAL_FLOW_VAR'] = (pd.to_numeric(df.TOTAL_FLOW_MOE, errors='coerce').fillna(0) / ACS_MOE_Z) ** 2
 
     df['D_STFIPS'] = df.D_STFIPS.astype('int').astype('str').str.zfill(2)
     df['D_COFIPS'] = df.D_COFIPS.astype('int').astype('str').str.zfill(3)
     df['DESTINATION_FIPS'] = df.D_STFIPS + df.D_COFIPS
 
     df['AGE'] = df.AGE.replace(to_replace=AGE_MAP)
-    df = df[['DESTINATION_FIPS', 'AGE', 'TOTAL_FLOW']]
+    df = df[['DESTINATION_FIPS', 'AGE', 'TOTAL_FLOW'] + (['TOTAL_FLOW_VAR'] if keep_moe else [])]
 
     assert not df.isnull().any().any()
 
-    df = df.groupby(['DESTINATION_FIPS', 'AGE'], as_index=False).sum()
+    # flows from every world region, and their sampling variances, add
+    return df.groupby(['DESTINATION_FIPS', 'AGE'], as_index=False).sum()
+
+
+def get_immigration_replicates(n_replicates=N_REPLICATES, seed=REPLICATE_SEED):
+    '''
+    Draw bootstrap replicates of the destination x age group flows from
+    abroad from the ACS margins of error (normal, floored at zero) and store
+    each replicate as a float32 multiplier of the county's share of its age
+    group, so the model applies it to the age-sex immigration fractions.
+    '''
+    df = read_acs_flows_from_abroad(keep_moe=True)
+
+    flow = df.TOTAL_FLOW.to_numpy(dtype=np.float64)
+    se = np.sqrt(df.TOTAL_FLOW_VAR.to_numpy(dtype=np.float64))
+    group = pd.factorize(df.AGE)[0]
+    n_groups = group.max() + 1
+    share = flow / np.bincount(group, weights=flow, minlength=n_groups)[group]
+
+    rng = np.random.default_rng(seed)
+    multipliers = np.ones((n_replicates, len(df)), dtype=np.float32)
+    for b in range(n_replicates):
+        flow_b = np.maximum(flow + rng.standard_normal(flow.size) * se, 0.0)
+        share_b = flow_b / np.bincount(group, weights=flow_b, minlength=n_groups)[group]
+        multipliers[b] = np.divide(share_b, share, out=np.ones(flow.size), where=share > 0)
+
+    groups = list(AGE_MAP.values())
+    start_ages = [min(parse_age_groups(label)) for label in groups]
+
+    np.savez(os.path.join(DATABASE_FOLDER, 'acs_immigration_replicates_2011_2015.npz'),
+             destinations=df.DESTINATION_FIPS.to_numpy(dtype=str),
+             age_groups=df.AGE.to_numpy(dtype=str),
+             group_labels=np.array(groups),
+             group_start_ages=np.array(start_ages),
+             multipliers=multipliers)
+
+
+def main():
+    df = read_acs_flows_from_abroad()
     df['AGE_SUM'] = df.groupby('AGE')['TOTAL_FLOW'].transform('sum')
     df['WEIGHT_x_10^6'] = (df['TOTAL_FLOW'] / df['AGE_SUM']) * 1000000
     df = df.pivot(index='DESTINATION_FIPS', columns='AGE', values='WEIGHT_x_10^6')
@@ -107,6 +163,9 @@ def main():
     df.to_csv(path_or_buf=os.path.join(PROCESSED_FILES, 'county_acs_immigration_weights_age_2011_2015.csv'),
               index=False)
 
+    if N_REPLICATES > 0:
+        get_immigration_replicates()
+
 
 if __name__ == '__main__':
     main()
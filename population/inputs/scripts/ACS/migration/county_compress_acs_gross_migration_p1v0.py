@@ -0,0 +1,129 @@
+"""
+Author:  Phil Morefield
+Purpose: Compress the county-to-county migration rates by keeping the top-k
+         destinations of every origin, and report the error of top-k and
+         low-rank approximations against the full rates
+Created: October 19th, 2026
+
+Most origin-destination pairs carry rates well inside the ACS margins of
+error, but every pair is multiplied for every age and sex in every year. The
+compressed table keeps the k destinations of each origin with the most
+migrants and reallocates the dropped rates to them, so every origin's
+outflows by age and sex are unchanged (see top_k_migration_operator). It has
+the same columns as the full table and can be used by the county model in
+its place (MIGRATION_CSV).
+
+The report compares every candidate with the full rates on one population
+(the launch population if given, otherwise one person per cohort): size,
+time per year, and the relative L1 error of inflows, outflows and net
+migration.
+
+Usage:
+    python county_compress_acs_gross_migration_p1v0.py --top-k 50
+    python county_compress_acs_gross_migration_p1v0.py --top-k 50 --report-k 10 25 100 --ranks 50 100
+"""
+import argparse
+import os
+import sys
+
+import numpy as np
+import polars as pl
+
+
+BASE_FOLDER = 'D:\\OneDrive\\ICLUS_v3\\population'
+if os.path.isdir('C:\\Users\\philm\\OneDrive\\ICLUS_v3\\population'):
+    BASE_FOLDER = 'C:\\Users\\philm\\OneDrive\\ICLUS_v3\\population'
+DATABASE_FOLDER = os.path.join(BASE_FOLDER, 'inputs', 'databases')
+
+MODELS_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..', '..', 'models')
+sys.path.insert(0, os.path.abspath(MODELS_FOLDER))
+from lorax_engine_p1v0 import (CohortIndex, build_low_rank_migration_operator, build_migration_operator,  # noqa: E402
+                               migration_error_report, top_k_migration_operator)
+
+
+MIGRATION_CSV = 'acs_gross_migration_age_sex_fractions_2011_2015.csv'
+AGES = list(range(86))  # single years of age, 85 is 85+
+
+# the low-rank bases come from a dense GEOID x GEOID SVD
+LOW_RANK_MAX_GEOIDS = 10000
+
+
+def read_rates(database_folder):
+    rates = pl.scan_csv(os.path.join(database_folder, MIGRATION_CSV),
+                        schema_overrides={'ORIGIN_FIPS': pl.String, 'DESTINATION_FIPS': pl.String})
+    rates = rates.with_columns([pl.col('ORIGIN_FIPS').str.zfill(5),
+                                pl.col('DESTINATION_FIPS').str.zfill(5)])
+
+    # we have migration rates to/from Puerto Rico, but not currently
+    # modeling migration involving PR
+    rates = rates.filter(~pl.col('ORIGIN_FIPS').str.starts_with('7') & ~pl.col('DESTINATION_FIPS').str.starts_with('7'))
+
+    return rates.collect(engine='streaming')
+
+
+def operator_to_frame(operator):
+    '''
+    Long ORIGIN_FIPS, DESTINATION_FIPS, AGE, SEX, MIGRATION_RATE table of a
+    MigrationOperator (destinations outside the index are dropped).
+    '''
+    index = operator.index
+    inside = operator.destinations >= 0
+    n_cohorts = len(index.ages) * len(index.sexes)
+    geoids = np.asarray(index.geoids)
+
+    return pl.DataFrame({'ORIGIN_FIPS': np.repeat(geoids[operator.origins[inside]], n_cohorts),
+                         'DESTINATION_FIPS': np.repeat(geoids[operator.destinations[inside]], n_cohorts),
+                         'AGE': np.tile(np.repeat(index.ages, len(index.sexes)), inside.sum()),
+                         'SEX': np.tile(index.sexes, len(index.ages) * inside.sum()),
+                         'MIGRATION_RATE': operator.rates[inside].ravel()})
+
+
+def main(top_k=50, report_k=(10, 25, 100), ranks=(50, 100), population_csv=None, database_folder=None):
+    database_folder = database_folder or DATABASE_FOLDER
+    rates = read_rates(database_folder)
+
+    geoids = sorted(set(rates.get_column('ORIGIN_FIPS').unique().to_list()) |
+                    set(rates.get_column('DESTINATION_FIPS').unique().to_list()))
+    index = CohortIndex(geoids=geoids, ages=AGES, age_col='AGE')
+    full = build_migration_operator(index=index, rates=rates)
+    del rates
+    print(f"Full rates: {full.n_pairs:,} origin-destination pairs, {full.nbytes / 1024 ** 2:,.0f} MB")
+
+    pop = np.ones(index.shape)
+    if population_csv is not None:
+        df = pl.read_csv(population_csv, schema_overrides={'GEOID': pl.String})
+        pop = index.to_array(df.with_columns(pl.col('GEOID').str.zfill(5)), 'POPULATION')
+
+    candidates = {}
+    for k in sorted(set(report_k) | {top_k}):
+        candidates[f'top_{k}'] = top_k_migration_operator(full, k, weights=pop)
+    if len(index.geoids) <= LOW_RANK_MAX_GEOIDS:
+        for rank in ranks:
+            candidates[f'rank_{rank}'] = build_low_rank_migration_operator(full, rank)
+    else:
+        print(f"Skipping low-rank candidates: more than {LOW_RANK_MAX_GEOIDS:,} geographies")
+
+    report = migration_error_report(full, candidates, pop)
+    with pl.Config(tbl_rows=-1, tbl_cols=-1, tbl_width_chars=200):
+        print(report)
+    report.write_csv(os.path.join(database_folder, 'acs_gross_migration_compression_report.csv'))
+
+    compressed = operator_to_frame(candidates[f'top_{top_k}'])
+    compressed.write_csv(os.path.join(database_folder, MIGRATION_CSV.replace('.csv', f'_top{top_k}.csv')))
+    print(f"Wrote {compressed.height:,} rows for the top {top_k} destinations of every origin")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compress the county migration rates.')
+    parser.add_argument('--top-k', type=int, default=50, help='destinations kept per origin in the written table')
+    parser.add_argument('--report-k', type=int, nargs='*', default=[10, 25, 100])
+    parser.add_argument('--ranks', type=int, nargs='*', default=[50, 100])
+    parser.add_argument('--population', default=None, help='GEOID, AGE, SEX, POPULATION csv used to rank and weigh errors')
+    parser.add_argument('--database-folder', default=None)
+    args = parser.parse_args()
+
+    main(top_k=args.top_k,
+         report_k=args.report_k,
+         ranks=args.ranks,
+         population_csv=args.population,
+         database_folder=args.database_folder)
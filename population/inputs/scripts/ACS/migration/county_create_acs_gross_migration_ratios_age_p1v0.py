@@ -1,15 +1,14 @@
 import os
 import sqlite3
 
+import numpy as np
 import pandas as pd
 
 pd.set_option("display.max_columns", None) # show all cols
 
-BASE_FOLDER = 'D:\\projects\\ICLUS_v3\\population'
+BASE_FOLDER = 'D:\\OneDrive\\ICLUS_v3\\population'
 if os.path.isdir('C:\\Users\\philm\\OneDrive\\ICLUS_v3\\population'):
     BASE_FOLDER = 'C:\\Users\\philm\\OneDrive\\ICLUS_v3\\population'
-if os.path.isdir('D:\\OneDrive\\ICLUS_v3\\population'):
-    BASE_FOLDER = 'D:\\OneDrive\\ICLUS_v3\\population'
 
 DATABASE_FOLDER = os.path.join(BASE_FOLDER, 'inputs\\databases')
 MIGRATION_DB = os.path.join(DATABASE_FOLDER, 'migration.sqlite')
@@ -31,6 +30,12 @@ ACS_AGE_GROUP_MAP = {1: '1_TO_4',
                      14: '70_TO_74',
                      15: '75_AND_OVER'}
 
+# bootstrap replicates of the migration rates drawn from the ACS margins of
+# error (90% confidence, so SE = MOE / 1.645)
+N_REPLICATES = 100
+REPLICATE_SEED = 20111015
+ACS_MOE_Z = 1.645
+
 
 def make_fips_changes(df):
     con =sqlite3.connect(MIGRATION_DB)
@@ -53,9 +58,13 @@ def make_fips_changes(df):
                 right_on='COFIPS')
     df.loc[~df.NEW_FIPS.isnull(), 'DESTINATION_FIPS'] = df['NEW_FIPS']
     df = df.drop(columns=['NEW_FIPS', 'COFIPS'])
-    df = (df.groupby(by=['ORIGIN_FIPS', 'DESTINATION_FIPS', 'AGE_GROUP'],
-                     as_index=False).agg(FLOW=('FLOW', 'sum'),
-                                         ORIGIN_POPULATION=('ORIGIN_POPULATION', 'min')))
+    aggs = {'FLOW': ('FLOW', 'sum'),
+            'ORIGIN_POPULATION': ('ORIGIN_POPULATION', 'min')}
+    # sampling variances of merged counties add
+    if 'FLOW_VAR' in df.columns:
+        aggs['FLOW_VAR'] = ('FLOW_VAR', 'sum')
+        aggs['ORIGIN_POPULATION_VAR'] = ('ORIGIN_POPULATION_VAR', 'min')
+    df = df.groupby(by=['ORIGIN_FIPS', 'DESTINATION_FIPS', 'AGE_GROUP'], as_index=False).agg(**aggs)
     df = df.query('ORIGIN_FIPS != DESTINATION_FIPS').copy()
     df['ORIGIN_POPULATION'] = df['ORIGIN_POPULATION'].astype(int)
 
@@ -64,7 +73,12 @@ def make_fips_changes(df):
     return df
 
 
-def get_acs_2011_2015_migration():
+def get_acs_2011_2015_migration(keep_moe=False):
+    '''
+    County-to-county flows by age group. With keep_moe, the sampling
+    variances of the flows and origin populations (from the ACS margins of
+    error) are kept as FLOW_VAR and ORIGIN_POPULATION_VAR.
+    '''
     xl_filename = 'county-to-county-by-age-2011-2015-current-residence-sort.xlsx'
 
     columns = ('D_STFIPS', 'D_COFIPS', 'O_STFIPS', 'O_COFIPS', 'AGE_GROUP',
@@ -88,7 +102,10 @@ def get_acs_2011_2015_migration():
 
     df = df[~df.O_STFIPS.str.contains('XXX')]
     foreign = ('EUR', 'ASI', 'SAM', 'ISL', 'NAM', 'CAM', 'CAR', 'AFR', 'OCE')
-    df = df.loc[~df.O_STFIPS.isin(foreign), ['D_STFIPS', 'D_COFIPS', 'O_STFIPS', 'O_COFIPS', 'AGE_GROUP', 'ORIGIN_POPULATION', 'FLOW']]
+    df = df.loc[~df.O_STFIPS.isin(foreign), ['D_STFIPS', 'D_COFIPS', 'O_STFIPS', 'O_COFIPS', 'AGE_GROUP', 'ORIGIN_POPULATION', 'FLOW',
+                                             'O_POP_MOE', 'TOTAL_FLOW_MOE']]
+    df['FLOW_VAR'] = (pd.to_numeric(df.TOTAL_FLOW_MOE, errors='coerce').fillna(0) / ACS_MOE_Z) ** 2
+    df['ORIGIN_POPULATION_VAR'] = (pd.to_numeric(df.O_POP_MOE, errors='coerce').fillna(0) / ACS_MOE_Z) ** 2
 
     df['D_STFIPS'] = df.D_STFIPS.astype(int).astype(str).str.zfill(2)
     df['D_COFIPS'] = df.D_COFIPS.astype(int).astype(str).str.zfill(3)
@@ -99,7 +116,10 @@ def get_acs_2011_2015_migration():
     df['ORIGIN_FIPS'] = df.O_STFIPS + df.O_COFIPS
 
     df['AGE_GROUP'] = df['AGE_GROUP'].replace(to_replace=ACS_AGE_GROUP_MAP)
-    df = df[['ORIGIN_FIPS', 'DESTINATION_FIPS', 'AGE_GROUP', 'FLOW', 'ORIGIN_POPULATION']]
+    columns = ['ORIGIN_FIPS', 'DESTINATION_FIPS', 'AGE_GROUP', 'FLOW', 'ORIGIN_POPULATION']
+    if keep_moe:
+        columns += ['FLOW_VAR', 'ORIGIN_POPULATION_VAR']
+    df = df[columns]
 
     # make FIPS changes and consolidate migration flows
     df = make_fips_changes(df)
@@ -125,6 +145,56 @@ def calculate_flow_percentages(df):
     return df[['ORIGIN_FIPS', 'DESTINATION_FIPS', 'AGE_GROUP', 'MIGRATION_RATE']]
 
 
+def get_gross_migration_replicates(n_replicates=N_REPLICATES, seed=REPLICATE_SEED):
+    '''
+    Draw bootstrap replicates of every origin-destination-age group
+    migration rate from the ACS margins of error: every flow and every
+    origin-age group population are drawn independently from normal
+    distributions with the ACS standard errors (flows are floored at zero,
+    populations at one), and all rows of an origin-age group share its
+    population draw.
+    Each replicate is stored as a float32 multiplier of the published rate,
+    so the model applies it to its single-year, age-sex rates.
+    '''
+    df = get_acs_2011_2015_migration(keep_moe=True)
+
+    # same cleaning as calculate_flow_percentages
+    df.loc[df.AGE_GROUP == '1_TO_4', 'AGE_GROUP'] = '0_TO_4'
+    df = df.loc[~df.ORIGIN_FIPS.str.startswith('72')]
+    df = df.loc[~df.DESTINATION_FIPS.str.startswith('72')]
+
+    flow = df.FLOW.to_numpy(dtype=np.float64)
+    flow_se = np.sqrt(df.FLOW_VAR.to_numpy(dtype=np.float64))
+    pop = df.ORIGIN_POPULATION.to_numpy(dtype=np.float64)
+
+    # every destination of an origin and age group shares one draw of its
+    # population; origin_rows maps each row to its (ORIGIN_FIPS, AGE_GROUP)
+    grouped = df.groupby(['ORIGIN_FIPS', 'AGE_GROUP'], sort=False)
+    origin_rows = grouped.ngroup().to_numpy()
+    origins = grouped[['ORIGIN_POPULATION', 'ORIGIN_POPULATION_VAR']].first()
+    origin_pop = origins.ORIGIN_POPULATION.to_numpy(dtype=np.float64)
+    origin_se = np.sqrt(origins.ORIGIN_POPULATION_VAR.to_numpy(dtype=np.float64))
+
+    rng = np.random.default_rng(seed)
+    multipliers = np.ones((n_replicates, len(df)), dtype=np.float32)
+    for b in range(n_replicates):
+        flow_b = np.maximum(flow + rng.standard_normal(flow.size) * flow_se, 0.0)
+        pop_b = np.maximum(origin_pop + rng.standard_normal(origin_pop.size) * origin_se, 1.0)[origin_rows]
+        multipliers[b] = np.divide(flow_b / pop_b, flow / pop, out=np.ones(flow.size), where=flow > 0)
+
+    # first single year of age of every ACS age group
+    groups = ['0_TO_4'] + list(ACS_AGE_GROUP_MAP.values())[1:]
+    start_ages = [int(group.split('_')[0]) for group in groups]
+
+    np.savez(os.path.join(DATABASE_FOLDER, 'acs_gross_migration_replicates_2011_2015.npz'),
+             origins=df.ORIGIN_FIPS.to_numpy(dtype=str),
+             destinations=df.DESTINATION_FIPS.to_numpy(dtype=str),
+             age_groups=df.AGE_GROUP.to_numpy(dtype=str),
+             group_labels=np.array(groups),
+             group_start_ages=np.array(start_ages),
+             multipliers=multipliers)
+
+
 def get_gross_migration_ratios_by_age():
     df = get_acs_2011_2015_migration()
     df = calculate_flow_percentages(df)
@@ -141,6 +211,8 @@ def get_gross_migration_ratios_by_age():
 
 def main():
     get_gross_migration_ratios_by_age()
+    if N_REPLICATES > 0:
+        get_gross_migration_replicates()
 
 if __name__ == '__main__':
     main()
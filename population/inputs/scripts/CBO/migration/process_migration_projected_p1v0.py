@@ -0,0 +1,126 @@
+"""
+Author:  Phil Morefield
+Purpose: Year-indexed scaling factors for the domestic migration rates from
+         CBO's projected gross migration
+Created: October 19th, 2026
+
+The ACS county-to-county rates describe migration in 2011-2015 and are used
+unchanged in every projection year. CBO does not project domestic
+migration, so its gross international flows (immigration + emigration) per
+person are used as a proxy for how mobility changes over time: the factor
+for a year, single year of age and sex is that year's gross migration rate
+divided by its rate in the first projection year, so every factor is 1 in
+2025: the ACS rates keep the level of domestic migration at launch and CBO
+only adds its path over time. The 2021-2024 rates are not used as the base
+because they include the immigration surge of those years. The county model
+multiplies every origin cohort's out-migration rates by the factor of the
+projection year.
+
+Single-year international rates are noisy (a cohort of a few thousand
+migrants can double from one year to the next), so the rates are smoothed
+with a centred AGE_WINDOW-year moving average across ages before the
+ratios are taken, and the factors are clipped to [MIN_FACTOR, MAX_FACTOR]:
+international mobility of the oldest ages grows six-fold by 2098 in CBO's
+projection, which domestic mobility is not expected to follow.
+
+Output: AGE (0-85, 85 is 85+), SEX and one MIG_{year} column per projection
+year, in the same wide layout as the CBO mortality and fertility multipliers,
+written to the county model's databases folder (MIGRATION_SCALING_CSV in
+county_lorax_model_p1v0.py).
+"""
+import os
+
+import polars as pl
+
+
+BASE_FOLDER = 'D:\\OneDrive\\lorax_p1v0\\population'
+if os.path.isdir('C:\\Users\\philm\\OneDrive\\lorax_p1v0\\population'):
+    BASE_FOLDER = 'C:\\Users\\philm\\OneDrive\\lorax_p1v0\\population'
+# the county model reads its inputs from the ICLUS_v3 databases folder
+COUNTY_BASE_FOLDER = 'D:\\OneDrive\\ICLUS_v3\\population'
+if os.path.isdir('C:\\Users\\philm\\OneDrive\\ICLUS_v3\\population'):
+    COUNTY_BASE_FOLDER = 'C:\\Users\\philm\\OneDrive\\ICLUS_v3\\population'
+DATABASE_FOLDER = os.path.join(COUNTY_BASE_FOLDER, 'inputs\\databases')
+
+CBO_FOLDER = os.path.join(BASE_FOLDER, 'inputs\\raw_files\\CBO')
+CSV_FOLDER = '57059-2025-09-Demographic-Projections//CSV files'
+CSV_FILE = 'grossMigration_byYearAgeSexStatusFlow.csv'
+POPULATION_CSV_FILE = 'censusThrough2020+CBOProjection_byYearAgeSex.csv'
+
+PROJECTION_YEARS = list(range(2025, 2099))
+BASE_YEARS = PROJECTION_YEARS[:1]
+OPEN_AGE = 85
+
+# centred moving average of the rates across single years of age
+AGE_WINDOW = 9
+# plausible range of the factors, and of their change from one year to the
+# next
+MIN_FACTOR = 0.5
+MAX_FACTOR = 2.0
+MAX_ANNUAL_CHANGE = 0.5
+
+
+def read_cbo_csv(csv_file, value_col):
+    '''
+    Read a CBO year x age x sex table with single years of age, folding
+    everyone 85 and older into 85 (85+) and the age -1 (born during the
+    year) into 0.
+    '''
+    df = pl.read_csv(source=os.path.join(CBO_FOLDER, CSV_FOLDER, csv_file),
+                     infer_schema_length=0)
+    df = df.rename({'year': 'YEAR', 'age': 'AGE', 'sex': 'SEX', 'number_of_people': value_col})
+    df = df.with_columns([pl.col('YEAR').cast(pl.Int32),
+                          pl.col('AGE').str.replace('+', '', literal=True).str.replace('-1', '0').cast(pl.Int32),
+                          pl.col('SEX').str.to_uppercase(),
+                          pl.col(value_col).cast(pl.Float64)])
+    df = df.with_columns(pl.min_horizontal(pl.col('AGE'), pl.lit(OPEN_AGE)).alias('AGE'))
+
+    return df.group_by(['YEAR', 'AGE', 'SEX']).agg(pl.col(value_col).sum())
+
+
+def main():
+    flows = read_cbo_csv(CSV_FILE, 'GROSS_MIGRATION')
+    population = read_cbo_csv(POPULATION_CSV_FILE, 'POPULATION')
+
+    # gross international migrants per person by year, age and sex
+    df = flows.join(population, on=['YEAR', 'AGE', 'SEX'], how='inner')
+    df = df.with_columns((pl.col('GROSS_MIGRATION') / pl.col('POPULATION')).alias('RATE'))
+    df = df.sort(['YEAR', 'SEX', 'AGE'])
+    df = df.with_columns(pl.col('RATE').rolling_mean(AGE_WINDOW, center=True, min_samples=1)
+                                       .over(['YEAR', 'SEX'])
+                                       .alias('RATE'))
+
+    base = (df.filter(pl.col('YEAR').is_in(BASE_YEARS))
+              .group_by(['AGE', 'SEX'])
+              .agg(pl.col('RATE').mean().alias('BASE_RATE')))
+
+    # factor relative to the base years; cohorts without base migrants are
+    # left unscaled
+    df = df.filter(pl.col('YEAR').is_in(PROJECTION_YEARS)).join(base, on=['AGE', 'SEX'], how='left')
+    df = df.with_columns(pl.when(pl.col('BASE_RATE') > 0)
+                           .then(pl.col('RATE') / pl.col('BASE_RATE'))
+                           .otherwise(pl.lit(1.0))
+                           .alias('MIG'))
+    capped = df.filter((pl.col('MIG') < MIN_FACTOR) | (pl.col('MIG') > MAX_FACTOR)).height
+    print(f"Clipped {capped:,} of {df.height:,} factors to [{MIN_FACTOR}, {MAX_FACTOR}]")
+    df = df.with_columns(pl.col('MIG').clip(MIN_FACTOR, MAX_FACTOR))
+
+    change = df.sort('YEAR').select(pl.col('MIG').diff().over(['AGE', 'SEX']).abs().max()).item()
+    assert change <= MAX_ANNUAL_CHANGE, f"Migration factors change by up to {change:.2f} in one year"
+
+    df = df.sort('YEAR').pivot(on='YEAR', index=['AGE', 'SEX'], values='MIG')
+    df = df.rename({str(year): f'MIG_{year}' for year in PROJECTION_YEARS}).sort(['AGE', 'SEX'])
+    assert df.height == (OPEN_AGE + 1) * 2
+    assert df.null_count().sum_horizontal().item() == 0
+    factors = df.select(pl.exclude(['AGE', 'SEX'])).to_numpy()
+    assert MIN_FACTOR <= factors.min() and factors.max() <= MAX_FACTOR, \
+        f"Migration factors range from {factors.min():.2f} to {factors.max():.2f}"
+    # domestic migration starts at the ACS level
+    first_year_mean = df.get_column(f'MIG_{PROJECTION_YEARS[0]}').mean()
+    assert abs(first_year_mean - 1.0) < 1e-6, f"First-year migration factors average {first_year_mean:.4f}, not 1"
+
+    df.write_csv(os.path.join(DATABASE_FOLDER, 'cbo_migration_scaling_p1v0.csv'))
+
+
+if __name__ == '__main__':
+    main()
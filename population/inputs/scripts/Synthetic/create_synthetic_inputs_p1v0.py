@@ -0,0 +1,353 @@
+"""
+Author:  Phil Morefield
+Purpose: Write synthetic, schema-compatible model inputs for any number of
+         geographies so the projection engine can be benchmarked and
+         regression-tested without the county databases
+Created: October 19th, 2026
+
+Two age schemas are supported:
+
+    single  single years of age 0-85+ with the county model's file names
+            (inputs/databases layout, AGE and YEAR columns)
+    group   five-year age groups with the state model's file names
+            (inputs/processed_files layout, AGE_GROUP and TIME_STEP columns)
+
+Usage:
+    python create_synthetic_inputs_p1v0.py --geographies 3100 --ages single
+"""
+import argparse
+import os
+
+import numpy as np
+import polars as pl
+
+
+BASE_FOLDER = 'D:\\OneDrive\\lorax_p1v0\\population'
+if os.path.isdir('C:\\Users\\philm\\OneDrive\\lorax_p1v0\\population'):
+    BASE_FOLDER = 'C:\\Users\\philm\\OneDrive\\lorax_p1v0\\population'
+SYNTHETIC_FOLDER = os.path.join(BASE_FOLDER, 'inputs', 'synthetic')
+
+AGE_GROUPS = ['0-4', '5-9', '10-14', '15-19', '20-24', '25-29', '30-34',
+              '35-39', '40-44', '45-49', '50-54', '55-59', '60-64', '65-69',
+              '70-74', '75-79', '80-84', '85+']
+SEXES = ['FEMALE', 'MALE']
+STATE_FIPS = ['01', '02', '04', '05', '06', '08', '09', '10', '11', '12',
+              '13', '15', '16', '17', '18', '19', '20', '21', '22', '23',
+              '24', '25', '26', '27', '28', '29', '30', '31', '32', '33',
+              '34', '35', '36', '37', '38', '39', '40', '41', '42', '44',
+              '45', '46', '47', '48', '49', '50', '51', '53', '54', '55',
+              '56']
+
+LAUNCH_YEAR = 2024
+FINAL_YEAR = 2098
+US_POPULATION = 340_000_000
+NET_IMMIGRATION = 1_100_000  # national net immigrants per year
+
+# file names used by each model, keyed by age schema
+FILE_NAMES = {'single': {'mortality': os.path.join('databases', 'mortality_2019_2023_county.csv'),
+                         'mortality_multipliers': os.path.join('databases', 'cbo_mortality_p1v1.csv'),
+                         'fertility': os.path.join('databases', 'fertility_2020_2024_county.csv'),
+                         'fertility_multipliers': os.path.join('databases', 'cbo_fertility_p1v1.csv'),
+                         'immigration_weights': os.path.join('databases', 'acs_immigration_age_sex_fractions_2011_2015.csv'),
+                         'immigration': os.path.join('databases', 'cbo_national_net_migration_by_year_age_sex.csv'),
+                         'migration': os.path.join('databases', 'acs_gross_migration_age_sex_fractions_2011_2015.csv'),
+                         'launch_population': os.path.join('databases', 'launch_population_2024.csv')},
+              'group': {'mortality': os.path.join('processed_files', 'mortality', 'state_adjusted_cdc_mortality_2023_p1v0.csv'),
+                        'mortality_multipliers': os.path.join('processed_files', 'mortality', 'cbo_mortality_p1v0.csv'),
+                        'fertility': os.path.join('processed_files', 'fertility', 'state_adjusted_cdc_fertility_2024_p1v0.csv'),
+                        'fertility_multipliers': os.path.join('processed_files', 'fertility', 'national_cbo_fertility_p1v0.csv'),
+                        'immigration_weights': os.path.join('processed_files', 'immigration', 'state_acs_immigration_age_sex_fractions_2011_2015.csv'),
+                        'immigration': os.path.join('processed_files', 'immigration', 'national_cbo_net_migration_by_year_age_sex.csv'),
+                        'migration': os.path.join('processed_files', 'migration', 'state_adjusted_acs_gross_migration_age_sex_fractions_2011_2015.csv'),
+                        'launch_population': os.path.join('processed_files', 'launch_population_2024.csv')}}
+
+
+def age_schema(ages):
+    '''
+    Return the age column name, age labels and the representative single
+    year of age for each label.
+    '''
+    if ages == 'single':
+        labels = list(range(86))
+        return 'AGE', labels, np.array(labels, dtype=float)
+    elif ages == 'group':
+        midpoints = np.array([float(label[:-1]) + 2.0 if label.endswith('+') else
+                              np.mean([float(a) for a in label.split('-')]) for label in AGE_GROUPS])
+        return 'AGE_GROUP', AGE_GROUPS, midpoints
+    else:
+        raise ValueError(f"Unknown age schema: {ages}")
+
+
+def make_geoids(n_geo):
+    '''
+    Create state (2-digit), county (5-digit) or tract (11-digit) style
+    GEOIDs, spread across the real state FIPS codes.
+    '''
+    if n_geo <= len(STATE_FIPS):
+        return STATE_FIPS[:n_geo]
+
+    width = 3 if n_geo <= 10_000 else 9
+    states = np.array(STATE_FIPS)[np.arange(n_geo) % len(STATE_FIPS)]
+    local = np.arange(n_geo) // len(STATE_FIPS) + 1
+
+    return sorted(f'{state}{number:0{width}d}' for state, number in zip(states, local))
+
+
+def age_structure(age_values):
+    '''
+    Share of the population at each age label (roughly the current U.S.
+    pyramid: flat to the mid-60s, then declining).
+    '''
+    width = np.diff(np.append(age_values, age_values[-1] + 15.0))
+    width[width < 1.0] = 1.0
+    density = np.where(age_values < 65, 1.0, np.exp(-(age_values - 65) / 12.0))
+
+    return density * width / (density * width).sum()
+
+
+def mortality_schedule(age_values):
+    '''
+    Deaths per 100,000 by age (Gompertz with an infant term).
+    '''
+    return 8.0 * np.exp(0.085 * age_values) + 550.0 * np.exp(-3.0 * age_values) + 15.0
+
+
+def fertility_schedule(age_values):
+    '''
+    Births per 1,000 women by age.
+    '''
+    return 105.0 * np.exp(-0.5 * ((age_values - 29.0) / 6.0) ** 2)
+
+
+def migration_schedule(age_values):
+    '''
+    Relative propensity to migrate by age, peaking in the late 20s.
+    '''
+    return 0.5 + 2.0 * np.exp(-0.5 * ((age_values - 26.0) / 6.0) ** 2) + 0.3 * np.exp(-0.5 * ((age_values - 67.0) / 4.0) ** 2)
+
+
+def write_frame(df, folder, file_name):
+    path = os.path.join(folder, file_name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    df.write_csv(path)
+
+    return path
+
+
+def make_launch_population(geoids, age_col, labels, age_values, rng):
+    '''
+    Lognormal geography sizes scaled to the U.S. total.
+    '''
+    sizes = rng.lognormal(mean=0.0, sigma=1.2, size=len(geoids))
+    sizes = sizes / sizes.sum() * US_POPULATION
+    shares = age_structure(age_values)
+    noise = rng.lognormal(mean=0.0, sigma=0.15, size=(len(geoids), len(labels), len(SEXES)))
+
+    pop = np.round(sizes[:, None, None] * shares[None, :, None] * 0.5 * noise)
+    df = pl.DataFrame({'GEOID': np.repeat(geoids, len(labels) * len(SEXES)),
+                       age_col: np.tile(np.repeat(labels, len(SEXES)), len(geoids)),
+                       'SEX': np.tile(SEXES, len(geoids) * len(labels)),
+                       'POPULATION': pop.ravel()})
+
+    return df, sizes
+
+
+def make_mortality(geoids, age_col, labels, age_values, years, rng):
+    geo_mult = rng.lognormal(mean=0.0, sigma=0.12, size=len(geoids))
+    sex_mult = np.array([1.0, 1.4])
+    rates = (geo_mult[:, None, None] * mortality_schedule(age_values)[None, :, None] * sex_mult[None, None, :])
+
+    base = pl.DataFrame({'GEOID': np.repeat(geoids, len(labels) * len(SEXES)),
+                         age_col: np.tile(np.repeat(labels, len(SEXES)), len(geoids)),
+                         'SEX': np.tile(SEXES, len(geoids) * len(labels)),
+                         'MORTALITY_RATE_100K': rates.ravel()})
+
+    # CBO-style multipliers: about 1% improvement per year
+    multipliers = pl.DataFrame({age_col: np.repeat(labels, len(SEXES)),
+                                'SEX': np.tile(SEXES, len(labels))})
+    multipliers = multipliers.with_columns([pl.lit(0.99 ** (year - LAUNCH_YEAR)).alias(f'ASMR_{year}') for year in years])
+
+    return base, multipliers
+
+
+def make_fertility(geoids, age_col, labels, age_values, years, rng):
+    fertile = [label for label, age in zip(labels, age_values) if 15 <= age < 45]
+    fertile_values = np.array([age for age in age_values if 15 <= age < 45])
+    geo_mult = rng.lognormal(mean=0.0, sigma=0.1, size=len(geoids))
+    rates = geo_mult[:, None] * fertility_schedule(fertile_values)[None, :]
+
+    base = pl.DataFrame({'GEOID': np.repeat(geoids, len(fertile)),
+                         age_col: np.tile(fertile, len(geoids)),
+                         'FERTILITY': rates.ravel()})
+
+    multipliers = pl.DataFrame({age_col: labels if age_col == 'AGE' else [label for label in labels if label in fertile + ['45-49']]})
+    multipliers = multipliers.with_columns([pl.lit(0.998 ** (year - LAUNCH_YEAR)).alias(f'ASFR_{year}') for year in years])
+
+    return base, multipliers
+
+
+def make_immigration(geoids, age_col, labels, age_values, sizes, ages, rng):
+    # weights: share of each national age-sex cohort going to each geography
+    attract = sizes ** 1.1 * rng.lognormal(mean=0.0, sigma=0.5, size=len(geoids))
+    weights = attract[:, None, None] * rng.lognormal(mean=0.0, sigma=0.2, size=(len(geoids), len(labels), len(SEXES)))
+    weights = weights / weights.sum(axis=0, keepdims=True)
+
+    df_weights = pl.DataFrame({'GEOID': np.repeat(geoids, len(labels) * len(SEXES)),
+                               age_col: np.tile(np.repeat(labels, len(SEXES)), len(geoids)),
+                               'SEX': np.tile(SEXES, len(geoids) * len(labels)),
+                               'PERCENT_OF_AGE_SEX_COHORT': weights.ravel()})
+
+    # national net immigrants by year, age and sex
+    profile = migration_schedule(age_values) * age_structure(age_values)
+    profile = profile / profile.sum()
+    years = list(range(LAUNCH_YEAR + 1, FINAL_YEAR + 1))
+    national = np.round(NET_IMMIGRATION * 0.5 * profile[None, :, None] * np.ones((len(years), 1, len(SEXES))))
+
+    df_national = pl.DataFrame({'YEAR': np.repeat(years, len(labels) * len(SEXES)),
+                                age_col: np.tile(np.repeat(labels, len(SEXES)), len(years)),
+                                'SEX': np.tile(SEXES, len(years) * len(labels)),
+                                'NET_IMMIGRATION': national.ravel().astype(np.int64)})
+    if ages == 'group':
+        # five-year time steps, labelled like national_cbo_net_migration_by_year_age_sex.csv
+        df_national = df_national.with_columns((((pl.col('YEAR') - 2025) // 5) * 5 + 2025).alias('_START'))
+        df_national = (df_national.with_columns((pl.col('_START').cast(pl.String) + '-' + (pl.col('_START') + 4).cast(pl.String))
+                                                .alias('TIME_STEP'))
+                                  .select(['TIME_STEP', age_col, 'SEX', 'NET_IMMIGRATION']))
+
+    return df_weights, df_national
+
+
+def migration_destinations(n_geo, origin, mean_destinations, rng):
+    '''
+    Pick destinations for one origin: mostly nearby geographies (in GEOID
+    order) with a heavy-tailed distance, plus a few long-distance moves.
+    '''
+    if n_geo - 1 <= mean_destinations:
+        dest = np.arange(n_geo)
+        return dest[dest != origin]
+
+    k = int(np.clip(rng.lognormal(mean=np.log(mean_destinations), sigma=0.8), 1, n_geo - 1))
+    offsets = np.round(rng.standard_cauchy(size=2 * k) * max(k / 4.0, 1.0)).astype(np.int64)
+    offsets = offsets[offsets != 0]
+    far = rng.integers(0, n_geo, size=max(k // 10, 1))
+    dest = np.unique(np.concatenate([(origin + offsets) % n_geo, far]))
+    dest = dest[dest != origin]
+
+    return dest[:k] if dest.size > k else dest
+
+
+def write_migration(path, geoids, age_col, labels, age_values, mean_destinations,
+                    out_rate, rng, chunk_size=2_000):
+    '''
+    Stream the origin-destination table to CSV in origin chunks so that
+    tract-scale tables never have to fit in memory.
+    '''
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    n_geo = len(geoids)
+    geoids = np.array(geoids)
+    cohort_profile = (migration_schedule(age_values)[:, None] * np.array([1.0, 1.05])[None, :]).ravel()
+    cohort_ages = np.repeat(labels, len(SEXES))
+    cohort_sexes = np.tile(SEXES, len(labels))
+    n_rows = 0
+
+    with open(path, 'w') as f:
+        f.write(f'ORIGIN_FIPS,DESTINATION_FIPS,{age_col},SEX,MIGRATION_RATE\n')
+        for start in range(0, n_geo, chunk_size):
+            origins, destinations, rates = [], [], []
+            for origin in range(start, min(start + chunk_size, n_geo)):
+                dest = migration_destinations(n_geo, origin, mean_destinations, rng)
+                share = rng.lognormal(mean=0.0, sigma=1.5, size=dest.size)
+                share = share / share.sum()
+                total = out_rate * rng.lognormal(mean=0.0, sigma=0.3)
+                origins.append(np.full(dest.size, origin))
+                destinations.append(dest)
+                rates.append(total * share)
+
+            origins = np.concatenate(origins)
+            destinations = np.concatenate(destinations)
+            pair_rates = np.concatenate(rates)
+            n_cohorts = cohort_profile.size
+
+            df = pl.DataFrame({'ORIGIN_FIPS': np.repeat(geoids[origins], n_cohorts),
+                               'DESTINATION_FIPS': np.repeat(geoids[destinations], n_cohorts),
+                               age_col: np.tile(cohort_ages, origins.size),
+                               'SEX': np.tile(cohort_sexes, origins.size),
+                               'MIGRATION_RATE': (pair_rates[:, None] * cohort_profile[None, :]).ravel()})
+            df.write_csv(f, include_header=False)
+            n_rows += df.height
+
+    return n_rows
+
+
+def main(n_geo, ages='single', folder=None, seed=0, mean_destinations=None, out_rate=0.03):
+    '''
+    Write a complete set of synthetic inputs.
+
+    Parameters:
+        n_geo (int): number of geographies (51 states, ~3,100 counties,
+            ~85,000 tracts, or anything else).
+        ages (str): 'single' or 'group' age schema.
+        folder (str): output folder; defaults to
+            inputs/synthetic/{n_geo}_{ages}.
+        seed (int): random seed, so benchmark inputs are reproducible.
+        mean_destinations (int): typical number of destinations per origin
+            in the O-D table. Defaults to ~all other states at state scale
+            and ~30 at county and tract scale, which matches the sparsity of
+            the ACS county-to-county flows.
+        out_rate (float): average annual out-migration rate per origin.
+    '''
+    if folder is None:
+        folder = os.path.join(SYNTHETIC_FOLDER, f'{n_geo}_{ages}')
+    if mean_destinations is None:
+        mean_destinations = n_geo - 1 if n_geo <= len(STATE_FIPS) else 30
+
+    rng = np.random.default_rng(seed)
+    age_col, labels, age_values = age_schema(ages)
+    geoids = make_geoids(n_geo)
+    file_names = FILE_NAMES[ages]
+
+    years = list(range(LAUNCH_YEAR + 1, FINAL_YEAR + 1))
+
+    launch, sizes = make_launch_population(geoids, age_col, labels, age_values, rng)
+    write_frame(launch, folder, file_names['launch_population'])
+
+    base, multipliers = make_mortality(geoids, age_col, labels, age_values, years, rng)
+    write_frame(base, folder, file_names['mortality'])
+    write_frame(multipliers, folder, file_names['mortality_multipliers'])
+
+    base, multipliers = make_fertility(geoids, age_col, labels, age_values, years, rng)
+    write_frame(base, folder, file_names['fertility'])
+    write_frame(multipliers, folder, file_names['fertility_multipliers'])
+
+    weights, national = make_immigration(geoids, age_col, labels, age_values, sizes, ages, rng)
+    write_frame(weights, folder, file_names['immigration_weights'])
+    write_frame(national, folder, file_names['immigration'])
+
+    n_rows = write_migration(path=os.path.join(folder, file_names['migration']),
+                             geoids=geoids,
+                             age_col=age_col,
+                             labels=labels,
+                             age_values=age_values,
+                             mean_destinations=mean_destinations,
+                             out_rate=out_rate,
+                             rng=rng)
+
+    print(f"Wrote synthetic inputs for {n_geo:,} geographies ({ages} ages, {n_rows:,} O-D rows) to {folder}")
+
+    return folder
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write synthetic LORAX model inputs.')
+    parser.add_argument('--geographies', type=int, default=3100)
+    parser.add_argument('--ages', choices=['single', 'group'], default='single')
+    parser.add_argument('--folder', default=None)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--destinations', type=int, default=None)
+    args = parser.parse_args()
+
+    main(n_geo=args.geographies,
+         ages=args.ages,
+         folder=args.folder,
+         seed=args.seed,
+         mean_destinations=args.destinations)
@@ -0,0 +1,471 @@
+"""
+Author:  Phil Morefield
+Purpose: Run the input processing scripts as a dependency graph, rebuilding
+         only the steps whose inputs or code changed
+Created: October 19th, 2026
+
+Every script under inputs/scripts is a step in STEPS with the files it reads
+(inputs) and writes (outputs), as paths relative to the OneDrive folder
+(the state scripts work in lorax_p1v0, the county scripts in ICLUS_v3).
+A step depends on every step that writes one of its inputs, so e.g.
+state_migration_fractions runs after the state age and sex ratios.
+
+A step is current when its outputs exist and the SHA-256 of its script, its
+extra code files and its inputs match the last successful run (recorded in
+STATE_FILE; digests are cached by file size and modification time, so
+unchanged raw files are not re-read). run() checks a step once all of its
+upstream steps have finished, so a rerun that rewrites identical outputs
+does not cascade. Independent steps run in parallel processes (steps that
+share a lock, e.g. acs.sqlite, never run at the same time); every step's
+output goes to LOG_FOLDER and its time to TIMING_CSV.
+
+Raw downloads (Census/download_*) and the synthetic inputs are not steps.
+Some county inputs are still copied into inputs/databases by hand (e.g.
+acs_immigration_weights_age_2011_2015.csv from processed_files); those are
+declared as the files the scripts read, so a new copy reruns the step.
+
+Usage:
+    python run_input_scripts_p1v0.py status
+    python run_input_scripts_p1v0.py run --processes 4
+    python run_input_scripts_p1v0.py run --steps state_migration_fractions --force
+"""
+import argparse
+import glob
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import time
+
+import polars as pl
+
+
+# the state scripts use the lorax_p1v0 folder and the county scripts the
+# ICLUS_v3 folder (where the county model reads its inputs), so step paths
+# are relative to the folder that holds both
+ONEDRIVE_FOLDER = 'D:\\OneDrive'
+if os.path.isdir('C:\\Users\\philm\\OneDrive\\lorax_p1v0\\population'):
+    ONEDRIVE_FOLDER = 'C:\\Users\\philm\\OneDrive'
+BASE_FOLDER = os.path.join(ONEDRIVE_FOLDER, 'lorax_p1v0', 'population')
+PROCESSED_FILES = os.path.join(BASE_FOLDER, 'inputs', 'processed_files')
+STATE_FILE = os.path.join(PROCESSED_FILES, 'input_scripts_state.json')
+TIMING_CSV = os.path.join(PROCESSED_FILES, 'input_scripts_timing.csv')
+LOG_FOLDER = os.path.join(PROCESSED_FILES, 'logs')
+
+SCRIPTS_FOLDER = os.path.dirname(os.path.abspath(__file__))
+
+DEFAULT_PROCESSES = 4
+POLL_SECONDS = 0.5
+
+LORAX = 'lorax_p1v0/population/inputs'
+ICLUS = 'ICLUS_v3/population/inputs'
+ACS_AGE_XLSX = 'raw_files/ACS/2011_2015/migration/county-to-county-by-age-2011-2015-current-residence-sort.xlsx'
+ACS_SEX_XLSX = 'raw_files/ACS/2011_2015/migration/county-to-county-by-sex-2011-2015-current-residence-sort.xlsx'
+ACS_POPULATION_CSV = f'{LORAX}/raw_files/ACS/2011_2015/population/ACSDP5Y2015.DP05-Data.csv'
+CBO_CSV_FOLDER = f'{LORAX}/raw_files/CBO/57059-2025-09-Demographic-Projections/CSV files'
+CBO_XLSX = f'{LORAX}/raw_files/CBO/57059-2025-09-Demographic-Projections/57059-2025-09-Demographic-Projections.xlsx'
+CDC_FOLDER = f'{LORAX}/raw_files/CDC/age'
+CENSUS_SYASEX = f'{LORAX}/raw_files/Census/2024/intercensal/syasex/*.csv'
+CENSUS_ALLDATA = f'{LORAX}/raw_files/Census/2024/intercensal/co-est2024-alldata.csv'
+GEOGRAPHY_CSV = f'{LORAX}/fips_to_urb20_bea10_hhs.csv'
+MIGRATION_DB = f'{ICLUS}/databases/migration.sqlite'
+
+# script: path relative to SCRIPTS_FOLDER; code: other code the script
+# imports (relative to SCRIPTS_FOLDER); inputs and outputs: paths (or glob
+# patterns, inputs only) relative to ONEDRIVE_FOLDER, as the scripts build
+# them from their own BASE_FOLDER; locks: shared resources that only one
+# running step may hold
+STEPS = {'county_immigration_weights_age': {'script': 'ACS/immigration/county_process_acs_immigration_weights_age_p1v0.py',
+                                            'inputs': [f'{LORAX}/{ACS_AGE_XLSX}'],
+                                            'outputs': [f'{ICLUS}/databases/acs_immigration_replicates_2011_2015.npz',
+                                                        f'{LORAX}/processed_files/county_acs_immigration_weights_age_2011_2015.csv']},
+         'county_immigration_weights_sex': {'script': 'ACS/immigration/county_process_acs_immigration_weights_sex_p1v0.py',
+                                            'inputs': [f'{ICLUS}/{ACS_SEX_XLSX}'],
+                                            'outputs': [f'{ICLUS}/databases/acs_immigration_weights_sex_2011_2015.csv'],
+                                            'locks': ['acs.sqlite']},
+         'county_immigration_fractions': {'script': 'ACS/immigration/county_create_immigration_cohort_fractions_p1v0.py',
+                                          'inputs': [f'{ICLUS}/databases/acs_immigration_weights_sex_2011_2015.csv',
+                                                     f'{ICLUS}/databases/acs_immigration_weights_age_2011_2015.csv'],
+                                          'outputs': [f'{ICLUS}/databases/acs_immigration_age_sex_fractions_2011_2015.csv']},
+         'state_immigration_weights_age': {'script': 'ACS/immigration/state_process_acs_immigration_weights_age_p1v0.py',
+                                           'inputs': [f'{LORAX}/{ACS_AGE_XLSX}'],
+                                           'outputs': [f'{LORAX}/processed_files/immigration/state_acs_immigration_weights_age_2011_2015.csv']},
+         'state_immigration_weights_sex': {'script': 'ACS/immigration/state_process_acs_immigration_weights_sex_p1v0.py',
+                                           'inputs': [f'{LORAX}/{ACS_SEX_XLSX}'],
+                                           'outputs': [f'{LORAX}/processed_files/immigration/state_acs_immigration_weights_sex_2011_2015.csv']},
+         'state_immigration_fractions': {'script': 'ACS/immigration/state_create_immigration_cohort_fractions_p1v0.py',
+                                         'inputs': [f'{LORAX}/processed_files/immigration/state_acs_immigration_weights_sex_2011_2015.csv',
+                                                    f'{LORAX}/processed_files/immigration/state_acs_immigration_weights_age_2011_2015.csv',
+                                                    'lorax_p1v0/geospatial/state_2020.shp'],
+                                         'outputs': [f'{LORAX}/processed_files/immigration/state_acs_immigration_age_sex_fractions_2011_2015.csv']},
+         'county_migration_ratios_age': {'script': 'ACS/migration/county_create_acs_gross_migration_ratios_age_p1v0.py',
+                                         'inputs': [MIGRATION_DB, f'{ICLUS}/{ACS_AGE_XLSX}'],
+                                         'outputs': [f'{ICLUS}/databases/acs_gross_migration_replicates_2011_2015.npz',
+                                                     f'{ICLUS}/databases/acs_gross_migration_ratios_2011_2015_age.csv']},
+         'county_migration_ratios_sex': {'script': 'ACS/migration/county_create_acs_gross_migration_ratios_sex_p1v0.py',
+                                         'inputs': [MIGRATION_DB, f'{ICLUS}/{ACS_SEX_XLSX}'],
+                                         'outputs': [f'{ICLUS}/databases/acs_gross_migration_ratios_2011_2015_sex.csv'],
+                                         'locks': ['acs.sqlite']},
+         'county_migration_compress': {'script': 'ACS/migration/county_compress_acs_gross_migration_p1v0.py',
+                                       'code': ['../../models/lorax_engine_p1v0.py'],
+                                       'inputs': [f'{ICLUS}/databases/acs_gross_migration_age_sex_fractions_2011_2015.csv'],
+                                       'outputs': [f'{ICLUS}/databases/acs_gross_migration_compression_report.csv',
+                                                   f'{ICLUS}/databases/acs_gross_migration_age_sex_fractions_2011_2015_top50.csv']},
+         'state_migration_ratios_age': {'script': 'ACS/migration/state_create_acs_gross_migration_ratios_age_p1v0.py',
+                                        'inputs': [ACS_POPULATION_CSV, f'{LORAX}/{ACS_AGE_XLSX}'],
+                                        'outputs': [f'{LORAX}/processed_files/migration/state_acs_gross_migration_ratios_2011_2015_age.csv']},
+         'state_migration_ratios_sex': {'script': 'ACS/migration/state_create_acs_gross_migration_ratios_sex_p1v0.py',
+                                        'inputs': [f'{LORAX}/{ACS_SEX_XLSX}'],
+                                        'outputs': [f'{LORAX}/processed_files/migration/state_acs_gross_migration_ratios_2011_2015_sex.csv']},
+         'state_migration_fractions': {'script': 'ACS/migration/state_create_migration_cohort_fractions_p1v0.py',
+                                       'inputs': [f'{LORAX}/processed_files/migration/state_acs_gross_migration_ratios_2011_2015_sex.csv',
+                                                  f'{LORAX}/processed_files/migration/state_acs_gross_migration_ratios_2011_2015_age.csv',
+                                                  f'{LORAX}/raw_files/ACS/2018_2022/migration/state-to-county-migration-flows-acs-2018-2022.xlsx',
+                                                  ACS_POPULATION_CSV,
+                                                  f'{LORAX}/{ACS_AGE_XLSX}'],
+                                       'outputs': [f'{LORAX}/processed_files/migration/state_acs_gross_migration_age_sex_fractions_2011_2015.csv',
+                                                   f'{LORAX}/processed_files/migration/state_adjusted_acs_gross_migration_age_sex_fractions_2011_2015.csv']},
+         'cbo_fertility': {'script': 'CBO/fertility/process_fertility_projected_p1v0.py',
+                           'inputs': [f'{CBO_CSV_FOLDER}/fertilityRates_byYearAgePlace.csv', CBO_XLSX],
+                           'outputs': [f'{LORAX}/processed_files/fertility/national_cbo_fertility_p1v0.csv']},
+         'cbo_immigration': {'script': 'CBO/immigration/process_immigration_projected_p1v0.py',
+                             'inputs': [f'{CBO_CSV_FOLDER}/grossMigration_byYearAgeSexStatusFlow.csv'],
+                             'outputs': [f'{LORAX}/processed_files/immigration/national_cbo_net_migration_by_year_age_sex.csv']},
+         'cbo_migration_scaling': {'script': 'CBO/migration/process_migration_projected_p1v0.py',
+                                   'inputs': [f'{CBO_CSV_FOLDER}/grossMigration_byYearAgeSexStatusFlow.csv',
+                                              f'{CBO_CSV_FOLDER}/censusThrough2020+CBOProjection_byYearAgeSex.csv'],
+                                   'outputs': [f'{ICLUS}/databases/cbo_migration_scaling_p1v0.csv']},
+         'cbo_mortality': {'script': 'CBO/mortality/process_mortality_projected_p1v0.py',
+                           'inputs': [f'{CBO_CSV_FOLDER}/mortalityRates_byYearAgeSex.csv', CBO_XLSX],
+                           'outputs': [f'{LORAX}/processed_files/mortality/cbo_mortality_p1v0.csv']},
+         'county_fertility': {'script': 'CDC/fertility/process_fertility_2020_2024_p1v0.py',
+                              'inputs': [MIGRATION_DB, f'{ICLUS}/raw_files/CDC/age/Natality, 2020-2024, county.csv'],
+                              'outputs': [f'{ICLUS}/databases/fertility_2020_2024_county.csv']},
+         'state_fertility': {'script': 'CDC/fertility/state_process_fertility_2020_2024_p1v0.py',
+                             'inputs': [GEOGRAPHY_CSV, f'{CDC_FOLDER}/Natality, 2020-2024, state.csv'],
+                             'outputs': [f'{LORAX}/processed_files/fertility/state_cdc_fertility_2020_2024.csv']},
+         'state_fertility_adjusted': {'script': 'CDC/fertility/state_adjust_fertility_rates_p1v0.py',
+                                      'inputs': [GEOGRAPHY_CSV, f'{CDC_FOLDER}/Natality, 2024, State.csv', CBO_XLSX, CENSUS_SYASEX],
+                                      'outputs': [f'{LORAX}/processed_files/fertility/state_adjusted_cdc_fertility_2024_p1v0.csv']},
+         'state_mortality_2019_2023': {'script': 'CDC/mortality/process_mortality_2019_2023_p1v0.py',
+                                       'inputs': [GEOGRAPHY_CSV, f'{CDC_FOLDER}/Underlying*.csv'],
+                                       'outputs': [f'{LORAX}/processed_files/mortality/cdc_mortality_2019_2023_p1v0.csv']},
+         'state_mortality_2023': {'script': 'CDC/mortality/process_mortality_2023_p1v0.py',
+                                  'inputs': [GEOGRAPHY_CSV,
+                                             f'{CDC_FOLDER}/Underlying Cause of Death, 2023, State.csv',
+                                             f'{CDC_FOLDER}/Underlying Cause of Death, 2023, State, 85+.csv',
+                                             f'{CDC_FOLDER}/Underlying Cause of Death, 2023, HHS.csv',
+                                             f'{CDC_FOLDER}/Underlying Cause of Death, 2023, HHS, 85+.csv'],
+                                  'outputs': [f'{LORAX}/processed_files/mortality/state_cdc_mortality_2023_p1v0.csv']},
+         'state_mortality_adjusted': {'script': 'CDC/mortality/state_adjust_mortality_rates_p1v0.py',
+                                      'inputs': [f'{LORAX}/processed_files/mortality/state_cdc_mortality_2023_p1v0.csv',
+                                                 GEOGRAPHY_CSV, CENSUS_ALLDATA, CBO_XLSX, CENSUS_SYASEX],
+                                      'outputs': [f'{LORAX}/processed_files/mortality/state_adjusted_cdc_mortality_2023_p1v0.csv']}}
+
+
+class InputPipeline():
+    '''
+    The steps of STEPS as a dependency graph over the files under one
+    folder.
+
+    Parameters:
+        steps (dict): step name -> script, code, inputs, outputs and locks.
+        base_folder (str): folder the inputs and outputs are relative to.
+        scripts_folder (str): folder the scripts and code are relative to.
+        state_file (str): JSON record of file digests and successful runs.
+        timing_csv (str): step times, appended after every run.
+        log_folder (str): one log per step with the script's output.
+    '''
+    def __init__(self, steps=STEPS, base_folder=ONEDRIVE_FOLDER, scripts_folder=SCRIPTS_FOLDER, state_file=STATE_FILE,
+                 timing_csv=TIMING_CSV, log_folder=LOG_FOLDER):
+        self.steps = steps
+        self.base_folder = base_folder
+        self.scripts_folder = scripts_folder
+        self.state_file = state_file
+        self.timing_csv = timing_csv
+        self.log_folder = log_folder
+
+        # every output has one writer
+        self.writers = {}
+        for name, step in steps.items():
+            for output in step['outputs']:
+                assert output not in self.writers, f"{output} is written by {self.writers[output]} and {name}"
+                self.writers[output] = name
+        self.upstream = {name: sorted({self.writers[path] for path in step['inputs'] if path in self.writers} - {name})
+                         for name, step in steps.items()}
+        self.order = self.topological_order()
+
+        self.state = {'files': {}, 'steps': {}}
+        if os.path.isfile(state_file):
+            with open(state_file) as f:
+                self.state = json.load(f)
+
+    def topological_order(self):
+        '''
+        Step names with every step after its upstream steps (in STEPS order
+        otherwise).
+        '''
+        order, visiting = [], set()
+
+        def visit(name):
+            if name in order:
+                return
+            assert name not in visiting, f"Dependency cycle through {name}"
+            visiting.add(name)
+            for upstream in self.upstream[name]:
+                visit(upstream)
+            visiting.discard(name)
+            order.append(name)
+
+        for name in self.steps:
+            visit(name)
+
+        return order
+
+    def select(self, targets=None):
+        '''
+        The targets and every step upstream of them, in dependency order
+        (every step without targets).
+        '''
+        if targets is None:
+            return list(self.order)
+        unknown = set(targets) - set(self.steps)
+        assert not unknown, f"Unknown steps: {', '.join(sorted(unknown))}"
+
+        selected = set()
+        stack = list(targets)
+        while stack:
+            name = stack.pop()
+            if name not in selected:
+                selected.add(name)
+                stack.extend(self.upstream[name])
+
+        return [name for name in self.order if name in selected]
+
+    def path(self, relative, folder=None):
+        return os.path.normpath(os.path.join(folder or self.base_folder, *relative.split('/')))
+
+    def digest(self, path):
+        '''
+        SHA-256 of a file, reused while its size and modification time are
+        unchanged; None if it does not exist.
+        '''
+        if not os.path.isfile(path):
+            return None
+        stat = os.stat(path)
+        cached = self.state['files'].get(path)
+        if cached is not None and cached[:2] == [stat.st_size, stat.st_mtime_ns]:
+            return cached[2]
+
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        self.state['files'][path] = [stat.st_size, stat.st_mtime_ns, digest.hexdigest()]
+
+        return digest.hexdigest()
+
+    def input_files(self, name):
+        '''
+        The input files of a step, with glob patterns expanded; patterns
+        that match nothing are kept so they show up as missing.
+        '''
+        files = []
+        for relative in self.steps[name]['inputs']:
+            path = self.path(relative)
+            matches = sorted(glob.glob(path)) if glob.has_magic(path) else [path]
+            files.extend(matches or [path])
+
+        return files
+
+    def fingerprint(self, name):
+        '''
+        SHA-256 of a step's script, code and input digests, and the inputs
+        that are missing.
+        '''
+        step = self.steps[name]
+        code = [self.path(step['script'], self.scripts_folder)] + [self.path(path, self.scripts_folder)
+                                                                   for path in step.get('code', [])]
+        digests = {'code': {path: self.digest(path) for path in code},
+                   'inputs': {path: self.digest(path) for path in self.input_files(name)}}
+        missing = [path for group in digests.values() for path, digest in group.items() if digest is None]
+        content = json.dumps(digests, sort_keys=True)
+
+        return hashlib.sha256(content.encode('utf-8')).hexdigest(), missing
+
+    def is_current(self, name, fingerprint):
+        record = self.state['steps'].get(name)
+        outputs = all(os.path.isfile(self.path(path)) for path in self.steps[name]['outputs'])
+
+        return outputs and record is not None and record['fingerprint'] == fingerprint
+
+    def status(self, targets=None):
+        '''
+        Whether every selected step is current, stale (its inputs, code or
+        outputs changed, or an upstream step is stale) or missing inputs.
+        '''
+        status = {}
+        for name in self.select(targets):
+            fingerprint, missing = self.fingerprint(name)
+            # outputs of upstream steps are written when they run
+            produced = {self.path(output) for up in self.upstream[name] for output in self.steps[up]['outputs']}
+            if set(missing) - produced:
+                status[name] = 'missing inputs'
+            elif any(status[up] != 'current' for up in self.upstream[name]) or not self.is_current(name, fingerprint):
+                status[name] = 'stale'
+            else:
+                status[name] = 'current'
+        self.save_state()
+
+        record = self.state['steps']
+        return pl.DataFrame({'STEP': list(status),
+                             'STATUS': list(status.values()),
+                             'UPSTREAM': [', '.join(self.upstream[name]) for name in status],
+                             'LAST_RUN': [record.get(name, {}).get('finished') for name in status],
+                             'SECONDS': [record.get(name, {}).get('seconds') for name in status]},
+                            schema_overrides={'SECONDS': pl.Float64})
+
+    def start(self, name):
+        '''
+        Launch a step's script in its own process, with its output written
+        to the step's log.
+        '''
+        os.makedirs(self.log_folder, exist_ok=True)
+        script = self.path(self.steps[name]['script'], self.scripts_folder)
+        log = open(os.path.join(self.log_folder, f'{name}.log'), 'w')
+        process = subprocess.Popen([sys.executable, script],
+                                   cwd=os.path.dirname(script),
+                                   stdout=log,
+                                   stderr=subprocess.STDOUT)
+
+        return process, log
+
+    def run(self, targets=None, processes=DEFAULT_PROCESSES, force=False):
+        '''
+        Run every selected step that is not current, up to processes at a
+        time. A step is checked once all of its upstream steps have
+        finished; steps downstream of a failure are skipped.
+
+        Returns:
+            DataFrame: STEP, STATUS ('current', 'ran', 'failed', 'missing
+                inputs' or 'skipped'), STARTED and SECONDS of every step.
+        '''
+        selected = self.select(targets)
+        pending = list(selected)
+        running = {}
+        results = {}
+        run_start = time.perf_counter()
+        print(f"{time.ctime()} {len(selected)} steps, up to {processes} at a time")
+
+        while pending or running:
+            # check or launch every step whose upstream steps are done
+            for name in list(pending):
+                upstream = [results.get(up) for up in self.upstream[name] if up in selected]
+                if any(result is None for result in upstream):
+                    continue
+                if any(result['STATUS'] in ('failed', 'missing inputs', 'skipped') for result in upstream):
+                    pending.remove(name)
+                    results[name] = {'STATUS': 'skipped', 'STARTED': None, 'SECONDS': None}
+                    print(f"{time.ctime()} {name}: skipped (upstream step failed)")
+                    continue
+
+                fingerprint, missing = self.fingerprint(name)
+                if missing:
+                    pending.remove(name)
+                    results[name] = {'STATUS': 'missing inputs', 'STARTED': None, 'SECONDS': None}
+                    print(f"{time.ctime()} {name}: missing {', '.join(missing)}")
+                    continue
+                if not force and self.is_current(name, fingerprint):
+                    pending.remove(name)
+                    results[name] = {'STATUS': 'current', 'STARTED': None, 'SECONDS': None}
+                    continue
+
+                locks = set(self.steps[name].get('locks', []))
+                held = {lock for other in running for lock in self.steps[other].get('locks', [])}
+                if len(running) >= processes or locks & held:
+                    continue
+                pending.remove(name)
+                process, log = self.start(name)
+                running[name] = (process, log, fingerprint, time.strftime('%Y-%m-%d %H:%M:%S'), time.perf_counter())
+                print(f"{time.ctime()} {name}: started")
+
+            # collect finished steps
+            for name, (process, log, fingerprint, started, start) in list(running.items()):
+                if process.poll() is None:
+                    continue
+                log.close()
+                del running[name]
+                seconds = time.perf_counter() - start
+                unwritten = [path for path in self.steps[name]['outputs'] if not os.path.isfile(self.path(path))]
+                status = 'ran' if process.returncode == 0 and not unwritten else 'failed'
+                results[name] = {'STATUS': status, 'STARTED': started, 'SECONDS': seconds}
+                if status == 'ran':
+                    # digest the outputs now, while they are fresh in the page cache
+                    for path in self.steps[name]['outputs']:
+                        self.digest(self.path(path))
+                    self.state['steps'][name] = {'fingerprint': fingerprint, 'finished': time.strftime('%Y-%m-%d %H:%M:%S'),
+                                                 'seconds': round(seconds, 3)}
+                    print(f"{time.ctime()} {name}: finished in {seconds:.1f} seconds")
+                else:
+                    # a failed run may have rewritten some outputs
+                    self.state['steps'].pop(name, None)
+                    reason = f"exit code {process.returncode}" if process.returncode else f"did not write {', '.join(unwritten)}"
+                    print(f"{time.ctime()} {name}: FAILED ({reason}; see {os.path.join(self.log_folder, name + '.log')})")
+                self.save_state()
+
+            if running:
+                time.sleep(POLL_SECONDS)
+
+        self.save_state()
+        df = pl.DataFrame({'STEP': selected,
+                           'STATUS': [results[name]['STATUS'] for name in selected],
+                           'STARTED': [results[name]['STARTED'] for name in selected],
+                           'SECONDS': [results[name]['SECONDS'] for name in selected]},
+                          schema_overrides={'STARTED': pl.String, 'SECONDS': pl.Float64})
+        self.write_timing(df.filter(pl.col('STATUS').is_in(['ran', 'failed'])))
+
+        wall = time.perf_counter() - run_start
+        serial = df.get_column('SECONDS').fill_null(0.0).sum()
+        print(f"{time.ctime()} Finished {df.filter(pl.col('STATUS') == 'ran').height} steps in {wall:.1f} seconds "
+              f"({serial:.1f} seconds of step time; {df.filter(pl.col('STATUS') == 'current').height} steps current)")
+
+        return df
+
+    def save_state(self):
+        # written to a temporary file and moved, so an interrupted run never
+        # leaves a partial record
+        os.makedirs(os.path.dirname(self.state_file), exist_ok=True)
+        temp = self.state_file + '.tmp'
+        with open(temp, 'w') as f:
+            json.dump(self.state, f, indent=1, sort_keys=True)
+        os.replace(temp, self.state_file)
+
+    def write_timing(self, df):
+        if df.height == 0:
+            return
+        if os.path.isfile(self.timing_csv):
+            df = pl.concat([pl.read_csv(self.timing_csv, schema=df.schema), df])
+        df.write_csv(self.timing_csv)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the input processing scripts.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help='run every step that is not current')
+    run_parser.add_argument('--steps', nargs='*', default=None, help='only these steps and their upstream steps')
+    run_parser.add_argument('--processes', type=int, default=DEFAULT_PROCESSES)
+    run_parser.add_argument('--force', action='store_true', help='rerun the selected steps even if they are current')
+
+    status_parser = subparsers.add_parser('status', help='show which steps are current')
+    status_parser.add_argument('--steps', nargs='*', default=None)
+    args = parser.parse_args()
+
+    pipeline = InputPipeline()
+    if args.command == 'run':
+        df = pipeline.run(targets=args.steps, processes=args.processes, force=args.force)
+    else:
+        df = pipeline.status(targets=args.steps)
+    with pl.Config(tbl_rows=-1, tbl_cols=-1, tbl_width_chars=200):
+        print(df)
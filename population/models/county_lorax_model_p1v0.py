@@ -9,8 +9,16 @@ Created: November 10th, 2025
 import os
 import time
 
+import numpy as np
 import polars as pl
 
+from lorax_engine_p1v0 import (MAX_SCALED_OUT_RATE, OUTPUT_LEDGERS, SENSITIVITY_FAMILIES, AttributionCube, ChunkedMigrationOperator, CohortIndex,
+                               CompiledEngine, DenseEngine, GeographyIndex, InputBundle, LedgerStore, MigrationOperator, OutputPolicy,
+                               RateStore, ShardedEngine, build_chunked_migration_operator, build_immigration_tensor,
+                               build_migration_operator, build_migration_scaling, build_rate_store, build_replicate_immigration,
+                               build_replicate_migration_operator, elasticities, group_geoids, ledger_frames, plan_state_shards,
+                               precision_report, replicate_summary, rollup_results)
+
 
 BASE_FOLDER = 'D:\\OneDrive\\ICLUS_v3\\population'
 if os.path.isdir('C:\\Users\\philm\\OneDrive\\ICLUS_v3\\population'):
@@ -19,9 +27,52 @@ if os.path.isdir('C:\\Users\\philm\\OneDrive\\ICLUS_v3\\population'):
 INPUT_FOLDER = os.path.join(BASE_FOLDER, 'inputs')
 CENSUS_CSV_FOLDER = os.path.join(INPUT_FOLDER, 'raw_files', 'Census')
 DATABASE_FOLDER = os.path.join(INPUT_FOLDER, 'databases')
+# tract inputs use the same file names and layouts as the county databases
+TRACT_DATABASE_FOLDER = os.path.join(DATABASE_FOLDER, 'tract')
 OUTPUT_FOLDER = os.path.join(BASE_FOLDER, 'outputs', 'CBO')
 OUTPUT_DATABASE = os.path.join(OUTPUT_FOLDER, 'p1v1.sqlite')
 OUTPUT_DATABASE_URI = f'sqlite:{OUTPUT_DATABASE}'
+MIGRATION_CHUNK_FOLDER = os.path.join(OUTPUT_FOLDER, 'migration_chunks')
+GEOGRAPHY_CSV = os.path.join(INPUT_FOLDER, 'fips_to_urb20_bea10_hhs.csv')
+# O-D migration rates; the top-k table written by
+# county_compress_acs_gross_migration_p1v0.py (e.g. ..._2011_2015_top50.csv)
+# can be used in its place
+MIGRATION_CSV = 'acs_gross_migration_age_sex_fractions_2011_2015.csv'
+# county age-sex shares and CBO national totals of net immigration
+IMMIGRATION_CSV = 'acs_immigration_age_sex_fractions_2011_2015.csv'
+CBO_IMMIGRATION_CSV = 'cbo_national_net_migration_by_year_age_sex.csv'
+# year x age x sex factors of the migration rates, written by
+# process_migration_projected_p1v0.py; used with migration_scaling=True
+MIGRATION_SCALING_CSV = 'cbo_migration_scaling_p1v0.csv'
+# processed county inputs compiled by build_input_bundle(); opened with
+# Projector(bundle_folder=...)
+BUNDLE_FOLDER = os.path.join(INPUT_FOLDER, 'bundles', 'p1v1')
+
+AGES = list(range(86))  # single years of age, 85 is 85+
+FERTILE_AGES = list(range(15, 45))
+
+MALE_BIRTH_FRACTION = 0.512195122  # from Mathews, et al. (2005)
+
+GEOID_WIDTHS = {'county': 5, 'tract': 11}
+
+# tract mode: population-sized float64 arrays alive during a step (population,
+# remainders, rates, components, migration accumulators); whatever is left of
+# the memory budget goes to the migration chunks
+TRACT_STEP_ARRAYS = 16
+# tract mode: GEOIDs per batch when appending results to the output database
+TRACT_WRITE_GEOIDS = 5000
+
+# bootstrap replicates of the ACS migration and immigration inputs (written
+# by the ACS input scripts from the margins of error) and the quantiles
+# reported by run_replicates()
+MIGRATION_REPLICATES = 'acs_gross_migration_replicates_2011_2015.npz'
+IMMIGRATION_REPLICATES = 'acs_immigration_replicates_2011_2015.npz'
+REPLICATE_QUANTILES = (0.05, 0.5, 0.95)
+
+# output_rules of run_dense(): county detail in milestone years, state
+# totals in the other years
+MILESTONE_YEARS = list(range(2030, 2099, 10))
+MILESTONE_OUTPUT_RULES = {ledger: ('full', 'STATE') for ledger in OUTPUT_LEDGERS}
 
 
 def make_fips_changes(df):
@@ -43,7 +94,7 @@ def make_fips_changes(df):
         df = df.drop(['NEW_FIPS', 'NEW_NAME', 'NEW_STUSPS'])
         df = df.group_by(['GEOID', 'AGE', 'SEX']).agg(pl.col('POPULATION').sum())
     else:
-        Exception("DataFrame doesn't have required columns for FIPS changes")
+        raise Exception("DataFrame doesn't have required columns for FIPS changes")
 
     assert df.null_count().sum_horizontal()[0] == 0, "NaN values present after FIPS changes"
 
@@ -102,10 +153,23 @@ def get_cbo_population():
     return df
 
 
-def set_launch_population():
+def launch_population_sources():
     '''
-    2024 launch population is taken from U.S. Census Intercensal Population
-    Estimates.
+    Every file read by get_launch_population().
+    '''
+    census_sya_input_folder = os.path.join(INPUT_FOLDER, 'raw_files', 'Census', '2024', 'intercensal', 'syasex')
+    cbo_xlsx = os.path.join(BASE_FOLDER, 'inputs', 'raw_files', 'CBO', '57059-2025-09-Demographic-Projections',
+                            '57059-2025-09-Demographic-Projections.xlsx')
+
+    return ([os.path.join(census_sya_input_folder, csv) for csv in sorted(os.listdir(census_sya_input_folder)) if csv.endswith('.csv')] +
+            [os.path.join(INPUT_FOLDER, 'fips_or_name_changes.csv'), cbo_xlsx])
+
+
+def get_launch_population():
+    '''
+    2024 launch population (GEOID, AGE, SEX, POPULATION) from the U.S. Census
+    Intercensal Population Estimates, raked to the CBO national population
+    and not yet rounded.
     '''
     census_sya_input_folder = os.path.join(INPUT_FOLDER, 'raw_files', 'Census', '2024', 'intercensal', 'syasex')
 
@@ -128,21 +192,26 @@ def set_launch_population():
 
     df = df.sort(['GEOID', 'AGE', 'SEX'])
     df = make_fips_changes(df)
+    assert df.shape == (538016, 4)
 
-    # Group by age and sex, calculate percentages
-    df = df.with_columns((pl.col('POPULATION') / pl.col('POPULATION').sum().over(['AGE', 'SEX']) * 100)
-                           .alias('POPULATION') )
+    # rake every age and sex to the CBO national population, keeping each
+    # county's share
+    index = CohortIndex(geoids=df.get_column('GEOID').unique().sort().to_list(), ages=AGES, age_col='AGE')
+    cbo_2024_pop = get_cbo_population().with_columns(pl.lit('US').alias('GEOID'))
+    targets = index.with_geoids(['US']).to_array(cbo_2024_pop, 'POPULATION_CBO')
+    pop = GeographyIndex(index.geoids, {}).rake(index.to_array(df, 'POPULATION'), 'NATION', targets)
+    df = index.to_frame(pop, 'POPULATION')
     assert df.shape == (538016, 4)
 
-    cbo_2024_pop = get_cbo_population()
+    return df
 
-    df = df.join(other=cbo_2024_pop,
-                 on=['AGE', 'SEX'],
-                 how='left',
-                 coalesce=True)
-    assert df.shape == (538016, 5)
 
-    df = df.with_columns((pl.col('POPULATION_CBO') * (pl.col('POPULATION') / 100.0)).alias('POPULATION'))
+def set_launch_population():
+    '''
+    2024 launch population is taken from U.S. Census Intercensal Population
+    Estimates.
+    '''
+    df = get_launch_population()
 
     # calculate and save fractional population
     df = df.with_columns(pl.col('POPULATION').round().alias('POPULATION_ROUNDED'))
@@ -159,22 +228,127 @@ def set_launch_population():
     return df
 
 
-def main(scenario, version, fert_calibr_pct, mort_calibr_pct):
+def set_tract_launch_population(index):
+    '''
+    2024 tract launch population (GEOID, AGE, SEX, POPULATION), rounded to
+    whole persons.
+
+    Returns:
+        ndarray: rounded [GEOID, AGE, SEX] population on index.
+        ndarray: fractional remainders.
+    '''
+    df = pl.read_csv(source=os.path.join(TRACT_DATABASE_FOLDER, 'launch_population_2024.csv'),
+                     schema_overrides={'GEOID': pl.String})
+    df = df.with_columns(pl.col('GEOID').str.zfill(GEOID_WIDTHS['tract']))
+    pop = index.to_array(df, 'POPULATION')
+    rounded = np.round(pop)
+
+    return rounded, pop - rounded
+
+
+def build_input_bundle(folder=BUNDLE_FOLDER, version='p1v1', launch=True):
+    '''
+    Compile the processed county inputs into an InputBundle: the
+    uncalibrated mortality and fertility rates, the immigration tensor, the
+    O-D migration rates, the migration scaling factors (if
+    MIGRATION_SCALING_CSV exists) and, with launch, the rounded launch
+    population and its remainders. Calibrations are applied when a
+    Projector opens the bundle, so one bundle serves every scenario.
+    '''
+    start = time.perf_counter()
+    scaling = os.path.isfile(os.path.join(DATABASE_FOLDER, MIGRATION_SCALING_CSV))
+    model = Projector(scenario='CBO',
+                      version=version,
+                      fert_calibr=0.0,
+                      mort_calibr=0.0,
+                      migration_scaling=scaling)
+    index = model.rates.index
+    assert model.immigration_index.geoids == index.geoids, "Immigration and rates have different counties"
+
+    migration = model.build_migration_operator()
+    arrays = {'mortality': model.rates.mortality,
+              'fertility': model.rates.fertility,
+              'immigration': model.immigration_tensor,
+              'migration_origins': migration.origins,
+              'migration_destinations': migration.destinations,
+              'migration_rates': migration.rates}
+    if scaling:
+        arrays['migration_scaling'] = model.migration_scaling
+
+    sources = [os.path.join(DATABASE_FOLDER, csv) for csv in ('mortality_2019_2023_county.csv',
+                                                              'cbo_mortality_p1v1.csv',
+                                                              'fertility_2020_2024_county.csv',
+                                                              'cbo_fertility_p1v1.csv',
+                                                              IMMIGRATION_CSV,
+                                                              CBO_IMMIGRATION_CSV,
+                                                              MIGRATION_CSV)]
+    if scaling:
+        sources.append(os.path.join(DATABASE_FOLDER, MIGRATION_SCALING_CSV))
+
+    if launch:
+        launch_pop = index.to_array(get_launch_population(), 'POPULATION')
+        arrays['launch_population'] = np.round(launch_pop)
+        arrays['launch_remainder'] = launch_pop - arrays['launch_population']
+        sources += launch_population_sources()
+
+    bundle = InputBundle.write(folder=folder,
+                               arrays=arrays,
+                               indexes={'cohorts': index},
+                               keys={'rate_years': model.rates.years,
+                                     'immigration_years': model.immigration_years},
+                               sources=sources,
+                               params={'version': version,
+                                       'rates': model.rates.params,
+                                       'migration_scaling': scaling,
+                                       'launch': launch})
+
+    size = sum(os.path.getsize(os.path.join(folder, name)) for name in os.listdir(folder))
+    print(f"{time.ctime()} Wrote {len(arrays)} arrays ({size / 1e9:.2f} GB) to {folder} "
+          f"in {time.perf_counter() - start:.1f} seconds")
+
+    return bundle
+
+
+def main(scenario, version, fert_calibr_pct, mort_calibr_pct, geography='county'):
     '''
     TODO: Add docstring
     '''
     model = Projector(scenario=scenario,
                       version=version,
                       fert_calibr=fert_calibr_pct,
-                      mort_calibr=mort_calibr_pct)
-    model.run()
+                      mort_calibr=mort_calibr_pct,
+                      geography=geography)
+    if geography == 'tract':
+        model.run_tract()
+    else:
+        model.run()
 
 
 class Projector():
     '''
     TODO: Add docstring
     '''
-    def __init__(self, scenario, version, fert_calibr, mort_calibr):
+    def __init__(self, scenario, version, fert_calibr, mort_calibr, rate_folder=None, rate_dtype='float64',
+                 geography='county', memory_budget_gb=32.0, migration_scaling=False, bundle_folder=None):
+
+        # geography-related attributes; tract mode builds rates and
+        # immigration one year at a time and streams migration by origin
+        # chunk to stay within memory_budget_gb
+        assert geography in GEOID_WIDTHS, f"Unknown geography: {geography}"
+        self.geography = geography
+        self.geoid_width = GEOID_WIDTHS[geography]
+        self.memory_budget_gb = memory_budget_gb
+        self.tract_index = None
+        if self.geography == 'tract':
+            self.tract_index = self.build_tract_index()
+
+        # processed inputs compiled by build_input_bundle(); when given, the
+        # immigration, rates, migration and launch population are
+        # memory-mapped from it instead of being read from the CSVs
+        self.bundle = None
+        if bundle_folder is not None:
+            assert self.geography == 'county', "Input bundles are only built for counties"
+            self.bundle = InputBundle.open(bundle_folder)
 
         # time-related attributes
         self.launch_year = 2024
@@ -190,18 +364,34 @@ class Projector():
 
         # immigration-related attributes
         self.immigrants = None
+        self.immigration_index = None
+        self.immigration_years = None
+        self.immigration_tensor = None
+        self.build_immigration()
 
         # mortality-related attributes
         self.deaths = None
         self.mort_calibr = mort_calibr
 
-        # migration-related attributes
+        # migration-related attributes; with migration_scaling the ACS rates
+        # are rescaled every year by the CBO-derived factors
         self.net_migration = None
+        self.migration_multipliers = None
+        self.migration_scaling = None
+        if migration_scaling:
+            self.build_migration_scaling()
 
         # fertility-related attributes
         self.births = None
         self.fert_calibr_pct = fert_calibr
 
+        # mortality and fertility rates for every projection year; optionally
+        # saved to and memory-mapped from rate_folder
+        self.rate_folder = rate_folder
+        self.rate_dtype = rate_dtype
+        self.rates = None
+        self.build_rates()
+
 
     def run(self, final_projection_year=2098):
         '''
@@ -352,46 +542,558 @@ class Projector():
             del temp
 
 
-    def mortality(self):
+    @property
+    def database_folder(self):
+        return TRACT_DATABASE_FOLDER if self.geography == 'tract' else DATABASE_FOLDER
+
+    def build_tract_index(self):
         '''
-        Placeholder
+        Array layout for tract mode: every GEOID in the tract launch
+        population, single years of age and sex.
         '''
+        geoids = (pl.scan_csv(os.path.join(TRACT_DATABASE_FOLDER, 'launch_population_2024.csv'),
+                              schema_overrides={'GEOID': pl.String})
+                    .select(pl.col('GEOID').str.zfill(GEOID_WIDTHS['tract']))
+                    .unique()
+                    .collect(engine='streaming')
+                    .get_column('GEOID'))
 
-        print("Calculating mortality...", end='')
+        return CohortIndex(geoids=sorted(geoids.to_list()), ages=AGES, age_col='AGE')
 
-        # get CDC mortality rates by AGE, SEX, and COUNTY
-        mort_rates = os.path.join(DATABASE_FOLDER, 'mortality_2019_2023_county.csv')
-        county_mort_rates = (pl.read_csv(source=mort_rates)
-                             .with_columns(pl.col('GEOID').cast(pl.String).str.zfill(5).alias('GEOID')))
+    def build_migration_chunks(self):
+        '''
+        Partition the tract O-D migration rates by origin into memory-mapped
+        chunks (see build_chunked_migration_operator) sized to what is left
+        of the memory budget after the step arrays. The chunks are reused by
+        later runs with the same inputs and budget.
+        '''
+        index = self.rates.index
+        migration_csv = os.path.join(self.database_folder, MIGRATION_CSV)
 
-        df = self.current_pop.clone()
-        df = df.join(other=county_mort_rates,
-                        on=['GEOID', 'AGE', 'SEX'],
-                        how='left',
-                        coalesce=True)
+        budget = self.memory_budget_gb * 1024 ** 3 - TRACT_STEP_ARRAYS * index.size * 8
+        assert budget > 0, f"A {self.memory_budget_gb} GB memory budget is too small for {len(index.geoids):,} geographies"
 
-        assert sum(df.null_count()).item() == 0
+        folder = os.path.join(MIGRATION_CHUNK_FOLDER, self.geography)
+        params = {'geography': self.geography,
+                  'n_geoids': len(index.geoids),
+                  'memory_budget_gb': self.memory_budget_gb,
+                  'dtype': self.rate_dtype,
+                  'inputs': {os.path.basename(migration_csv): os.path.getmtime(migration_csv)}}
+        if ChunkedMigrationOperator.saved_params(folder) == params:
+            return ChunkedMigrationOperator.load(folder, mmap=True)
+
+        # we have migration rates to/from Puerto Rico, but not currently
+        # modeling migration involving PR
+        rates = pl.scan_csv(migration_csv, schema_overrides={'ORIGIN_FIPS': pl.String, 'DESTINATION_FIPS': pl.String})
+        rates = rates.with_columns([pl.col('ORIGIN_FIPS').str.zfill(self.geoid_width),
+                                    pl.col('DESTINATION_FIPS').str.zfill(self.geoid_width)])
+        rates = rates.filter(~pl.col('ORIGIN_FIPS').str.starts_with('7') & ~pl.col('DESTINATION_FIPS').str.starts_with('7'))
+
+        return build_chunked_migration_operator(index=index,
+                                                rates=rates,
+                                                folder=folder,
+                                                memory_budget=budget,
+                                                dtype=self.rate_dtype,
+                                                params=params)
+
+    def run_tract(self, final_projection_year=2098, ledger_folder=None):
+        '''
+        Tract mode: the same annual cohort-component steps as run(), on
+        dense arrays with origin-chunked migration, appending every year's
+        results to the output database instead of holding the time series
+        in memory. With ledger_folder, the years are written to a
+        memory-mapped LedgerStore there instead and exported to the
+        database (see export_tract_ledgers) when the run is done.
+        '''
+        assert self.geography == 'tract', "run_tract() needs a Projector with geography='tract'"
+
+        migration = self.build_migration_chunks()
+        print(f"Migration: {migration.n_pairs:,} origin-destination pairs in {len(migration.chunks)} chunks")
+
+        engine = DenseEngine(rates=self.rates,
+                             immigration=self.immigration_tensor,
+                             immigration_years=self.immigration_years,
+                             migration=migration,
+                             male_birth_fraction=MALE_BIRTH_FRACTION,
+                             remainder_mode='carry',
+                             migration_scaling=self.migration_scaling,
+                             migration_scaling_years=self.immigration_years)
+        launch_pop, launch_remainder = set_tract_launch_population(self.rates.index)
+
+        years = list(range(self.current_projection_year, final_projection_year + 1))
+        store = None
+        if ledger_folder is not None:
+            store = LedgerStore.create(ledger_folder, self.rates.index, years)
+
+        for year, pop, ledgers in engine.iterate(launch_pop, launch_remainder, years):
+            print(f"{time.ctime()} {year}: {int(pop.sum()):,} total population")
+            if store is None:
+                self.write_tract_year(year, pop, ledgers, first_year=(year == years[0]))
+            else:
+                store.write(year, {'population': pop, **ledgers})
+            self.current_projection_year = year + 1
+
+        if store is not None:
+            self.export_tract_ledgers(store)
+
+        self.current_pop = self.rates.index.to_frame(pop, 'POPULATION')
+
+    def build_migration_operator(self):
+        '''
+        County O-D migration rates as an in-memory MigrationOperator.
+        '''
+        if self.bundle is not None:
+            return MigrationOperator(index=self.rates.index,
+                                     origins=self.bundle['migration_origins'],
+                                     destinations=self.bundle['migration_destinations'],
+                                     rates=self.bundle['migration_rates'])
+
+        rates = pl.read_csv(os.path.join(DATABASE_FOLDER, MIGRATION_CSV),
+                            schema_overrides={'ORIGIN_FIPS': pl.String, 'DESTINATION_FIPS': pl.String})
+        rates = rates.with_columns([pl.col('ORIGIN_FIPS').str.zfill(5),
+                                    pl.col('DESTINATION_FIPS').str.zfill(5)])
+        # we have migration rates to/from Puerto Rico, but not currently
+        # modeling migration involving PR
+        rates = rates.filter(~pl.col('ORIGIN_FIPS').str.starts_with('7') & ~pl.col('DESTINATION_FIPS').str.starts_with('7'))
+
+        return build_migration_operator(index=self.rates.index, rates=rates)
+
+    def dense_launch_population(self):
+        '''
+        The rounded launch population and its remainders as arrays on the
+        rate index.
+        '''
+        if self.bundle is not None and 'launch_population' in self.bundle:
+            return self.bundle['launch_population'], self.bundle['launch_remainder']
+
+        index = self.rates.index
+        launch_pop = index.to_array(set_launch_population(), 'POPULATION')
+        query = f'SELECT * FROM population_by_age_sex_{self.scenario}_r'
+        launch_remainder = index.to_array(pl.read_database_uri(query=query, uri=OUTPUT_DATABASE_URI), 'POPULATION_REMAINDER')
+
+        return launch_pop, launch_remainder
 
+    def run_dense(self, final_projection_year=2098, processes=1, ledger_folder=None, attribution_by_age=False,
+                  rollup_levels=(), output_rules=None, milestone_years=MILESTONE_YEARS, compiled=False,
+                  dtype='float64'):
+        '''
+        Run the same annual steps as run() on dense arrays and write the
+        same output tables once at the end (exported from a memory-mapped
+        LedgerStore when ledger_folder is given).
+
+        The components of change of every county and year (by age with
+        attribution_by_age) are accumulated during the run and written to
+        components_of_change_{scenario}.parquet (see AttributionCube).
+
+        Every level in rollup_levels (e.g. 'STATE', 'HHS_REGION',
+        'BEA_AREA'; see GeographyIndex.from_crosswalk) also gets its own
+        {ledger}_by_age_sex_{scenario}_{level} tables, summed from the
+        county arrays.
+
+        output_rules limits what is kept and written to an OutputPolicy:
+        ledger -> (detail in milestone_years, detail in other years), where
+        a detail is 'full', a GeographyIndex level or None. For example
+        MILESTONE_OUTPUT_RULES keeps county detail every ten years and
+        state totals in between, and {} writes the components of change
+        only. Full-detail tables keep their usual names; level tables get
+        the level as a suffix, as with rollup_levels.
+
+        With processes > 1, the counties are partitioned by state into that
+        many shards of about equal population, each projected by its own
+        worker process; the shards only exchange their migrants every step
+        (see ShardedEngine). Otherwise compiled runs every step as fused
+        Numba kernels (see CompiledEngine).
+
+        dtype is the storage precision of the population and ledgers;
+        check 'float32' with run_precision_check() first.
+        '''
+        assert self.geography == 'county', "run_dense() is only available for counties"
+
+        index = self.rates.index
+        launch_pop, launch_remainder = self.dense_launch_population()
+
+        engine = DenseEngine(rates=self.rates,
+                             immigration=self.immigration_tensor,
+                             immigration_years=self.immigration_years,
+                             migration=self.build_migration_operator(),
+                             male_birth_fraction=MALE_BIRTH_FRACTION,
+                             remainder_mode='carry',
+                             migration_scaling=self.migration_scaling,
+                             migration_scaling_years=self.immigration_years,
+                             dtype=dtype)
+        if processes > 1:
+            shards = plan_state_shards(index.geoids, processes, weights=launch_pop.sum(axis=(-2, -1)))
+            print(f"Sharding {len(index.geoids):,} counties into {len(shards)} shards")
+            engine = ShardedEngine(engine, shards)
+        elif compiled:
+            engine = CompiledEngine(engine)
+
+        years = list(range(self.current_projection_year, final_projection_year + 1))
+        print(f"{time.ctime()}")
+        print(f"Total population (start): {int(launch_pop.sum()):,}\n")
+
+        store = None
+        if ledger_folder is not None:
+            store = LedgerStore.create(ledger_folder, index, years, dtype=dtype)
+        policy = None
+        if output_rules is not None:
+            assert store is None and not rollup_levels, "output_rules replace ledger_folder and rollup_levels"
+            policy = OutputPolicy(rules=output_rules,
+                                  milestone_years=milestone_years,
+                                  geography=GeographyIndex.from_crosswalk(index.geoids, GEOGRAPHY_CSV))
+        cube = AttributionCube(index, by_age=attribution_by_age)
+        results = engine.run(launch_pop=launch_pop,
+                             launch_remainder=launch_remainder,
+                             years=years,
+                             store=store,
+                             cube=cube,
+                             policy=policy)
+        cube.write(os.path.join(OUTPUT_FOLDER, f'components_of_change_{self.scenario}.parquet'))
+
+        if policy is not None:
+            batches = []
+            for (name, detail), df in results.frames().items():
+                suffix = '' if detail == 'full' else f'_{detail.lower()}'
+                df.sort(by=[col for col in ('GEOID', 'SEX', 'AGE') if col in df.columns]).write_database(
+                    table_name=f'{name}_by_age_sex_{self.scenario}{suffix}',
+                    connection=OUTPUT_DATABASE_URI,
+                    if_table_exists='replace',
+                    engine='adbc')
+            final_pop = results.final_population
+        elif store is None:
+            batches = [engine.ledger_frames(results, years)]
+            final_pop = results['population'][-1]
+        else:
+            batches = store.frame_batches(TRACT_WRITE_GEOIDS)
+            final_pop = store.array('population')[-1]
+
+        for i, frames in enumerate(batches):
+            for name, df in frames.items():
+                df.sort(by=[col for col in ('GEOID', 'SEX', 'AGE') if col in df.columns]).write_database(
+                    table_name=f'{name}_by_age_sex_{self.scenario}',
+                    connection=OUTPUT_DATABASE_URI,
+                    if_table_exists='replace' if i == 0 else 'append',
+                    engine='adbc')
+
+        if rollup_levels:
+            geography = GeographyIndex.from_crosswalk(index.geoids, GEOGRAPHY_CSV)
+            for level in rollup_levels:
+                if store is None:
+                    rolled = rollup_results(geography, level, results)
+                else:
+                    # one year at a time, so only one year of every ledger is paged in
+                    arrays = {name: store.array(name) for name in store.shapes}
+                    per_year = [rollup_results(geography, level, {name: arr[t] for name, arr in arrays.items()})
+                                for t in range(len(years))]
+                    rolled = {name: np.stack([arrs[name] for arrs in per_year]) for name in arrays}
+                frames = ledger_frames(geography.parent_index(index, level), rolled, years)
+                for name, df in frames.items():
+                    df.sort(by=[col for col in ('GEOID', 'SEX', 'AGE') if col in df.columns]).write_database(
+                        table_name=f'{name}_by_age_sex_{self.scenario}_{level.lower()}',
+                        connection=OUTPUT_DATABASE_URI,
+                        if_table_exists='replace',
+                        engine='adbc')
+
+        self.current_pop = index.to_frame(final_pop, 'POPULATION')
+        self.current_projection_year = years[-1] + 1
+
+        print(f"{time.ctime()}")
+        print(f"Total population (end): {int(final_pop.sum()):,}\n")
+
+    def run_replicates(self, final_projection_year=2098, n_replicates=None, replicate_batch=8,
+                       quantiles=REPLICATE_QUANTILES, compiled=False):
+        '''
+        Migration-driven uncertainty: project every bootstrap replicate of
+        the ACS migration rates and immigration weights in one vectorized
+        run, with a leading REPLICATE axis on the population, instead of
+        one run per replicate. Mortality, fertility and the national
+        immigration totals are the same in every replicate.
+
+        Every year, the mean, standard deviation and quantiles across
+        replicates of the population and net domestic migration are
+        appended to the {ledger}_replicates_by_age_sex_{scenario} tables.
+        With compiled, the replicate steps run as fused Numba kernels (see
+        CompiledEngine).
+        '''
+        assert self.geography == 'county', "run_replicates() is only available for counties"
+
+        index = self.rates.index
+        migration = build_replicate_migration_operator(base=self.build_migration_operator(),
+                                                       replicates=np.load(os.path.join(DATABASE_FOLDER, MIGRATION_REPLICATES)),
+                                                       n_replicates=n_replicates,
+                                                       replicate_batch=replicate_batch)
+        # the replicates need the weights and totals kept apart; the
+        # Projector's own (dense) tensor is left as it is
+        immigration_years, immigration_index, lazy_immigration = self.read_immigration(lazy=True)
+        immigration = build_replicate_immigration(index=immigration_index,
+                                                  immigration=lazy_immigration,
+                                                  replicates=np.load(os.path.join(DATABASE_FOLDER, IMMIGRATION_REPLICATES)),
+                                                  n_replicates=n_replicates)
+        print(f"Replicates: {migration.n_replicates} ({migration.n_pairs:,} origin-destination pairs)")
+
+        engine = DenseEngine(rates=self.rates,
+                             immigration=immigration,
+                             immigration_years=immigration_years,
+                             migration=migration,
+                             male_birth_fraction=MALE_BIRTH_FRACTION,
+                             remainder_mode='carry',
+                             migration_scaling=self.migration_scaling,
+                             migration_scaling_years=immigration_years)
+        if compiled:
+            engine = CompiledEngine(engine)
+
+        launch_pop, launch_remainder = self.dense_launch_population()
+        launch_pop = np.broadcast_to(launch_pop, (migration.n_replicates,) + index.shape)
+
+        years = list(range(self.current_projection_year, final_projection_year + 1))
+        for year, pop, ledgers in engine.iterate(launch_pop, launch_remainder, years):
+            totals = pop.sum(axis=(1, 2, 3))
+            print(f"{time.ctime()} {year}: {int(totals.mean()):,} mean total population "
+                  f"({int(totals.min()):,} - {int(totals.max()):,})")
+
+            mode = 'replace' if year == years[0] else 'append'
+            tables = {'population': pop, 'migration': ledgers['inmig'] - ledgers['outmig']}
+            for name, arr in tables.items():
+                df = replicate_summary(index, arr, quantiles).with_columns(pl.lit(year).alias('YEAR'))
+                df.write_database(table_name=f'{name}_replicates_by_age_sex_{self.scenario}',
+                                  connection=OUTPUT_DATABASE_URI,
+                                  if_table_exists=mode,
+                                  engine='adbc')
+            self.current_projection_year = year + 1
+
+    def run_sensitivity(self, final_projection_year=2050, families=SENSITIVITY_FAMILIES, scope_width=2,
+                        output_width=2, report_years=None, batch=8):
+        '''
+        Elasticities of total population by state (output_width=2) or county
+        (output_width=5) with respect to the fertility, mortality,
+        immigration and migration rates of every state (scope_width=2) or
+        county (scope_width=5), or of the whole country (scope_width=0), in
+        one forward-mode pass per batch of directions (see elasticities).
+        Written to elasticities_{scenario}.csv; defaults to the final year.
+        '''
+        assert self.geography == 'county', "run_sensitivity() is only available for counties"
+
+        index = self.rates.index
+        engine = DenseEngine(rates=self.rates,
+                             immigration=self.immigration_tensor,
+                             immigration_years=self.immigration_years,
+                             migration=self.build_migration_operator(),
+                             male_birth_fraction=MALE_BIRTH_FRACTION,
+                             remainder_mode='carry',
+                             migration_scaling=self.migration_scaling,
+                             migration_scaling_years=self.immigration_years)
+        launch_pop, launch_remainder = self.dense_launch_population()
+
+        years = list(range(self.current_projection_year, final_projection_year + 1))
+        print(f"{time.ctime()}")
+        report = elasticities(engine=engine,
+                              launch_pop=launch_pop + launch_remainder,
+                              years=years,
+                              families=families,
+                              scopes=group_geoids(index.geoids, scope_width) if scope_width else None,
+                              outputs=group_geoids(index.geoids, output_width),
+                              report_years=report_years or [years[-1]],
+                              batch=batch)
+        report.write_csv(os.path.join(OUTPUT_FOLDER, f'elasticities_{self.scenario}.csv'))
+        print(f"{time.ctime()}")
+
+        return report
+
+    def run_precision_check(self, final_projection_year=2098, dtype='float32'):
+        '''
+        Project the scenario twice, side by side: once in float64 and once
+        with the rates, migration rates, population and ledgers stored as
+        dtype. The errors of the dtype run by year and ledger (see
+        precision_report) are written to precision_{dtype}_{scenario}.csv
+        and the worst of them printed.
+        '''
+        assert self.geography == 'county', "run_precision_check() is only available for counties"
+
+        migration = self.build_migration_operator()
+        launch_pop, launch_remainder = self.dense_launch_population()
+
+        engines = []
+        for precision in ('float64', dtype):
+            engines.append(DenseEngine(rates=self.rates.astype(precision),
+                                       immigration=self.immigration_tensor,
+                                       immigration_years=self.immigration_years,
+                                       migration=MigrationOperator(index=migration.index,
+                                                                   origins=migration.origins,
+                                                                   destinations=migration.destinations,
+                                                                   rates=migration.rates.astype(precision)),
+                                       male_birth_fraction=MALE_BIRTH_FRACTION,
+                                       remainder_mode='carry',
+                                       migration_scaling=self.migration_scaling,
+                                       migration_scaling_years=self.immigration_years,
+                                       dtype=precision))
+
+        years = list(range(self.current_projection_year, final_projection_year + 1))
+        print(f"{time.ctime()}")
+        report = precision_report(reference=engines[0],
+                                  candidate=engines[1],
+                                  launch_pop=launch_pop,
+                                  launch_remainder=launch_remainder,
+                                  years=years)
+        report.write_csv(os.path.join(OUTPUT_FOLDER, f'precision_{dtype}_{self.scenario}.csv'))
+
+        worst = (report.group_by('LEDGER', maintain_order=True)
+                       .agg([pl.col('REL_TOTAL').max(),
+                             pl.col('REL_L1').max(),
+                             pl.col('MAX_ABS_CELL').max(),
+                             pl.col('MAX_REL_GEOID').max(),
+                             (pl.col('CANDIDATE_MB').sum() / pl.col('REFERENCE_MB').sum()).alias('MEMORY_RATIO')]))
+        with pl.Config(tbl_cols=-1, tbl_width_chars=200):
+            print(worst)
+        seconds = report.unique('YEAR').select(pl.col('REFERENCE_SECONDS').sum(), pl.col('CANDIDATE_SECONDS').sum())
+        print(f"float64: {seconds.item(0, 0):.1f} seconds, {dtype}: {seconds.item(0, 1):.1f} seconds")
+        print(f"{time.ctime()}")
+
+        return report
+
+    def export_tract_ledgers(self, store):
+        '''
+        Append every year in a LedgerStore to the tract output tables,
+        reading one year's slices at a time.
+        '''
+        names = ('deaths', 'immigration', 'inmig', 'outmig', 'births')
+        arrays = {name: store.array(name) for name in ('population',) + names}
+        for i, year in enumerate(store.written_years):
+            t = store.years.index(year)
+            self.write_tract_year(year,
+                                  arrays['population'][t],
+                                  {name: arrays[name][t] for name in names},
+                                  first_year=(i == 0))
+
+    def write_tract_year(self, year, pop, ledgers, first_year):
+        '''
+        Append one year of tract results to the output database as long
+        tables with a YEAR column, in batches of TRACT_WRITE_GEOIDS.
+        '''
+        index = self.rates.index
+        tables = {'population': {'POPULATION': pop},
+                  'deaths': {'DEATHS': ledgers['deaths']},
+                  'immigration': {'NET_IMMIGRATION': ledgers['immigration']},
+                  'migration': {'INFLOWS': ledgers['inmig'],
+                                'OUTFLOWS': ledgers['outmig'],
+                                'NET_MIGRATION': ledgers['inmig'] - ledgers['outmig']}}
+
+        for start in range(0, len(index.geoids), TRACT_WRITE_GEOIDS):
+            stop = start + TRACT_WRITE_GEOIDS
+            batch = index.with_geoids(index.geoids[start:stop])
+            mode = 'replace' if first_year and start == 0 else 'append'
+
+            for name, columns in tables.items():
+                df = batch.key_frame().with_columns([pl.lit(year).alias('YEAR')] +
+                                                    [pl.Series(col, arr[start:stop].ravel()) for col, arr in columns.items()])
+                df.write_database(table_name=f'{name}_by_age_sex_{self.scenario}_tract',
+                                  connection=OUTPUT_DATABASE_URI,
+                                  if_table_exists=mode,
+                                  engine='adbc')
+
+            births = pl.DataFrame({'GEOID': np.repeat(batch.geoids, len(index.sexes)),
+                                   'SEX': np.tile(index.sexes, len(batch.geoids)),
+                                   'AGE': 0,
+                                   'YEAR': year,
+                                   'BIRTHS': ledgers['births'][start:stop].ravel()})
+            births.write_database(table_name=f'births_by_age_sex_{self.scenario}_tract',
+                                  connection=OUTPUT_DATABASE_URI,
+                                  if_table_exists=mode,
+                                  engine='adbc')
+
+    def build_rates(self):
+        '''
+        Materialize the final mortality and fertility rates for every
+        projection year: CDC base rates x CBO multipliers x calibration
+        percentages. If rate_folder is set the rates are written there and
+        memory-mapped, and later runs with the same parameters and inputs
+        open them without rebuilding.
+        '''
+        if self.bundle is not None:
+            # the bundle holds the uncalibrated rates
+            rates = RateStore(index=self.bundle.index('cohorts'),
+                              years=self.bundle.key('rate_years'),
+                              mortality=self.bundle['mortality'],
+                              fertility=self.bundle['fertility'],
+                              params=self.bundle.params['rates'])
+            self.rates = rates.scaled(mortality_scale=1.0 + (0.01 * self.mort_calibr),
+                                      fertility_scale=1.0 + (0.01 * self.fert_calibr_pct))
+            if np.dtype(self.rate_dtype) != self.bundle['mortality'].dtype:
+                self.rates = self.rates.astype(self.rate_dtype)
+            return
+
+        mort_csv = os.path.join(self.database_folder, 'mortality_2019_2023_county.csv')
+        cbo_mort_csv = os.path.join(self.database_folder, 'cbo_mortality_p1v1.csv')
+        fert_csv = os.path.join(self.database_folder, 'fertility_2020_2024_county.csv')
+        cbo_fert_csv = os.path.join(self.database_folder, 'cbo_fertility_p1v1.csv')
+
+        params = {'geography': self.geography,
+                  'launch_year': self.launch_year,
+                  'mort_calibr': self.mort_calibr,
+                  'fert_calibr': self.fert_calibr_pct,
+                  'dtype': self.rate_dtype,
+                  'inputs': {os.path.basename(csv): os.path.getmtime(csv)
+                             for csv in (mort_csv, cbo_mort_csv, fert_csv, cbo_fert_csv)}}
+
+        # tract rates are computed one year at a time, so there is nothing
+        # worth saving
+        lazy = self.geography == 'tract'
+
+        if self.rate_folder is not None and not lazy and RateStore.saved_params(self.rate_folder) == params:
+            self.rates = RateStore.load(self.rate_folder, mmap=True)
+            return
+
+        # get CDC mortality rates by AGE, SEX, and COUNTY
+        county_mort_rates = (pl.read_csv(source=mort_csv)
+                               .with_columns(pl.col('GEOID').cast(pl.String).str.zfill(self.geoid_width).alias('GEOID')))
         # get CBO mortality rate adjustments
-        cbo_mort_csv = os.path.join(DATABASE_FOLDER, 'cbo_mortality_p1v1.csv')
-        cbo_mort_multiply = pl.read_csv(source=cbo_mort_csv).with_columns(pl.col('AGE'))
-        cbo_mort_multiply = cbo_mort_multiply.select(['AGE', 'SEX', f'ASMR_{self.current_projection_year}'])
-        cbo_mort_multiply = cbo_mort_multiply.rename({f'ASMR_{self.current_projection_year}': 'MORT_MULTIPLY'})
-
-        # join CBO mortality rate adjustments
-        df = df.join(other=cbo_mort_multiply,
-                     on=['AGE', 'SEX'],
-                     how='left',
-                     coalesce=True)
+        cbo_mort_multiply = pl.read_csv(source=cbo_mort_csv)
+        # get CDC fertility rates by AGE (15-44) and COUNTY
+        county_fert_rates = (pl.read_csv(source=fert_csv)
+                               .with_columns(pl.col('GEOID').cast(pl.String).str.zfill(self.geoid_width).alias('GEOID')))
+        # get CBO fertility rate adjustments
+        fert_multiply = pl.read_csv(source=cbo_fert_csv)
+
+        # projection years covered by both CBO adjustment files
+        years = [year for year in range(self.launch_year + 1, 2100)
+                 if f'ASMR_{year}' in cbo_mort_multiply.columns and f'ASFR_{year}' in fert_multiply.columns]
+
+        index = self.tract_index
+        if index is None:
+            index = CohortIndex(geoids=sorted(county_mort_rates.get_column('GEOID').unique().to_list()),
+                                ages=AGES,
+                                age_col='AGE')
+
+        self.rates = build_rate_store(index=index,
+                                      years=years,
+                                      base_mortality=county_mort_rates,
+                                      mortality_multipliers=cbo_mort_multiply,
+                                      base_fertility=county_fert_rates,
+                                      fertility_multipliers=fert_multiply,
+                                      fertile_ages=FERTILE_AGES,
+                                      mortality_scale=1.0 + (0.01 * self.mort_calibr),
+                                      fertility_scale=1.0 + (0.01 * self.fert_calibr_pct),
+                                      dtype=self.rate_dtype,
+                                      params=params,
+                                      lazy=lazy)
+
+        if self.rate_folder is not None and not lazy:
+            self.rates.save(self.rate_folder)
+            self.rates = RateStore.load(self.rate_folder, mmap=True)
 
-        assert sum(df.null_count()).item() == 0
+    def mortality(self):
+        '''
+        Calculate deaths from the precomputed rates for this year
+        '''
 
-        df = df.with_columns(((pl.col('MORTALITY_RATE_100K') * (1.0 + (0.01 * self.mort_calibr)) * pl.col('MORT_MULTIPLY')) / 100000.0).alias('MORT_PROJ'))
+        print("Calculating mortality...", end='')
 
-        # calculate deaths
-        df = df.with_columns((pl.col('MORT_PROJ') * pl.col('POPULATION')).alias('DEATHS'))
-        df = df.select(['GEOID', 'AGE', 'SEX', 'DEATHS'])
-        assert sum(df.null_count()).item() == 0
+        pop = self.rates.index.to_array(self.current_pop, 'POPULATION')
+        df = self.rates.index.to_frame(arr=self.rates.deaths(pop, self.current_projection_year),
+                                       value_col='DEATHS')
+        df = df.join(other=self.current_pop.select(['GEOID', 'AGE', 'SEX']),
+                     on=['GEOID', 'AGE', 'SEX'],
+                     how='semi')
+        assert df.shape[0] == self.current_pop.shape[0], "Missing mortality rates for current population"
 
         # store deaths
         self.deaths = df.clone()
@@ -417,51 +1119,91 @@ class Projector():
 
         print(f"finished! ({total_deaths_this_year:,} deaths this year)")
 
-    def immigration(self):
+    def build_immigration(self, lazy=False):
         '''
-        Calculate net immigration
+        Allocate CBO net immigration to counties for every projection year up
+        front. Neither the ACS weights nor the CBO totals depend on the
+        projected population, so the full [YEAR, GEOID, AGE, SEX] array is
+        built once and sliced by immigration(). With lazy (always for
+        tracts) it is kept as an OuterProduct of the weights and totals.
         '''
-        print("Calculating net immigration...", end='')
+        self.immigration_years, self.immigration_index, self.immigration_tensor = self.read_immigration(lazy=lazy)
+
+    def read_immigration(self, lazy=False):
+        '''
+        The immigration years, CohortIndex and [YEAR, GEOID, AGE, SEX]
+        tensor (see build_immigration), without changing the Projector.
+        '''
+        if self.bundle is not None:
+            return self.bundle.key('immigration_years'), self.bundle.index('cohorts'), self.bundle['immigration']
+
         # get the County level age-sex proportions
-        county_weights_csv = os.path.join(DATABASE_FOLDER, 'acs_immigration_age_sex_fractions_2011_2015.csv')
+        county_weights_csv = os.path.join(self.database_folder, IMMIGRATION_CSV)
         county_weights = pl.read_csv(source=county_weights_csv)
-        county_weights = county_weights.with_columns(pl.col('GEOID').cast(pl.String).str.zfill(5).alias('GEOID'))
-
-        # this is the net migrants for each age-sex combination
-        df_cbo = pl.read_csv(source=os.path.join(DATABASE_FOLDER, 'cbo_national_net_migration_by_year_age_sex.csv'))
-        df_cbo = (df_cbo.filter(pl.col('YEAR') == self.current_projection_year)
-                        .select(['AGE', 'SEX', 'NET_IMMIGRATION'])
-                        .with_columns(pl.col('AGE').cast(pl.Int32)))
-        df = (county_weights.join(other=df_cbo,
-                                  on=['AGE', 'SEX'],
-                                  how='left',
-                                  coalesce=True)
-                            .with_columns((pl.col('NET_IMMIGRATION') * pl.col('PERCENT_OF_AGE_SEX_COHORT'))
-                            .alias('NET_IMMIGRATION'))
-                            .drop('PERCENT_OF_AGE_SEX_COHORT'))
+        county_weights = county_weights.with_columns(pl.col('GEOID').cast(pl.String).str.zfill(self.geoid_width).alias('GEOID'))
+
+        # this is the net migrants for each year and age-sex combination
+        df_cbo = pl.read_csv(source=os.path.join(self.database_folder, CBO_IMMIGRATION_CSV))
+        df_cbo = df_cbo.with_columns(pl.col('AGE').cast(pl.Int32))
+
+        years = sorted(year for year in df_cbo.get_column('YEAR').unique().to_list() if year > self.launch_year)
+        # tracts allocate straight onto the launch population's GEOIDs, one
+        # year at a time
+        index = self.tract_index
+        if index is None:
+            index = CohortIndex(geoids=sorted(county_weights.get_column('GEOID').unique().to_list()),
+                                ages=AGES,
+                                age_col='AGE')
+        tensor = build_immigration_tensor(index=index,
+                                          weights=county_weights,
+                                          national=df_cbo,
+                                          time_col='YEAR',
+                                          times=years,
+                                          lazy=lazy or self.geography == 'tract')
+
+        return years, index, tensor
+
+    def build_migration_scaling(self):
+        '''
+        Read the yearly migration rate factors (AGE, SEX, MIG_{year}) for
+        every immigration year; migration() joins them onto the rates and
+        the dense engines apply them as a per-year rescale of every origin
+        cohort.
+        '''
+        if self.bundle is not None:
+            assert 'migration_scaling' in self.bundle, f"{self.bundle.folder} was built without {MIGRATION_SCALING_CSV}"
+            self.migration_scaling = self.bundle['migration_scaling']
+            index = self.bundle.index('cohorts')
+            factors = self.migration_scaling.reshape(len(self.immigration_years), -1)
+            self.migration_multipliers = pl.DataFrame({index.age_col: np.repeat(index.ages, len(index.sexes)),
+                                                       'SEX': np.tile(index.sexes, len(index.ages)),
+                                                       **{f'MIG_{year}': factors[t] for t, year in enumerate(self.immigration_years)}})
+            return
+
+        self.migration_multipliers = pl.read_csv(source=os.path.join(self.database_folder, MIGRATION_SCALING_CSV))
+        self.migration_scaling = build_migration_scaling(index=self.immigration_index,
+                                                         years=self.immigration_years,
+                                                         multipliers=self.migration_multipliers)
 
-        assert sum(df.null_count()).item() == 0
+    def immigration(self):
+        '''
+        Calculate net immigration
+        '''
+        print("Calculating net immigration...", end='')
 
-        self.immigrants = df.clone()
+        t = self.immigration_years.index(self.current_projection_year)
+        self.immigrants = self.immigration_index.to_frame(arr=self.immigration_tensor[t],
+                                                          value_col='NET_IMMIGRATION')
 
         # store time series of immigration in sqlite3
-        if self.current_projection_year == self.launch_year + 1:
-            immigration = self.immigrants.rename({'NET_IMMIGRATION': str(self.current_projection_year)}).clone()
-        else:
-            query = f'SELECT * FROM immigration_by_age_sex_{self.scenario}'
-            immigration = pl.read_database_uri(query=query, uri=OUTPUT_DATABASE_URI)
-            current_immigration = self.immigrants.clone()
-            current_immigration = current_immigration.rename({'NET_IMMIGRATION': str(self.current_projection_year)}).clone()
-            immigration = pl.concat(items=[immigration, current_immigration], how='align')
-
-        assert sum(immigration.null_count()).item() == 0
-
+        immigration = self.immigration_index.ledger_frame(arr=self.immigration_tensor[:t + 1],
+                                                          labels=self.immigration_years[:t + 1])
         immigration.write_database(table_name=f'immigration_by_age_sex_{self.scenario}',
                                    connection=OUTPUT_DATABASE_URI,
                                    if_table_exists='replace',
                                    engine='adbc')
 
-        total_immigrants_this_year = round(immigration.select(f'{self.current_projection_year}').sum().item())
+        total_immigrants_this_year = round(self.immigration_tensor[t].sum())
         print(f"finished! ({total_immigrants_this_year:,} net immigrants this year)")
 
     def migration(self):
@@ -471,7 +1213,7 @@ class Projector():
         print("Calculating domestic migration...")
 
         # get the age-sex migration rates specific to each ORIGIN-DESTINATION
-        rates = pl.read_csv(os.path.join(DATABASE_FOLDER, 'acs_gross_migration_age_sex_fractions_2011_2015.csv'))
+        rates = pl.read_csv(os.path.join(self.database_folder, MIGRATION_CSV))
         rates = rates.with_columns([pl.col('ORIGIN_FIPS').cast(pl.String).str.zfill(5).alias('ORIGIN_FIPS'),
                                    pl.col('DESTINATION_FIPS').cast(pl.String).str.zfill(5).alias('DESTINATION_FIPS')])
 
@@ -480,6 +1222,23 @@ class Projector():
         rates = rates.filter(~pl.col('ORIGIN_FIPS').str.starts_with('7'))
         rates = rates.filter(~pl.col('DESTINATION_FIPS').str.starts_with('7'))
 
+        # this year's CBO-derived change in mobility by age and sex, capped
+        # so that no origin's scaled out-rate exceeds MAX_SCALED_OUT_RATE
+        # (as cap_migration_scaling does for the dense engines)
+        if self.migration_multipliers is not None:
+            limits = (rates.group_by(['ORIGIN_FIPS', 'AGE', 'SEX']).agg(pl.col('MIGRATION_RATE').sum())
+                           .group_by(['AGE', 'SEX']).agg(pl.col('MIGRATION_RATE').max().alias('MAX_OUT_RATE')))
+            factors = self.migration_multipliers.select(['AGE', 'SEX', pl.col(f'MIG_{self.current_projection_year}').alias('FACTOR')])
+            factors = (factors.join(limits, on=['AGE', 'SEX'], how='left')
+                              .with_columns(pl.when(pl.col('MAX_OUT_RATE') > 0)
+                                              .then(pl.min_horizontal('FACTOR', MAX_SCALED_OUT_RATE / pl.col('MAX_OUT_RATE')))
+                                              .otherwise(pl.col('FACTOR'))
+                                              .alias('FACTOR'))
+                              .drop('MAX_OUT_RATE'))
+            rates = (rates.join(factors, on=['AGE', 'SEX'], how='left')
+                          .with_columns((pl.col('MIGRATION_RATE') * pl.col('FACTOR')).alias('MIGRATION_RATE'))
+                          .drop('FACTOR'))
+
         # compute all county to county migration flows
         # join current population with migration rates ORIGIN_FIPS
         migr = rates.join(other=self.current_pop.clone(),
@@ -548,35 +1307,19 @@ class Projector():
         '''
         print("Calculating fertility...", end='')
 
-        # get CDC fertility rates by AGE (15-44) and COUNTY
-        county_fert_rates = (pl.read_csv(source=os.path.join(DATABASE_FOLDER, 'fertility_2020_2024_county.csv'))
-                                         .with_columns(pl.col('GEOID').cast(pl.String).str.zfill(5).alias('GEOID')))
-
-        df = self.current_pop.filter((pl.col('SEX') == 'FEMALE') & (pl.col('AGE').is_between(15, 44)))
-
-        # get CBO fertility rate adjustments
-        fert_multiply = (pl.read_csv(source=os.path.join(DATABASE_FOLDER, 'cbo_fertility_p1v1.csv'))
-                         .select(['AGE', f'ASFR_{self.current_projection_year}'])
-                         .rename({f'ASFR_{self.current_projection_year}': 'FERT_MULT'}))
-
-        # adjust the county fertility rates using change factors from
-        # CBO and then calculate births
-        df = df.join(other=county_fert_rates,
-                     on=['GEOID', 'AGE'],
-                     how='left',
-                     coalesce=True)
-
-        df = df.join(other=fert_multiply,
-                     on='AGE',
-                     how='left',
-                     coalesce=True)
-
-        df = df.with_columns(((pl.col('FERTILITY') * (1.0 + (0.01 * self.fert_calibr_pct)) * pl.col('FERT_MULT') / 1000) * pl.col('POPULATION')).alias('TOTAL_BIRTHS'))
-        df = df.with_columns((pl.col('TOTAL_BIRTHS') * 0.512195122).alias('MALE'))  # from Mathews, et al. (2005)
-        df = df.with_columns((pl.col('TOTAL_BIRTHS') - pl.col('MALE')).alias('FEMALE'))
-        df = (df.select(['GEOID', 'MALE', 'FEMALE'])
-                .unpivot(index='GEOID', variable_name='SEX', value_name='BIRTHS')
-                .group_by(['GEOID', 'SEX']).agg(pl.col('BIRTHS').sum()))
+        # births are the population times the precomputed rates for this
+        # year, summed by county
+        pop = self.rates.index.to_array(self.current_pop, 'POPULATION')
+        total_births = self.rates.births(pop, self.current_projection_year)
+        male_births = total_births * MALE_BIRTH_FRACTION
+
+        df = pl.DataFrame({'GEOID': self.rates.index.geoids,
+                           'MALE': male_births,
+                           'FEMALE': total_births - male_births})
+        df = df.join(other=self.current_pop.select('GEOID').unique(),
+                     on='GEOID',
+                     how='semi')
+        df = df.unpivot(index='GEOID', variable_name='SEX', value_name='BIRTHS')
         df = df.with_columns(pl.lit(0).alias('AGE'))
         assert sum(df.null_count()).item() == 0
 
@@ -0,0 +1,89 @@
+"""
+Author:  Phil Morefield
+Purpose: Build, check and describe the county model's input bundle
+Created: October 19th, 2026
+
+Every Projector reads and joins the processed CSVs before its first year is
+projected. build-bundle does that once and writes the results to an
+InputBundle (see lorax_engine_p1v0.py): one .npy file per typed array
+(rates, immigration, O-D migration, migration scaling and the launch
+population) and a manifest.json with the bundle format, the county, age
+and sex keys, the year lists, the build parameters and the SHA-256 of
+every source file. Projector(bundle_folder=...) memory-maps the arrays
+instead of parsing the CSVs, and every process that opens the bundle reads
+the same pages from the OS page cache.
+
+verify lists the source files that have changed or disappeared since the
+bundle was built (exits 1 if there are any); info prints the arrays and
+the manifest.
+
+Usage:
+    python lorax_bundle_p1v0.py build-bundle --folder D:\\bundles\\p1v1
+    python lorax_bundle_p1v0.py verify --folder D:\\bundles\\p1v1
+    python lorax_bundle_p1v0.py info --folder D:\\bundles\\p1v1
+"""
+import argparse
+import sys
+import time
+
+from county_lorax_model_p1v0 import BUNDLE_FOLDER, build_input_bundle
+from lorax_engine_p1v0 import InputBundle
+
+
+def verify(folder):
+    '''
+    Print the stale sources of a bundle and return their count.
+    '''
+    bundle = InputBundle.open(folder)
+    stale = bundle.stale_sources()
+    for path in stale:
+        print(f"stale: {path}")
+    print(f"{len(bundle.manifest['sources']) - len(stale):,} of {len(bundle.manifest['sources']):,} sources unchanged")
+
+    return len(stale)
+
+
+def info(folder):
+    '''
+    Print the arrays, keys and build parameters of a bundle, and how long
+    it takes to open.
+    '''
+    start = time.perf_counter()
+    bundle = InputBundle.open(folder)
+    arrays = {name: bundle[name] for name in bundle.manifest['arrays']}
+    seconds = time.perf_counter() - start
+
+    print(f"{folder} (format {bundle.manifest['format']}, built {bundle.manifest['created']}, "
+          f"opened in {seconds * 1000:.1f} ms)")
+    for name, arr in arrays.items():
+        print(f"  {name:<24}{str(arr.dtype):<10}{str(arr.shape):<28}{arr.nbytes / 1e6:>10,.1f} MB")
+    for name in bundle.manifest['indexes']:
+        index = bundle.index(name)
+        print(f"  index {name}: {len(index.geoids):,} GEOIDs x {len(index.ages)} {index.age_col} x {len(index.sexes)} SEX")
+    for name, key in bundle.manifest['keys'].items():
+        print(f"  key {name}: {key[0]}-{key[-1]} ({len(key)})")
+    print(f"  params: {', '.join(f'{key}={value}' for key, value in bundle.params.items() if key != 'rates')}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='County model input bundle.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build_parser = subparsers.add_parser('build-bundle', help='compile the processed inputs into a bundle')
+    build_parser.add_argument('--folder', default=BUNDLE_FOLDER)
+    build_parser.add_argument('--version', default='p1v1')
+    build_parser.add_argument('--no-launch', action='store_true', help='leave out the launch population')
+
+    verify_parser = subparsers.add_parser('verify', help='list sources changed since the bundle was built')
+    verify_parser.add_argument('--folder', default=BUNDLE_FOLDER)
+
+    info_parser = subparsers.add_parser('info', help='describe a bundle')
+    info_parser.add_argument('--folder', default=BUNDLE_FOLDER)
+    args = parser.parse_args()
+
+    if args.command == 'build-bundle':
+        build_input_bundle(folder=args.folder, version=args.version, launch=not args.no_launch)
+    elif args.command == 'verify':
+        sys.exit(1 if verify(args.folder) else 0)
+    else:
+        info(args.folder)
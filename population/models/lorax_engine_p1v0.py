@@ -0,0 +1,2781 @@
+"""
+Author:  Phil Morefield
+Purpose: Dense array layout shared by the state and county LORAX models
+Created: October 19th, 2026
+
+Model inputs that do not depend on the projected population (immigration
+allocations, rate schedules) are built once as contiguous numpy arrays laid
+out as [GEOID, AGE, SEX] and sliced every time step instead of being re-read
+and re-joined.
+"""
+import hashlib
+import itertools
+import json
+import multiprocessing
+import multiprocessing.connection
+import os
+import queue
+import shutil
+import time
+import traceback
+
+import numpy as np
+import polars as pl
+
+# optional: CompiledEngine falls back to the NumPy step without it
+try:
+    import numba
+except ImportError:
+    numba = None
+
+
+SEXES = ['FEMALE', 'MALE']
+RATE_STORE_MANIFEST = 'manifest.json'
+MIGRATION_MANIFEST = 'manifest.json'
+LEDGER_STORE_MANIFEST = 'manifest.json'
+BUNDLE_MANIFEST = 'manifest.json'
+# layout of an InputBundle; bundles written with another format are rebuilt
+BUNDLE_FORMAT = 1
+
+# ShardedEngine: how long the main process waits for a worker whose
+# results pipe has closed to exit, and how long a worker waits for the
+# migrants of the other shards before giving up
+SHARD_EXIT_SECONDS = 5.0
+SHARD_EXCHANGE_TIMEOUT = 600.0
+
+# approximate bytes held per O-D rate row while an origin chunk is loaded:
+# the long polars rows plus the rate, origin population and flow cells
+MIGRATION_ROW_BYTES = 96
+
+# highest total out-migration rate of an origin cohort once the migration
+# scaling factors are applied (see cap_migration_scaling)
+MAX_SCALED_OUT_RATE = 0.95
+
+# columns of an AttributionCube, after YEAR, GEOID (and the age column)
+ATTRIBUTION_COMPONENTS = ['BIRTHS', 'DEATHS', 'IMMIGRATION', 'INMIG', 'OUTMIG', 'ROUNDING']
+
+# rate families perturbed by elasticities()
+SENSITIVITY_FAMILIES = ('fertility', 'mortality', 'immigration', 'migration')
+
+# output tables and the engine arrays each one is built from
+OUTPUT_LEDGERS = {'population': ('population',),
+                  'deaths': ('deaths',),
+                  'immigration': ('immigration',),
+                  'migration': ('inmig', 'outmig'),
+                  'births': ('births',)}
+
+
+class CohortIndex():
+    '''
+    Fixed GEOID x AGE x SEX ordering for the model's dense arrays, with an
+    optional leading RACE axis (RACE x GEOID x AGE x SEX). Arrays without
+    the RACE axis broadcast against arrays with it, so race-less rates and
+    migration apply to every race without being copied.
+
+    Parameters:
+        geoids (list): GEOID codes, in array order.
+        ages (list): age groups ('0-4', ...) or single years of age (0, ...).
+        age_col (str): name of the age column, 'AGE_GROUP' or 'AGE'.
+        sexes (list): sex codes, in array order.
+        races (list): race/Hispanic origin codes, in array order, or None.
+    '''
+    def __init__(self, geoids, ages, age_col, sexes=SEXES, races=None):
+        self.geoids = list(geoids)
+        self.ages = list(ages)
+        self.age_col = age_col
+        self.sexes = list(sexes)
+        self.races = None if races is None else list(races)
+        self.columns = ['GEOID', self.age_col, 'SEX']
+        self.shape = (len(self.geoids), len(self.ages), len(self.sexes))
+        if self.races is not None:
+            self.columns = ['RACE'] + self.columns
+            self.shape = (len(self.races),) + self.shape
+        self.size = int(np.prod(self.shape))
+        self._key_frame = None
+
+    def levels(self):
+        '''
+        Return {column: values} for every axis, in array order.
+        '''
+        levels = {'GEOID': self.geoids, self.age_col: self.ages, 'SEX': self.sexes}
+        if self.races is not None:
+            levels = {'RACE': self.races, **levels}
+
+        return levels
+
+    def key_frame(self):
+        '''
+        Return the key columns (RACE, GEOID, age and SEX) in array (C) order.
+        '''
+        if self._key_frame is None:
+            columns = {}
+            inner = self.size
+            for col, values in self.levels().items():
+                inner //= len(values)
+                pos = np.tile(np.repeat(np.arange(len(values)), inner), self.size // (len(values) * inner))
+                columns[col] = pl.Series(values).gather(pos)
+            self._key_frame = pl.DataFrame(columns)
+
+        return self._key_frame.clone()
+
+    def positions(self, df, columns=None):
+        '''
+        Return the flat array position of every row of df over the given key
+        columns (default: all of them). Rows with unknown keys get -1.
+        '''
+        if columns is None:
+            columns = self.columns
+        levels = self.levels()
+
+        shape = tuple(len(levels[col]) for col in columns)
+        idx = []
+        for col in columns:
+            lookup = pl.DataFrame({col: levels[col], '_POS': np.arange(len(levels[col]))})
+            lookup = lookup.with_columns(pl.col(col).cast(df.schema[col]))
+            pos = (df.select(col).with_row_index('_ROW')
+                     .join(other=lookup, on=col, how='left')
+                     .sort('_ROW')
+                     .get_column('_POS')
+                     .fill_null(-1)
+                     .to_numpy())
+            idx.append(pos)
+
+        idx = np.stack(idx)
+        missing = (idx < 0).any(axis=0)
+        flat = np.ravel_multi_index(np.where(missing, 0, idx), shape)
+
+        return np.where(missing, -1, flat)
+
+    def to_array(self, df, value_col, fill=0.0, dtype=np.float64):
+        '''
+        Scatter df[value_col] into a dense array with shape self.shape.
+        Duplicate keys are summed and keys outside the index are dropped.
+        '''
+        pos = self.positions(df)
+        values = df.get_column(value_col).fill_null(0).to_numpy().astype(dtype, copy=False)
+        keep = pos >= 0
+
+        arr = np.zeros(self.size, dtype=dtype)
+        np.add.at(arr, pos[keep], values[keep])
+        if fill != 0.0:
+            seen = np.zeros(self.size, dtype=bool)
+            seen[pos[keep]] = True
+            arr[~seen] = fill
+
+        return arr.reshape(self.shape)
+
+    def to_frame(self, arr, value_col):
+        '''
+        Attach a dense [GEOID, AGE, SEX] array to the key columns.
+        '''
+        assert arr.shape == self.shape, f"Array shape {arr.shape} does not match index {self.shape}"
+
+        return self.key_frame().with_columns(pl.Series(name=value_col, values=np.asarray(arr).ravel()))
+
+    def take_geoids(self, arr, geoids, axis=-3):
+        '''
+        Re-order (and subset) the GEOID axis of an array laid out on this
+        index to match geoids. GEOIDs that are not in this index get zeros.
+        '''
+        arr = np.asarray(arr)
+        position = {geoid: i for i, geoid in enumerate(self.geoids)}
+        src = np.array([position.get(geoid, -1) for geoid in geoids], dtype=np.int64)
+
+        out = np.take(arr, np.where(src >= 0, src, 0), axis=axis)
+        if (src < 0).any():
+            out = np.moveaxis(out, axis, 0).copy()
+            out[src < 0] = 0
+            out = np.moveaxis(out, 0, axis)
+
+        return np.ascontiguousarray(out)
+
+    def with_geoids(self, geoids):
+        '''
+        Return an index with the same races, ages and sexes over different
+        GEOIDs.
+        '''
+        return CohortIndex(geoids=geoids, ages=self.ages, age_col=self.age_col, sexes=self.sexes, races=self.races)
+
+    def with_races(self, races):
+        '''
+        Return an index over the same GEOIDs, ages and sexes with a leading
+        RACE axis (or without one if races is None).
+        '''
+        return CohortIndex(geoids=self.geoids, ages=self.ages, age_col=self.age_col, sexes=self.sexes, races=races)
+
+    def ledger_frame(self, arr, labels):
+        '''
+        Convert a [TIME, (RACE,) GEOID, AGE, SEX] array to the wide ledger
+        layout used by the model outputs: one column per label.
+        '''
+        assert arr.shape[1:] == self.shape
+
+        flat = np.asarray(arr).reshape(arr.shape[0], -1)
+        return self.key_frame().with_columns([pl.Series(name=str(label), values=flat[i])
+                                             for i, label in enumerate(labels)])
+
+
+class GeographyIndex():
+    '''
+    Parent codes of every GEOID position of the model's arrays at every
+    level of the geography hierarchy (county, state, HHS region, ...),
+    precomputed once so that aggregating an array to any level is a segment
+    sum over its GEOID axis (np.add.reduceat) instead of a join. Every index
+    has a NATION level with a single parent.
+
+    Parameters:
+        geoids (list): GEOIDs, in array order.
+        parents (dict): level -> parent code of every GEOID, in the same
+            order.
+    '''
+    def __init__(self, geoids, parents):
+        self.geoids = list(geoids)
+        self.levels = {}
+        for level, codes in {**parents, 'NATION': ['US'] * len(self.geoids)}.items():
+            assert len(codes) == len(self.geoids), f"{level} needs one parent code per GEOID"
+            labels, positions = np.unique(np.asarray(codes), return_inverse=True)
+            order = np.argsort(positions, kind='stable')
+            self.levels[level] = {'labels': labels.tolist(),
+                                  'positions': positions,
+                                  'order': None if (order == np.arange(order.size)).all() else order,
+                                  'starts': np.searchsorted(positions[order], np.arange(labels.size))}
+
+    @classmethod
+    def from_prefixes(cls, geoids, widths=None):
+        '''
+        Levels that are prefixes of the GEOIDs, e.g. {'STATE': 2, 'COUNTY': 5}
+        (the default); levels at least as long as the GEOIDs are skipped.
+        '''
+        widths = widths or {'STATE': 2, 'COUNTY': 5}
+        geoids = list(geoids)
+        width = max(len(geoid) for geoid in geoids)
+
+        return cls(geoids, {level: [geoid[:w] for geoid in geoids] for level, w in widths.items() if w < width})
+
+    @classmethod
+    def from_crosswalk(cls, geoids, csv):
+        '''
+        State, county (for tracts), HHS region, and for county or tract
+        GEOIDs, BEA economic area (BEA10) and urbanicity (URBANDESTINATION20)
+        from a COFIPS crosswalk such as fips_to_urb20_bea10_hhs.csv. GEOIDs
+        missing from the crosswalk get the code -1.
+        '''
+        geoids = list(geoids)
+        crosswalk = pl.read_csv(csv, schema_overrides={'COFIPS': pl.String})
+        crosswalk = crosswalk.with_columns(pl.col('COFIPS').str.zfill(5))
+        county = {row['COFIPS']: row for row in crosswalk.iter_rows(named=True)}
+        state_hhs = {cofips[:2]: row['HHS'] for cofips, row in county.items()}
+
+        width = max(len(geoid) for geoid in geoids)
+        parents = {'STATE': [geoid[:2] for geoid in geoids]}
+        if width > 5:
+            parents['COUNTY'] = [geoid[:5] for geoid in geoids]
+        if width < 5:
+            parents['HHS_REGION'] = [state_hhs.get(geoid[:2], -1) for geoid in geoids]
+        else:
+            for level, col in (('HHS_REGION', 'HHS'), ('BEA_AREA', 'BEA10'), ('URBANICITY', 'URBANDESTINATION20')):
+                parents[level] = [county[geoid[:5]][col] if geoid[:5] in county else -1 for geoid in geoids]
+
+        return cls(geoids, parents)
+
+    def labels(self, level):
+        return self.levels[level]['labels']
+
+    def rollup(self, arr, level, axis=-3):
+        '''
+        Sum arr over the GEOIDs of every parent at level, along the GEOID
+        axis; the result has one entry per label on that axis.
+        '''
+        info = self.levels[level]
+        arr = np.asarray(arr)
+        if info['order'] is not None:
+            arr = np.take(arr, info['order'], axis=axis)
+
+        return np.add.reduceat(arr, info['starts'], axis=axis, dtype=np.float64)
+
+    def expand(self, arr, level, axis=-3):
+        '''
+        Repeat a parent-level array back onto the GEOIDs.
+        '''
+        return np.take(arr, self.levels[level]['positions'], axis=axis)
+
+    def rake(self, arr, level, targets, axis=-3):
+        '''
+        Scale arr so that its rollup to level equals targets (laid out like
+        that rollup), keeping every GEOID's share of its parent. Cells whose
+        parent total is zero stay zero.
+        '''
+        totals = self.rollup(arr, level, axis)
+        factors = np.divide(targets, totals, out=np.zeros(np.broadcast_shapes(np.shape(targets), totals.shape)),
+                            where=totals != 0)
+
+        return arr * self.expand(factors, level, axis)
+
+    def parent_index(self, index, level):
+        '''
+        A CohortIndex over the parents at level, with the same ages, sexes
+        and races as index.
+        '''
+        return index.with_geoids([str(label) for label in self.labels(level)])
+
+
+def rollup_results(geography, level, results):
+    '''
+    Aggregate [YEAR, ...] DenseEngine results (or one year's arrays) to a
+    level of the geography hierarchy, ledger by ledger. Births are
+    [..., GEOID, SEX], everything else [..., GEOID, AGE, SEX].
+    '''
+    return {name: geography.rollup(arr, level, axis=-2 if name == 'births' else -3)
+            for name, arr in results.items()}
+
+
+class OuterProduct():
+    '''
+    A [TIME, GEOID, AGE, SEX] array that is the product of a fixed
+    [GEOID, AGE, SEX] base and a per-time factor, computed one time slice at
+    a time. Used in place of a materialized array when the full array would
+    not fit in memory (e.g. tracts x 75 years).
+
+    Parameters:
+        base (ndarray): [GEOID, AGE, SEX] array.
+        factors (ndarray): [TIME, ...] factors that broadcast against base.
+        scale (float): applied to every element after the product.
+        dtype: dtype of the returned slices.
+    '''
+    def __init__(self, base, factors, scale=1.0, dtype=np.float64):
+        self.base = base
+        self.factors = factors
+        self.scale = scale
+        self.dtype = np.dtype(dtype)
+        self.shape = (factors.shape[0],) + base.shape
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, np.integer)):
+            out = self.base * self.factors[key]
+        else:
+            out = self.base[np.newaxis] * self.factors[key]
+        if self.scale != 1.0:
+            out = out * self.scale
+
+        return out.astype(self.dtype, copy=False)
+
+    def __array__(self, dtype=None, copy=None):
+        return np.asarray(self[:], dtype=dtype)
+
+
+class ScaledArray():
+    '''
+    A [TIME, ...] array (or OuterProduct) times a constant, computed one
+    time slice at a time so that a scenario can rescale shared rates or
+    immigration without copying them.
+
+    Parameters:
+        base (ndarray): [TIME, ...] array or OuterProduct.
+        scale (float): applied to every element.
+    '''
+    def __init__(self, base, scale):
+        self.base = base
+        self.scale = scale
+        self.shape = base.shape
+        self.dtype = base.dtype
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        return (self.base[key] * self.scale).astype(self.dtype, copy=False)
+
+    def __array__(self, dtype=None, copy=None):
+        return np.asarray(self[:], dtype=dtype)
+
+
+def build_immigration_tensor(index, weights, national, time_col, times, lazy=False):
+    '''
+    Allocate national net immigration to every geography for every time step
+    in a single outer product.
+
+    Parameters:
+        index (CohortIndex): layout of the allocation weights.
+        weights (DataFrame): GEOID, age, SEX and PERCENT_OF_AGE_SEX_COHORT.
+        national (DataFrame): time_col, age, SEX and NET_IMMIGRATION.
+        time_col (str): 'YEAR' or 'TIME_STEP'.
+        times (list): time_col values, in the order of the first axis.
+        lazy (bool): return an OuterProduct that allocates one time step at
+            a time instead of the full array.
+
+    Returns:
+        ndarray: C-contiguous [TIME, GEOID, AGE, SEX] net immigrants.
+    '''
+    w = index.to_array(weights, 'PERCENT_OF_AGE_SEX_COHORT')
+
+    national = (national.filter(pl.col(time_col).is_in(times))
+                        .group_by([time_col, index.age_col, 'SEX'])
+                        .agg(pl.col('NET_IMMIGRATION').sum()))
+
+    time_pos = dict(zip(times, range(len(times))))
+    t = np.array([time_pos[value] for value in national.get_column(time_col).to_list()], dtype=np.int64)
+    cohort = index.positions(national, columns=[index.age_col, 'SEX'])
+    assert (cohort >= 0).all(), "National immigration has age/sex cohorts outside the model"
+
+    n = np.zeros((len(times), len(index.ages) * len(index.sexes)))
+    np.add.at(n, (t, cohort), national.get_column('NET_IMMIGRATION').to_numpy().astype(np.float64))
+    n = n.reshape((len(times),) + (1,) * (len(index.shape) - 2) + (len(index.ages), len(index.sexes)))
+
+    if lazy:
+        return OuterProduct(base=w, factors=n)
+
+    return np.ascontiguousarray(n * w[np.newaxis])
+
+
+class RateStore():
+    '''
+    Final mortality hazards and fertility rates for every projection year,
+    laid out as [YEAR, GEOID, AGE, SEX]. Calibration, CBO multipliers and the
+    length of the time step are already folded in, so deaths and births for a
+    year are a single multiply with the population array.
+
+    Parameters:
+        index (CohortIndex): layout of the last three axes.
+        years (list): projection years, in the order of the first axis.
+        mortality (ndarray): deaths per person per time step.
+        fertility (ndarray): births (both sexes) per person per time step;
+            zero outside of females of childbearing age.
+        params (dict): build parameters, recorded in the saved manifest.
+    '''
+    def __init__(self, index, years, mortality, fertility, params=None):
+        assert mortality.shape == fertility.shape == (len(years),) + index.shape
+
+        self.index = index
+        self.years = list(years)
+        self.mortality = mortality
+        self.fertility = fertility
+        self.params = params or {}
+
+    def year_position(self, year):
+        return self.years.index(year)
+
+    def subset(self, geoids):
+        '''
+        Return a RateStore over the given GEOIDs (in that order).
+        '''
+        def take(arr):
+            if isinstance(arr, OuterProduct):
+                return OuterProduct(base=self.index.take_geoids(arr.base, geoids),
+                                    factors=arr.factors,
+                                    scale=arr.scale,
+                                    dtype=arr.dtype)
+            return self.index.take_geoids(arr, geoids)
+
+        return RateStore(index=self.index.with_geoids(geoids),
+                         years=self.years,
+                         mortality=take(self.mortality),
+                         fertility=take(self.fertility),
+                         params=self.params)
+
+    def scaled(self, mortality_scale=1.0, fertility_scale=1.0):
+        '''
+        Return a RateStore whose rates are these times the given factors,
+        as ScaledArray views (the arrays themselves are shared).
+        '''
+        def scale(arr, factor):
+            return arr if factor == 1.0 else ScaledArray(arr, factor)
+
+        return RateStore(index=self.index,
+                         years=self.years,
+                         mortality=scale(self.mortality, mortality_scale),
+                         fertility=scale(self.fertility, fertility_scale),
+                         params={**self.params, 'mortality_scale': mortality_scale, 'fertility_scale': fertility_scale})
+
+    def astype(self, dtype):
+        '''
+        Return a RateStore with the rates stored as dtype (lazy rates stay
+        lazy and are cast one year at a time).
+        '''
+        def cast(arr):
+            if isinstance(arr, OuterProduct):
+                return OuterProduct(base=arr.base, factors=arr.factors, scale=arr.scale, dtype=dtype)
+            return np.asarray(arr).astype(dtype, copy=False)
+
+        return RateStore(index=self.index,
+                         years=self.years,
+                         mortality=cast(self.mortality),
+                         fertility=cast(self.fertility),
+                         params={**self.params, 'dtype': np.dtype(dtype).name})
+
+    def deaths(self, pop, year):
+        '''
+        Deaths by GEOID, AGE and SEX for the time step ending in year.
+        '''
+        return pop * self.mortality[self.year_position(year)]
+
+    def births(self, pop, year):
+        '''
+        Total births by GEOID for the time step ending in year.
+        '''
+        return (pop * self.fertility[self.year_position(year)]).sum(axis=(-2, -1), dtype=np.float64)
+
+    def save(self, folder):
+        '''
+        Write the rate arrays as .npy files alongside a JSON manifest.
+        '''
+        os.makedirs(folder, exist_ok=True)
+        np.save(os.path.join(folder, 'mortality.npy'), self.mortality)
+        np.save(os.path.join(folder, 'fertility.npy'), self.fertility)
+
+        manifest = {'geoids': self.index.geoids,
+                    'ages': self.index.ages,
+                    'age_col': self.index.age_col,
+                    'sexes': self.index.sexes,
+                    'years': self.years,
+                    'dtype': str(self.mortality.dtype),
+                    'params': self.params}
+        with open(os.path.join(folder, RATE_STORE_MANIFEST), 'w') as f:
+            json.dump(manifest, f, indent=2)
+
+    @classmethod
+    def load(cls, folder, mmap=True):
+        '''
+        Open a saved RateStore. With mmap=True the arrays are memory-mapped
+        read-only, so only the years that are used get paged in.
+        '''
+        with open(os.path.join(folder, RATE_STORE_MANIFEST)) as f:
+            manifest = json.load(f)
+
+        mmap_mode = 'r' if mmap else None
+        index = CohortIndex(geoids=manifest['geoids'],
+                            ages=manifest['ages'],
+                            age_col=manifest['age_col'],
+                            sexes=manifest['sexes'])
+
+        return cls(index=index,
+                   years=manifest['years'],
+                   mortality=np.load(os.path.join(folder, 'mortality.npy'), mmap_mode=mmap_mode),
+                   fertility=np.load(os.path.join(folder, 'fertility.npy'), mmap_mode=mmap_mode),
+                   params=manifest['params'])
+
+    @staticmethod
+    def saved_params(folder):
+        '''
+        Return the build parameters of a saved RateStore, or None.
+        '''
+        manifest = os.path.join(folder, RATE_STORE_MANIFEST)
+        if not os.path.isfile(manifest):
+            return None
+        with open(manifest) as f:
+            return json.load(f)['params']
+
+
+def build_rate_store(index, years, base_mortality, mortality_multipliers,
+                     base_fertility, fertility_multipliers, fertile_ages,
+                     mortality_scale=1.0, fertility_scale=1.0,
+                     dtype=np.float64, params=None, lazy=False):
+    '''
+    Materialize the year x GEOID x AGE x SEX mortality and fertility rates.
+
+    Parameters:
+        index (CohortIndex): layout of the rate arrays.
+        years (list): projection years.
+        base_mortality (DataFrame): GEOID, age, SEX, MORTALITY_RATE_100K.
+        mortality_multipliers (DataFrame): age, SEX and one ASMR_{year}
+            column per projection year.
+        base_fertility (DataFrame): GEOID, age, FERTILITY (births per 1,000
+            women).
+        fertility_multipliers (DataFrame): age and one ASFR_{year} column per
+            projection year.
+        fertile_ages (list): ages that give birth.
+        mortality_scale (float): calibration and time step factor applied to
+            every death rate.
+        fertility_scale (float): calibration and time step factor applied to
+            every fertility rate.
+        dtype: storage dtype of the rate arrays (float64 or float32).
+        lazy (bool): keep the rates as OuterProducts of the base rates and
+            the yearly multipliers, so only one year is allocated at a time.
+
+    Returns:
+        RateStore
+    '''
+    age_col = index.age_col
+    n_age, n_sex = len(index.ages), len(index.sexes)
+    lead = index.shape[:-2]  # (GEOID,) or (RACE, GEOID)
+
+    # base CDC mortality rates, per person
+    base_mort = index.to_array(base_mortality, 'MORTALITY_RATE_100K', fill=np.nan) / 100000.0
+    assert not np.isnan(base_mort).any(), "Missing base mortality rates"
+
+    # CBO mortality multipliers by year
+    mort_mult = np.full((len(years), n_age * n_sex), np.nan)
+    cohort = index.positions(mortality_multipliers, columns=[age_col, 'SEX'])
+    keep = cohort >= 0
+    for t, year in enumerate(years):
+        mort_mult[t, cohort[keep]] = mortality_multipliers.get_column(f'ASMR_{year}').to_numpy()[keep]
+    assert not np.isnan(mort_mult).any(), "Missing CBO mortality multipliers"
+    mort_mult = mort_mult.reshape((len(years),) + (1,) * len(lead) + (n_age, n_sex))
+
+    if lazy:
+        mortality = OuterProduct(base=base_mort, factors=mort_mult, scale=mortality_scale, dtype=dtype)
+    else:
+        mortality = np.ascontiguousarray((base_mort[np.newaxis] * mort_mult * mortality_scale).astype(dtype))
+
+    # base CDC fertility rates, per woman
+    fertile = np.array([age in fertile_ages for age in index.ages])
+    base_fert = np.full(int(np.prod(lead)) * n_age, np.nan)
+    pos = index.positions(base_fertility, columns=index.columns[:-1])
+    keep = pos >= 0
+    base_fert[pos[keep]] = base_fertility.get_column('FERTILITY').to_numpy()[keep] / 1000.0
+    base_fert = base_fert.reshape(lead + (n_age,))
+    assert not np.isnan(base_fert[..., fertile]).any(), "Missing base fertility rates"
+
+    # CBO fertility multipliers by year
+    fert_mult = np.zeros((len(years), n_age))
+    pos = index.positions(fertility_multipliers, columns=[age_col])
+    keep = pos >= 0
+    for t, year in enumerate(years):
+        fert_mult[t, pos[keep]] = fertility_multipliers.get_column(f'ASFR_{year}').to_numpy()[keep]
+
+    female = index.sexes.index('FEMALE')
+    if lazy:
+        fert_base = np.zeros(index.shape)
+        fert_base[..., fertile, female] = base_fert[..., fertile]
+        fert_factors = np.zeros((len(years),) + (1,) * len(lead) + (n_age, 1))
+        fert_factors[..., fertile, 0] = fert_mult[(slice(None),) + (np.newaxis,) * len(lead) + (fertile,)]
+        fertility = OuterProduct(base=fert_base, factors=fert_factors, scale=fertility_scale, dtype=dtype)
+    else:
+        fertility = np.zeros((len(years),) + index.shape, dtype=dtype)
+        fertility[..., fertile, female] = (base_fert[np.newaxis][..., fertile] *
+                                           fert_mult[(slice(None),) + (np.newaxis,) * len(lead) + (fertile,)] *
+                                           fertility_scale)
+
+    return RateStore(index=index,
+                     years=years,
+                     mortality=mortality,
+                     fertility=fertility,
+                     params=params)
+
+
+def build_migration_scaling(index, years, multipliers):
+    '''
+    Year x AGE x SEX factors of the domestic migration rates, for
+    DenseEngine's migration_scaling.
+
+    Parameters:
+        index (CohortIndex): layout of the population arrays.
+        years (list): projection years.
+        multipliers (DataFrame): age, SEX and one MIG_{year} column per
+            projection year.
+
+    Returns:
+        ndarray: [YEAR, 1, ..., AGE, SEX] factors that broadcast over the
+            population's leading axes.
+    '''
+    lead = index.shape[:-2]
+    n_age, n_sex = len(index.ages), len(index.sexes)
+
+    factors = np.full((len(years), n_age * n_sex), np.nan)
+    cohort = index.positions(multipliers, columns=[index.age_col, 'SEX'])
+    keep = cohort >= 0
+    for t, year in enumerate(years):
+        factors[t, cohort[keep]] = multipliers.get_column(f'MIG_{year}').to_numpy()[keep]
+    assert not np.isnan(factors).any(), "Missing migration scaling factors"
+    assert (factors >= 0).all(), "Negative migration scaling factors"
+
+    return factors.reshape((len(years),) + (1,) * len(lead) + (n_age, n_sex))
+
+
+def cap_migration_scaling(factors, max_out_rates, max_out_rate=MAX_SCALED_OUT_RATE):
+    '''
+    Lower the migration scaling factors of every AGE x SEX cohort so that
+    no origin's scaled total out-migration rate exceeds max_out_rate.
+
+    Parameters:
+        factors (ndarray): [YEAR, ..., AGE, SEX] factors (see
+            build_migration_scaling).
+        max_out_rates (ndarray): [AGE, SEX] highest total out-migration
+            rate of any origin (see MigrationOperator.max_out_rates).
+
+    Returns:
+        ndarray: the factors, capped.
+    '''
+    limit = np.full(max_out_rates.shape, np.inf)
+    np.divide(max_out_rate, max_out_rates, out=limit, where=max_out_rates > 0)
+
+    return np.minimum(factors, limit)
+
+
+class MigrationOperator():
+    '''
+    Sparse origin-destination migration rates. Each origin-destination pair
+    carries a full [AGE, SEX] block of rates; pairs are stored sorted by
+    origin so that inflows and outflows are segment sums instead of joins.
+
+    Pairs whose destination is outside the index (e.g. a state with no
+    launch population) still count toward the origin's outflows, which
+    matches the polars model where those flows leave and never arrive.
+
+    Parameters:
+        index (CohortIndex): layout of the population arrays.
+        origins (ndarray): origin GEOID position of every pair.
+        destinations (ndarray): destination GEOID position of every pair,
+            or -1 if the destination is outside the index.
+        rates (ndarray): [PAIR, AGE, SEX] migration rates per time step.
+    '''
+    def __init__(self, index, origins, destinations, rates):
+        self.index = index
+        self.origins = np.asarray(origins, dtype=np.int64)
+        self.destinations = np.asarray(destinations, dtype=np.int64)
+        self.rates = rates
+
+        assert (np.diff(self.origins) >= 0).all(), "Pairs must be sorted by origin"
+
+        # segment starts for the outflow sums
+        self._out_geos, self._out_starts = np.unique(self.origins, return_index=True)
+
+        # pairs re-ordered by destination for the inflow sums
+        inside = np.flatnonzero(self.destinations >= 0)
+        self._in_order = inside[np.argsort(self.destinations[inside], kind='stable')]
+        self._in_geos, self._in_starts = np.unique(self.destinations[self._in_order], return_index=True)
+
+    @property
+    def n_pairs(self):
+        return self.origins.size
+
+    @property
+    def nbytes(self):
+        return self.origins.nbytes + self.destinations.nbytes + self.rates.nbytes
+
+    def max_out_rates(self):
+        '''
+        Highest total out-migration rate of any origin, [AGE, SEX].
+        '''
+        if self.n_pairs == 0:
+            return np.zeros(self.rates.shape[-2:])
+        totals = np.add.reduceat(self.rates, self._out_starts, axis=-3, dtype=np.float64)
+
+        return totals.reshape((-1,) + totals.shape[-2:]).max(axis=0)
+
+    def pair_flows(self, pop):
+        '''
+        Migrants for every pair, [..., PAIR, AGE, SEX].
+        '''
+        return self.rates * np.take(pop, self.origins, axis=-3)
+
+    def flows(self, pop):
+        '''
+        Return (inflows, outflows), both laid out like pop. Leading batch
+        dimensions on pop are carried through.
+        '''
+        shape = np.broadcast_shapes(pop.shape, self.rates.shape[:-3] + self.index.shape)
+        inflows = np.zeros(shape)
+        outflows = np.zeros(shape)
+        self.accumulate(pop, inflows, outflows)
+
+        return inflows, outflows
+
+    def accumulate(self, pop, inflows, outflows):
+        '''
+        Add this operator's inflows and outflows to existing arrays laid out
+        like pop.
+        '''
+        if self.n_pairs == 0:
+            return
+
+        self.add_flows(self.pair_flows(pop), inflows, outflows)
+
+    def add_flows(self, flow, inflows, outflows):
+        '''
+        Add [..., PAIR, AGE, SEX] pair flows to the inflows of their
+        destinations and the outflows of their origins.
+        '''
+        outflows[..., self._out_geos, :, :] += np.add.reduceat(flow, self._out_starts, axis=-3, dtype=np.float64)
+        if self._in_order.size > 0:
+            inflows[..., self._in_geos, :, :] += np.add.reduceat(np.take(flow, self._in_order, axis=-3),
+                                                                 self._in_starts, axis=-3, dtype=np.float64)
+
+
+def build_migration_operator(index, rates, scale=1.0, dtype=np.float64):
+    '''
+    Build a MigrationOperator from a long table of ORIGIN_FIPS,
+    DESTINATION_FIPS, age, SEX and MIGRATION_RATE. Origins outside the index
+    are dropped; scale is applied to every rate (e.g. 5.0 for five-year
+    time steps).
+    '''
+    n_geo = len(index.geoids)
+    origin = index.positions(rates.select(pl.col('ORIGIN_FIPS').alias('GEOID')), columns=['GEOID'])
+    rates = rates.filter(pl.Series(origin >= 0))
+    origin = origin[origin >= 0]
+    destination = index.positions(rates.select(pl.col('DESTINATION_FIPS').alias('GEOID')), columns=['GEOID'])
+    cohort = index.positions(rates, columns=[index.age_col, 'SEX'])
+    assert (cohort >= 0).all(), "Migration rates have age/sex cohorts outside the model"
+
+    # one row per origin-destination pair, sorted by origin
+    key = origin * (n_geo + 1) + (destination + 1)
+    pairs, pair_id = np.unique(key, return_inverse=True)
+
+    values = np.zeros((pairs.size, len(index.ages) * len(index.sexes)), dtype=dtype)
+    # missing rates (no ACS flow) are treated as zero, as in the polars model
+    np.add.at(values, (pair_id, cohort), rates.get_column('MIGRATION_RATE').fill_null(0).fill_nan(0).to_numpy() * scale)
+
+    return MigrationOperator(index=index,
+                             origins=pairs // (n_geo + 1),
+                             destinations=pairs % (n_geo + 1) - 1,
+                             rates=values.reshape(pairs.size, len(index.ages), len(index.sexes)))
+
+
+def top_k_migration_operator(operator, k, weights=None):
+    '''
+    Sparsify a MigrationOperator to the k destinations of every origin that
+    carry the most migrants. Within every origin x AGE x SEX cohort the
+    dropped rates are reallocated to the kept destinations in proportion to
+    their rates, so outflows are unchanged; a cohort whose rates all fall
+    on dropped destinations moves to the origin's top destination.
+
+    Parameters:
+        operator (MigrationOperator): full rates.
+        k (int): destinations kept per origin.
+        weights (ndarray): optional [GEOID, AGE, SEX] population used to
+            rank destinations by migrants instead of by summed rates.
+
+    Returns:
+        MigrationOperator
+    '''
+    rates = operator.rates
+    if weights is not None:
+        rates = rates * np.take(weights, operator.origins, axis=-3)
+    mass = rates.sum(axis=(-2, -1))
+
+    # rank of every pair within its origin, largest mass first
+    order = np.lexsort((-mass, operator.origins))
+    segment = np.searchsorted(operator._out_geos, operator.origins[order])
+    rank = np.arange(order.size) - operator._out_starts[segment]
+    keep = np.sort(order[rank < k])
+    top = order[rank == 0]
+
+    total = np.add.reduceat(operator.rates, operator._out_starts, axis=0)
+    kept_origins = np.searchsorted(operator._out_geos, operator.origins[keep])
+    kept_starts = np.unique(kept_origins, return_index=True)[1]
+    kept = np.add.reduceat(operator.rates[keep], kept_starts, axis=0)
+
+    scale = np.divide(total, kept, out=np.zeros_like(total), where=kept > 0)
+    values = operator.rates[keep] * scale[kept_origins]
+
+    # cohorts with nothing kept go to the top destination
+    stranded = (kept <= 0) & (total > 0)
+    if stranded.any():
+        first = np.searchsorted(keep, top)
+        values[first] += np.where(stranded, total, 0.0)
+
+    return MigrationOperator(index=operator.index,
+                             origins=operator.origins[keep],
+                             destinations=operator.destinations[keep],
+                             rates=values.astype(operator.rates.dtype, copy=False))
+
+
+class LowRankMigrationOperator():
+    '''
+    Migration with the origin-destination matrix of every AGE x SEX cohort
+    approximated as left @ core[age, sex] @ right.T, where left and right
+    are [GEOID, RANK] bases shared by every cohort. Outflows are exact (each
+    origin's summed rates); inflows are the low-rank product, clipped at
+    zero and rescaled so that every cohort's national inflows equal the
+    exact flows that stay inside the index.
+
+    Parameters:
+        index (CohortIndex): layout of the population arrays.
+        outflow_rates (ndarray): [GEOID, AGE, SEX] summed rates of every
+            origin, including destinations outside the index.
+        inside_rates (ndarray): [GEOID, AGE, SEX] summed rates of every
+            origin to destinations inside the index.
+        left (ndarray): [GEOID, RANK] origin basis.
+        right (ndarray): [GEOID, RANK] destination basis.
+        core (ndarray): [AGE, SEX, RANK, RANK] cohort coefficients.
+    '''
+    def __init__(self, index, outflow_rates, inside_rates, left, right, core):
+        self.index = index
+        self.outflow_rates = outflow_rates
+        self.inside_rates = inside_rates
+        self.left = left
+        self.right = right
+        self.core = core
+
+    @property
+    def rank(self):
+        return self.left.shape[1]
+
+    @property
+    def nbytes(self):
+        return sum(arr.nbytes for arr in (self.outflow_rates, self.inside_rates, self.left, self.right, self.core))
+
+    def flows(self, pop):
+        '''
+        Return (inflows, outflows), both laid out like pop.
+        '''
+        outflows = pop * self.outflow_rates
+
+        projected = np.einsum('...gas,gr->...asr', pop, self.left)
+        projected = np.einsum('...asr,asrq->...asq', projected, self.core)
+        inflows = np.maximum(np.einsum('...asq,gq->...gas', projected, self.right), 0.0)
+
+        exact = (pop * self.inside_rates).sum(axis=-3, keepdims=True)
+        approx = inflows.sum(axis=-3, keepdims=True)
+        inflows = inflows * np.divide(exact, approx, out=np.zeros_like(exact), where=approx > 0)
+
+        return inflows, outflows
+
+    def accumulate(self, pop, inflows, outflows):
+        pair_in, pair_out = self.flows(pop)
+        inflows += pair_in
+        outflows += pair_out
+
+
+def build_low_rank_migration_operator(operator, rank):
+    '''
+    Approximate a MigrationOperator with a LowRankMigrationOperator. The
+    shared bases are the leading singular vectors of the origin-destination
+    matrix summed over every cohort; each cohort's core is its own matrix
+    projected onto them.
+    '''
+    index = operator.index
+    n_geo = len(index.geoids)
+    n_age, n_sex = len(index.ages), len(index.sexes)
+    rates = operator.rates.reshape(operator.n_pairs, n_age * n_sex)
+
+    inside = operator.destinations >= 0
+    outflow_rates = np.zeros((n_geo, n_age * n_sex))
+    outflow_rates[operator._out_geos] = np.add.reduceat(rates, operator._out_starts, axis=0)
+    inside_rates = np.zeros((n_geo, n_age * n_sex))
+    inside_rates[operator._out_geos] = np.add.reduceat(rates * inside[:, np.newaxis], operator._out_starts, axis=0)
+
+    origins = operator.origins[inside]
+    destinations = operator.destinations[inside]
+    rates = rates[inside]
+
+    total = np.zeros((n_geo, n_geo))
+    np.add.at(total, (origins, destinations), rates.sum(axis=1))
+    u, _, vt = np.linalg.svd(total)
+    left = np.ascontiguousarray(u[:, :rank])
+    right = np.ascontiguousarray(vt[:rank].T)
+
+    # core[c] = left.T @ M_c @ right, with M_c @ right as segment sums over
+    # the origin-sorted pairs
+    geos, starts = np.unique(origins, return_index=True)
+    right_pairs = right[destinations]
+    core = np.empty((n_age * n_sex, rank, rank))
+    for c in range(n_age * n_sex):
+        m_right = np.zeros((n_geo, rank))
+        m_right[geos] = np.add.reduceat(rates[:, c, np.newaxis] * right_pairs, starts, axis=0)
+        core[c] = left.T @ m_right
+
+    shape = (n_geo, n_age, n_sex)
+    return LowRankMigrationOperator(index=index,
+                                    outflow_rates=outflow_rates.reshape(shape),
+                                    inside_rates=inside_rates.reshape(shape),
+                                    left=left,
+                                    right=right,
+                                    core=core.reshape(n_age, n_sex, rank, rank))
+
+
+def migration_error_report(reference, candidates, pop, repeats=3):
+    '''
+    Compare compressed migration operators with the full operator on one
+    population.
+
+    Parameters:
+        reference (MigrationOperator): full rates.
+        candidates (dict): label -> compressed operator.
+        pop (ndarray): [GEOID, AGE, SEX] population.
+        repeats (int): flows() calls timed per operator (best is kept).
+
+    Returns:
+        DataFrame: one row per operator with its size, time per flows()
+            call and the errors of its inflows, outflows and net migration
+            relative to the full operator.
+    '''
+    def timed_flows(operator):
+        best = np.inf
+        for _ in range(repeats):
+            start = time.perf_counter()
+            result = operator.flows(pop)
+            best = min(best, time.perf_counter() - start)
+        return result, best
+
+    (ref_in, ref_out), ref_seconds = timed_flows(reference)
+    ref_net = ref_in - ref_out
+
+    rows = []
+    for label, operator in {'full': reference, **candidates}.items():
+        (inflows, outflows), seconds = timed_flows(operator)
+        net = inflows - outflows
+        net_by_geo = np.abs(net.sum(axis=(-2, -1)) - ref_net.sum(axis=(-2, -1)))
+        rows.append({'OPERATOR': label,
+                     'PAIRS': getattr(operator, 'n_pairs', None),
+                     'MB': operator.nbytes / 1024 ** 2,
+                     'SECONDS': seconds,
+                     'SPEEDUP': ref_seconds / seconds if seconds > 0 else np.inf,
+                     'GROSS_MIGRANTS': float(outflows.sum()),
+                     'REL_L1_INFLOWS': float(np.abs(inflows - ref_in).sum() / max(np.abs(ref_in).sum(), 1e-12)),
+                     'REL_L1_OUTFLOWS': float(np.abs(outflows - ref_out).sum() / max(np.abs(ref_out).sum(), 1e-12)),
+                     'REL_L1_NET': float(np.abs(net - ref_net).sum() / max(np.abs(ref_net).sum(), 1e-12)),
+                     'MAX_ABS_NET_GEOID': float(net_by_geo.max())})
+
+    return pl.DataFrame(rows)
+
+
+class ReplicateMigrationOperator(MigrationOperator):
+    '''
+    Bootstrap replicates of a MigrationOperator, stored compactly as float32
+    multipliers of the base rates by pair and age group: the rate of
+    replicate b is rates[pair, age, sex] * multipliers[b, pair,
+    age_groups[age]]. flows() takes a [REPLICATE, GEOID, AGE, SEX]
+    population and visits replicate_batch replicates at a time, so the
+    replicate pair flows are never all in memory.
+
+    Parameters:
+        base (MigrationOperator): the published rates.
+        multipliers (ndarray): [REPLICATE, PAIR, GROUP] rate multipliers.
+        age_groups (ndarray): GROUP position of every age in the index.
+        replicate_batch (int): replicates per vectorized block.
+    '''
+    def __init__(self, base, multipliers, age_groups, replicate_batch=8):
+        super().__init__(index=base.index,
+                         origins=base.origins,
+                         destinations=base.destinations,
+                         rates=base.rates)
+        assert multipliers.shape[1] == base.n_pairs
+        self.multipliers = multipliers
+        self.age_groups = np.asarray(age_groups, dtype=np.int64)
+        self.replicate_batch = replicate_batch
+
+    @property
+    def n_replicates(self):
+        return self.multipliers.shape[0]
+
+    def flows(self, pop):
+        assert pop.shape[:-3] == (self.n_replicates,), "Population needs a leading REPLICATE axis"
+
+        return super().flows(pop)
+
+    def accumulate(self, pop, inflows, outflows):
+        if self.n_pairs == 0:
+            return
+
+        for start in range(0, self.n_replicates, self.replicate_batch):
+            batch = slice(start, start + self.replicate_batch)
+            rates = self.rates * self.multipliers[batch][:, :, self.age_groups, np.newaxis]
+            self.add_flows(rates * np.take(pop[batch], self.origins, axis=-3), inflows[batch], outflows[batch])
+
+
+def replicate_age_groups(index, group_start_ages):
+    '''
+    Position of every age in index within groups that start at
+    group_start_ages (single years of age).
+    '''
+    return np.searchsorted(np.asarray(group_start_ages), np.asarray(index.ages), side='right') - 1
+
+
+def build_replicate_migration_operator(base, replicates, n_replicates=None, replicate_batch=8):
+    '''
+    Line up stacked bootstrap replicates of the migration rates with the
+    pairs of a MigrationOperator.
+
+    Parameters:
+        base (MigrationOperator): the published rates.
+        replicates (dict): arrays origins, destinations and age_groups (one
+            per row), group_labels, group_start_ages and [REPLICATE, ROW]
+            multipliers, as written by the ACS migration script.
+        n_replicates (int): use only the first n_replicates.
+
+    Returns:
+        ReplicateMigrationOperator: pairs and age groups without a
+            replicate row keep multiplier 1.
+    '''
+    index = base.index
+    n_geo = len(index.geoids)
+    multipliers = np.asarray(replicates['multipliers'][:n_replicates], dtype=np.float32)
+    labels = list(replicates['group_labels'])
+
+    rows = pl.DataFrame({'ORIGIN': replicates['origins'], 'DESTINATION': replicates['destinations']})
+    origin = index.positions(rows.select(pl.col('ORIGIN').alias('GEOID')), columns=['GEOID'])
+    destination = index.positions(rows.select(pl.col('DESTINATION').alias('GEOID')), columns=['GEOID'])
+    group = np.array([labels.index(label) for label in replicates['age_groups']], dtype=np.int64)
+
+    # same pair keys as build_migration_operator
+    pair_keys = base.origins * (n_geo + 1) + (base.destinations + 1)
+    key = origin * (n_geo + 1) + (destination + 1)
+    pair = np.searchsorted(pair_keys, key)
+    keep = (origin >= 0) & (pair < pair_keys.size)
+    keep[keep] = pair_keys[pair[keep]] == key[keep]
+
+    stacked = np.ones((multipliers.shape[0], base.n_pairs, len(labels)), dtype=np.float32)
+    stacked[:, pair[keep], group[keep]] = multipliers[:, keep]
+
+    return ReplicateMigrationOperator(base=base,
+                                      multipliers=stacked,
+                                      age_groups=replicate_age_groups(index, replicates['group_start_ages']),
+                                      replicate_batch=replicate_batch)
+
+
+def build_replicate_immigration(index, immigration, replicates, n_replicates=None):
+    '''
+    Bootstrap replicates of a lazy [TIME, GEOID, AGE, SEX] immigration
+    allocation (see build_immigration_tensor). Each replicate multiplies the
+    allocation weights by its destination x age group multipliers and
+    re-normalizes them over GEOID, so every replicate allocates the same
+    national totals.
+
+    Parameters:
+        index (CohortIndex): layout of the allocation weights.
+        immigration (OuterProduct): weights [GEOID, AGE, SEX] times
+            national totals.
+        replicates (dict): arrays destinations and age_groups (one per
+            row), group_labels, group_start_ages and [REPLICATE, ROW]
+            multipliers, as written by the ACS immigration script.
+
+    Returns:
+        OuterProduct: [TIME, REPLICATE, GEOID, AGE, SEX] net immigrants.
+    '''
+    multipliers = np.asarray(replicates['multipliers'][:n_replicates], dtype=np.float64)
+    labels = list(replicates['group_labels'])
+
+    rows = pl.DataFrame({'GEOID': replicates['destinations']})
+    destination = index.positions(rows, columns=['GEOID'])
+    group = np.array([labels.index(label) for label in replicates['age_groups']], dtype=np.int64)
+    keep = destination >= 0
+
+    stacked = np.ones((multipliers.shape[0], len(index.geoids), len(labels)))
+    stacked[:, destination[keep], group[keep]] = multipliers[:, keep]
+
+    weights = immigration.base[np.newaxis] * stacked[:, :, replicate_age_groups(index, replicates['group_start_ages']), np.newaxis]
+    totals = weights.sum(axis=1, keepdims=True)
+    base_totals = immigration.base.sum(axis=0, keepdims=True)
+    weights = np.divide(weights * base_totals, totals, out=np.zeros_like(weights), where=totals > 0)
+
+    return OuterProduct(base=weights,
+                        factors=immigration.factors[:, np.newaxis],
+                        scale=immigration.scale,
+                        dtype=immigration.dtype)
+
+
+def replicate_summary(index, arr, quantiles=(0.05, 0.5, 0.95)):
+    '''
+    Mean, standard deviation and quantiles over the leading REPLICATE axis
+    of arr, as a long table on index.
+    '''
+    arr = np.asarray(arr)
+    columns = [pl.Series('MEAN', arr.mean(axis=0).ravel()),
+               pl.Series('SD', arr.std(axis=0, ddof=1).ravel() if arr.shape[0] > 1 else np.zeros(index.size))]
+    for q, values in zip(quantiles, np.quantile(arr, quantiles, axis=0)):
+        columns.append(pl.Series(f'P{round(q * 100):02d}', values.ravel()))
+
+    return index.key_frame().with_columns(columns)
+
+
+class ChunkedMigrationOperator():
+    '''
+    A MigrationOperator partitioned by origin into chunks that live on disk
+    as memory-mapped .npy files. flows() visits one chunk at a time and adds
+    its partial inflows and outflows into the full arrays, so the peak
+    memory of a step is one chunk plus a few population-sized arrays no
+    matter how many origin-destination pairs there are.
+
+    Parameters:
+        index (CohortIndex): layout of the population arrays.
+        chunks (list): (origins, destinations, rates) arrays of every chunk,
+            as taken by MigrationOperator.
+        params (dict): build parameters, recorded in the saved manifest.
+    '''
+    def __init__(self, index, chunks, params=None):
+        self.index = index
+        self.chunks = list(chunks)
+        self.params = params or {}
+
+    @property
+    def n_pairs(self):
+        return sum(origins.size for origins, _, _ in self.chunks)
+
+    def operators(self):
+        for origins, destinations, rates in self.chunks:
+            yield MigrationOperator(index=self.index,
+                                    origins=origins,
+                                    destinations=destinations,
+                                    rates=rates)
+
+    def flows(self, pop):
+        '''
+        Return (inflows, outflows), both laid out like pop.
+        '''
+        inflows = np.zeros(pop.shape)
+        outflows = np.zeros(pop.shape)
+        for operator in self.operators():
+            operator.accumulate(pop, inflows, outflows)
+
+        return inflows, outflows
+
+    @classmethod
+    def load(cls, folder, mmap=True):
+        '''
+        Open the chunks written by build_chunked_migration_operator().
+        '''
+        with open(os.path.join(folder, MIGRATION_MANIFEST)) as f:
+            manifest = json.load(f)
+
+        mmap_mode = 'r' if mmap else None
+        index = CohortIndex(geoids=manifest['geoids'],
+                            ages=manifest['ages'],
+                            age_col=manifest['age_col'],
+                            sexes=manifest['sexes'])
+        chunks = [tuple(np.load(os.path.join(folder, f'chunk_{i:05d}_{name}.npy'), mmap_mode=mmap_mode)
+                        for name in ('origins', 'destinations', 'rates'))
+                  for i in range(manifest['n_chunks'])]
+
+        return cls(index=index, chunks=chunks, params=manifest['params'])
+
+    @staticmethod
+    def saved_params(folder):
+        '''
+        Return the build parameters of saved chunks, or None.
+        '''
+        manifest = os.path.join(folder, MIGRATION_MANIFEST)
+        if not os.path.isfile(manifest):
+            return None
+        with open(manifest) as f:
+            return json.load(f)['params']
+
+
+def plan_origin_chunks(row_counts, max_rows):
+    '''
+    Group consecutive origins into chunks of at most max_rows O-D rate rows.
+    An origin with more rows than max_rows gets a chunk of its own.
+
+    Returns:
+        list: arrays of the positions (into row_counts) in every chunk.
+    '''
+    chunks = []
+    start = 0
+    total = 0
+    for i, rows in enumerate(row_counts):
+        if total + rows > max_rows and i > start:
+            chunks.append(np.arange(start, i))
+            start = i
+            total = 0
+        total += rows
+    if start < len(row_counts):
+        chunks.append(np.arange(start, len(row_counts)))
+
+    return chunks
+
+
+def build_chunked_migration_operator(index, rates, folder, memory_budget, scale=1.0,
+                                     dtype=np.float64, params=None):
+    '''
+    Build a ChunkedMigrationOperator from an O-D rate table that is too
+    large to load at once, writing the chunks to folder.
+
+    Origins are grouped (in index order) so that loading one chunk of the
+    long table and its pair arrays stays within memory_budget bytes; each
+    chunk is then collected with the streaming engine and converted by
+    build_migration_operator(). The table is staged once as parquet and
+    every chunk is selected by its range of origins, so for tables sorted by
+    origin (as the ACS flows are) each chunk only reads its own row groups.
+
+    Parameters:
+        index (CohortIndex): layout of the population arrays.
+        rates (LazyFrame): ORIGIN_FIPS, DESTINATION_FIPS, age, SEX and
+            MIGRATION_RATE.
+        folder (str): where the chunks and manifest are written.
+        memory_budget (int): bytes available to one chunk.
+        scale (float): applied to every rate.
+        dtype: storage dtype of the rates.
+        params (dict): build parameters, recorded in the manifest.
+
+    Returns:
+        ChunkedMigrationOperator: memory-mapped from folder.
+    '''
+    max_rows = max(int(memory_budget // MIGRATION_ROW_BYTES), 1)
+
+    os.makedirs(folder, exist_ok=True)
+    staged = os.path.join(folder, 'rates.parquet')
+    rates.sink_parquet(staged)
+    rates = pl.scan_parquet(staged)
+
+    # rows per origin, in index order (origins outside the index are dropped)
+    counts = (rates.group_by('ORIGIN_FIPS')
+                   .agg(pl.len().alias('N_ROWS'))
+                   .collect(engine='streaming'))
+    origin = index.positions(counts.select(pl.col('ORIGIN_FIPS').alias('GEOID')), columns=['GEOID'])
+    counts = counts.with_columns(pl.Series('ORIGIN', origin)).filter(pl.col('ORIGIN') >= 0).sort('ORIGIN')
+    origins = counts.get_column('ORIGIN_FIPS').to_list()
+    plan = plan_origin_chunks(counts.get_column('N_ROWS').to_numpy(), max_rows)
+
+    for i, members in enumerate(plan):
+        print(f"Building migration chunk {i + 1} of {len(plan)} ({members.size:,} origins)...")
+        # GEOIDs are sorted, so the chunk is a closed range of origins;
+        # origins in the range that are outside the index are dropped below
+        first, last = origins[members[0]], origins[members[-1]]
+        chunk = rates.filter(pl.col('ORIGIN_FIPS').is_between(pl.lit(first), pl.lit(last))).collect(engine='streaming')
+        operator = build_migration_operator(index, chunk, scale=scale, dtype=dtype)
+        del chunk
+        np.save(os.path.join(folder, f'chunk_{i:05d}_origins.npy'), operator.origins)
+        np.save(os.path.join(folder, f'chunk_{i:05d}_destinations.npy'), operator.destinations)
+        np.save(os.path.join(folder, f'chunk_{i:05d}_rates.npy'), operator.rates)
+    os.remove(staged)
+
+    manifest = {'geoids': index.geoids,
+                'ages': index.ages,
+                'age_col': index.age_col,
+                'sexes': index.sexes,
+                'n_chunks': len(plan),
+                'memory_budget': int(memory_budget),
+                'params': params or {}}
+    with open(os.path.join(folder, MIGRATION_MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+    return ChunkedMigrationOperator.load(folder, mmap=True)
+
+
+class DenseEngine():
+    '''
+    Cohort-component projection on dense [GEOID, AGE, SEX] arrays. One step
+    applies, in the same order as Projector.run: deaths, net immigration,
+    domestic migration, births, aging (the last age is open-ended), and
+    rounding with the fractional remainders carried forward.
+
+    With races, the population carries a leading RACE axis. Rates,
+    immigration and migration without that axis apply to every race;
+    births take the race of the mother.
+
+    Parameters:
+        rates (RateStore): mortality and fertility rates; its index is the
+            layout of the population arrays.
+        immigration (ndarray): [YEAR, GEOID, AGE, SEX] net immigrants on the
+            same index (or an OuterProduct).
+        immigration_years (list): years of the immigration first axis.
+        migration (MigrationOperator): domestic migration on the same index
+            (or a ChunkedMigrationOperator).
+        male_birth_fraction (float): share of births that are male.
+        remainder_mode (str): 'carry' adds the previous step's remainders
+            every step (county model); 'launch' adds the launch population
+            remainders from the second step on (state model).
+        races (list): race/Hispanic origin codes of the population's RACE
+            axis, or None.
+        immigration_shares (ndarray): [RACE, GEOID, AGE, SEX] split of
+            race-less net immigration across races (sums to 1 over RACE).
+        migration_scaling (ndarray): [YEAR, ..., AGE, SEX] factors of every
+            origin cohort's migration rates (see build_migration_scaling),
+            or None to use the migration rates unchanged in every year.
+            With an in-memory MigrationOperator they are capped by
+            cap_migration_scaling.
+        migration_scaling_years (list): years of its first axis.
+        dtype: storage dtype of the population, remainders and ledgers.
+            float32 halves the memory and bandwidth of every step; sums
+            (births, migration, rollups) are still accumulated in float64
+            (see precision_report for the resulting error).
+    '''
+    def __init__(self, rates, immigration, immigration_years, migration,
+                 male_birth_fraction, remainder_mode='carry', races=None,
+                 immigration_shares=None, migration_scaling=None,
+                 migration_scaling_years=None, dtype=np.float64):
+        assert remainder_mode in ('carry', 'launch')
+
+        self.index = rates.index
+        if races is not None and self.index.races is None:
+            self.index = self.index.with_races(races)
+        self.rates = rates
+        self.immigration = immigration
+        self.immigration_years = list(immigration_years)
+        self.migration = migration
+        self.male_birth_fraction = male_birth_fraction
+        self.remainder_mode = remainder_mode
+        self.immigration_shares = immigration_shares
+        # scaled rates are kept below MAX_SCALED_OUT_RATE wherever the rates
+        # are in memory; chunked rates are used as they are
+        if migration_scaling is not None and isinstance(migration, MigrationOperator):
+            migration_scaling = cap_migration_scaling(migration_scaling, migration.max_out_rates())
+        self.migration_scaling = migration_scaling
+        self.migration_scaling_years = None if migration_scaling is None else list(migration_scaling_years)
+        self.dtype = np.dtype(dtype)
+
+        assert immigration.shape[-3:] == self.index.shape[-3:]
+        assert migration.index.shape[-3:] == self.index.shape[-3:]
+        if self.index.races is not None and len(immigration.shape) == 4:
+            assert immigration_shares is not None, "Race-less immigration needs immigration_shares"
+            assert immigration_shares.shape == self.index.shape
+
+    def births(self, pop, year):
+        '''
+        Births by GEOID and SEX, [..., GEOID, SEX].
+        '''
+        total = self.rates.births(pop, year)
+        male = total * self.male_birth_fraction
+        births = np.zeros(total.shape + (len(self.index.sexes),))
+        births[..., self.index.sexes.index('MALE')] = male
+        births[..., self.index.sexes.index('FEMALE')] = total - male
+
+        return births.astype(self.dtype, copy=False)
+
+    def immigrants(self, year):
+        '''
+        Net immigrants of the time step ending in year, split across races
+        if the population has a RACE axis.
+        '''
+        immigrants = self.immigration[self.immigration_years.index(year)]
+        if self.immigration_shares is not None:
+            immigrants = immigrants * self.immigration_shares
+
+        return np.asarray(immigrants).astype(self.dtype, copy=False)
+
+    def migration_flows(self, pop, year):
+        '''
+        Domestic (inflows, outflows) of pop in the time step ending in year.
+        Flows are linear in the origin population, so scaling every origin
+        cohort's rates is the same as scaling the population that the
+        operator sees: one multiply per step instead of rebuilding the
+        origin-destination rates.
+        '''
+        if self.migration_scaling is not None:
+            pop = pop * self.migration_scaling[self.migration_scaling_years.index(year)]
+        inflows, outflows = self.migration.flows(pop)
+
+        return inflows.astype(self.dtype, copy=False), outflows.astype(self.dtype, copy=False)
+
+    @staticmethod
+    def advance_ages(pop, births):
+        '''
+        Move everyone up one age (group); the oldest age is open-ended and
+        births become the youngest age.
+        '''
+        aged = np.empty_like(pop)
+        aged[..., 1:, :] = pop[..., :-1, :]
+        aged[..., -1, :] += pop[..., -1, :]
+        aged[..., 0, :] = births
+
+        return aged
+
+    def step(self, pop, year, remainder, first_step):
+        '''
+        Project pop forward one time step ending in year.
+
+        Returns:
+            ndarray: rounded population.
+            ndarray: fractional remainders of this step.
+            dict: ledgers of the step's components.
+        '''
+        deaths = self.rates.deaths(pop, year).astype(self.dtype, copy=False)
+        pop = pop - deaths
+        assert not (pop < 0).any(), f"Negative population after mortality in {year}"
+
+        immigrants = self.immigrants(year)
+        pop = pop + immigrants
+        assert not (pop < 0).any(), f"Negative population after immigration in {year}"
+
+        inflows, outflows = self.migration_flows(pop, year)
+        pop = pop + (inflows - outflows)
+        assert not (pop < 0).any(), f"Negative population after migration in {year}"
+
+        births = self.births(pop, year)
+        pop = self.advance_ages(pop, births)
+
+        if self.remainder_mode == 'carry' or not first_step:
+            pop = pop + remainder
+
+        rounded = np.round(pop)
+        ledgers = {'deaths': deaths,
+                   'immigration': immigrants,
+                   'inmig': inflows,
+                   'outmig': outflows,
+                   'births': births}
+
+        return rounded, pop - rounded, ledgers
+
+    def iterate(self, launch_pop, launch_remainder, years):
+        '''
+        Project the launch population through every year in years, yielding
+        (year, population, ledgers) after each step so that callers can
+        write results out instead of keeping every year in memory.
+        '''
+        pop = np.asarray(launch_pop).astype(self.dtype, copy=False)
+        remainder = launch_remainder = np.asarray(launch_remainder).astype(self.dtype, copy=False)
+        for i, year in enumerate(years):
+            step_remainder = launch_remainder if self.remainder_mode == 'launch' else remainder
+            pop, remainder, ledgers = self.step(pop, year, step_remainder, first_step=(i == 0))
+            yield year, pop, ledgers
+
+    def run(self, launch_pop, launch_remainder, years, store=None, cube=None, policy=None):
+        '''
+        Project the launch population through every year in years.
+
+        Parameters:
+            store (LedgerStore): if given, every year is written to the store
+                as soon as it is projected instead of being kept in memory.
+            cube (AttributionCube): if given, every year's components of
+                change are added to the cube as they are projected.
+            policy (OutputPolicy): if given, only the detail the policy
+                selects for each year is kept.
+
+        Returns:
+            dict: [YEAR, ...] arrays for 'population' and every component
+                ledger, or the store, or PolicyOutputs with a policy.
+        '''
+        assert store is None or policy is None, "A LedgerStore keeps full detail; use either a store or a policy"
+
+        history = {'population': []}
+        outputs = None if policy is None else PolicyOutputs(self.index, policy)
+        previous = launch_pop
+        for year, pop, ledgers in self.iterate(launch_pop, launch_remainder, years):
+            if cube is not None:
+                cube.add(year, previous, pop, ledgers)
+            previous = pop
+
+            if store is not None:
+                store.write(year, {'population': pop, **ledgers})
+                continue
+            if outputs is not None:
+                outputs.add(year, policy.select(year, pop, ledgers))
+                outputs.final_population = pop
+                continue
+            history['population'].append(pop)
+            for name, ledger in ledgers.items():
+                history.setdefault(name, []).append(ledger)
+
+        if store is not None:
+            return store
+        if outputs is not None:
+            return outputs
+
+        return {name: np.stack(arrays) for name, arrays in history.items()}
+
+    def ledger_frames(self, results, years):
+        '''
+        Convert run() results to the wide ledger tables written by the
+        polars models, keyed by ledger name.
+        '''
+        return ledger_frames(self.index, results, years)
+
+
+def ledger_frame(index, ledger, results, years):
+    '''
+    One wide ledger table ('population', 'deaths', 'immigration',
+    'migration' or 'births') from [YEAR, ...] arrays laid out on index;
+    migration is built from the 'inmig' and 'outmig' arrays.
+    '''
+    labels = [str(year) for year in years]
+    if ledger in ('population', 'deaths', 'immigration'):
+        return index.ledger_frame(results[ledger], labels)
+
+    if ledger == 'migration':
+        migration = index.key_frame()
+        for i, year in enumerate(years):
+            migration = migration.with_columns([pl.Series(f'INMIG{year}', np.asarray(results['inmig'][i]).ravel()),
+                                                pl.Series(f'OUTMIG{year}', np.asarray(results['outmig'][i]).ravel()),
+                                                pl.Series(f'NETMIG{year}', np.asarray(results['inmig'][i] - results['outmig'][i]).ravel())])
+        return migration
+
+    keys = ['GEOID', 'SEX'] if index.races is None else ['RACE', 'GEOID', 'SEX']
+    births = pl.DataFrame(data=list(itertools.product(*(index.levels()[col] for col in keys))),
+                          schema=keys,
+                          orient='row')
+    flat = np.asarray(results['births']).reshape(len(years), -1)
+    births = births.with_columns([pl.Series(label, flat[i]) for i, label in enumerate(labels)])
+
+    return births.with_columns(pl.lit(index.ages[0]).alias(index.age_col))
+
+
+def ledger_frames(index, results, years):
+    '''
+    Convert [YEAR, ...] population and component arrays laid out on index
+    to the wide ledger tables written by the polars models, keyed by ledger
+    name.
+    '''
+    return {ledger: ledger_frame(index, ledger, results, years) for ledger in OUTPUT_LEDGERS}
+
+
+class OutputPolicy():
+    '''
+    Which detail of every output ledger a DenseEngine run keeps, and in
+    which years, so that detail nobody reads is never stacked or written.
+    Every ledger has one detail for the milestone years and one for all
+    other years:
+
+        'full'        [GEOID, AGE, SEX], as without a policy
+        a level       summed to a GeographyIndex level ('STATE', 'NATION',
+                      ...), still by age and sex
+        None          not kept (an AttributionCube still sees every
+                      component, so None everywhere is attribution only)
+
+    Parameters:
+        rules (dict): ledger in OUTPUT_LEDGERS -> (milestone detail,
+            other-year detail); ledgers without a rule are not kept.
+        milestone_years (list): years that get the milestone detail.
+        geography (GeographyIndex): hierarchy of the level details.
+    '''
+    def __init__(self, rules, milestone_years=(), geography=None):
+        unknown = set(rules) - set(OUTPUT_LEDGERS)
+        assert not unknown, f"Unknown output ledgers: {sorted(unknown)}"
+
+        self.rules = {ledger: tuple(rule) for ledger, rule in rules.items()}
+        self.milestone_years = set(milestone_years)
+        self.geography = geography
+        for ledger, rule in self.rules.items():
+            for detail in rule:
+                assert detail in (None, 'full') or (geography is not None and detail in geography.levels), \
+                    f"Unknown detail for {ledger}: {detail}"
+
+    @classmethod
+    def parse(cls, specs, milestone_years=(), geography=None):
+        '''
+        Build a policy from 'ledger=milestone,other' strings, e.g.
+        ['population=full,STATE', 'deaths=STATE,none', 'migration=none,none'].
+        '''
+        rules = {}
+        for spec in specs:
+            ledger, details = spec.split('=')
+            rules[ledger] = tuple(None if detail.lower() == 'none' else detail if detail == 'full' else detail.upper()
+                                  for detail in details.split(','))
+
+        return cls(rules, milestone_years, geography)
+
+    def detail(self, ledger, year):
+        milestone, other = self.rules.get(ledger, (None, None))
+        return milestone if year in self.milestone_years else other
+
+    def select(self, year, pop, ledgers):
+        '''
+        The kept arrays of one year: (ledger, detail) -> {array name:
+        array}, rolled up to the detail's level.
+        '''
+        arrays = {'population': pop, **ledgers}
+        selected = {}
+        for ledger, names in OUTPUT_LEDGERS.items():
+            detail = self.detail(ledger, year)
+            if detail is None:
+                continue
+            if detail == 'full':
+                selected[(ledger, detail)] = {name: arrays[name] for name in names}
+            else:
+                selected[(ledger, detail)] = rollup_results(self.geography, detail, {name: arrays[name] for name in names})
+
+        return selected
+
+
+class PolicyOutputs():
+    '''
+    The arrays an OutputPolicy kept during a run, by (ledger, detail), each
+    with its own years.
+    '''
+    def __init__(self, index, policy):
+        self.index = index
+        self.policy = policy
+        self.years = {}
+        self.arrays = {}
+        # full population of the last year, for continuing the run
+        self.final_population = None
+
+    def add(self, year, selected):
+        for key, arrays in selected.items():
+            self.years.setdefault(key, []).append(year)
+            for name, arr in arrays.items():
+                self.arrays.setdefault(key, {}).setdefault(name, []).append(arr)
+
+    def results(self, ledger, detail):
+        return {name: np.stack(arrays) for name, arrays in self.arrays[(ledger, detail)].items()}
+
+    def frames(self):
+        '''
+        Wide tables of every kept (ledger, detail), laid out like
+        ledger_frames() on the GEOIDs or on the parents of the level.
+        '''
+        frames = {}
+        for ledger, detail in self.arrays:
+            index = self.index
+            if detail != 'full':
+                index = self.policy.geography.parent_index(self.index, detail)
+            frames[(ledger, detail)] = ledger_frame(index, ledger, self.results(ledger, detail), self.years[(ledger, detail)])
+
+        return frames
+
+
+class AttributionCube():
+    '''
+    Components of change by YEAR and GEOID (optionally also by age), summed
+    over sex and race while a DenseEngine runs, so reporting can read a
+    small table instead of re-aggregating the full ledgers. For every GEOID
+    and year:
+
+        POPULATION = previous POPULATION + BIRTHS - DEATHS + IMMIGRATION
+                     + INMIG - OUTMIG + ROUNDING
+
+    where ROUNDING is the net effect of rounding to whole persons and
+    carrying the fractional remainders. With by_age, deaths, immigration
+    and migration are by age at the start of the step, births are in the
+    youngest age, and POPULATION and ROUNDING are by age at the end of the
+    step. Because of aging, the identity then holds only over all ages.
+
+    Parameters:
+        index (CohortIndex): layout of the engine's population arrays.
+        by_age (bool): keep the age axis.
+    '''
+    def __init__(self, index, by_age=False):
+        self.index = index
+        self.by_age = by_age
+        self.years = []
+        self.arrays = {name: [] for name in ATTRIBUTION_COMPONENTS + ['POPULATION']}
+
+    def reduce(self, arr):
+        '''
+        Sum an array that broadcasts to the index shape down to [GEOID] or
+        [GEOID, AGE].
+        '''
+        arr = np.asarray(arr)
+        assert arr.ndim <= len(self.index.shape), "AttributionCube does not support leading batch axes"
+        arr = np.broadcast_to(arr, self.index.shape).sum(axis=-1, dtype=np.float64)
+        if self.index.races is not None:
+            arr = arr.sum(axis=0)
+
+        return arr if self.by_age else arr.sum(axis=-1)
+
+    def add(self, year, previous, pop, ledgers):
+        '''
+        Add one step: the population before (previous) and after (pop) the
+        step ending in year, and the step's ledgers.
+        '''
+        survivors = previous - ledgers['deaths'] + ledgers['immigration'] + ledgers['inmig'] - ledgers['outmig']
+        rounding = pop - DenseEngine.advance_ages(survivors, ledgers['births'])
+
+        # births are [(RACE,) GEOID, SEX]
+        births = np.asarray(ledgers['births']).sum(axis=-1)
+        if self.index.races is not None:
+            births = births.sum(axis=0)
+        if self.by_age:
+            births = np.concatenate([births[:, None], np.zeros((len(births), len(self.index.ages) - 1))], axis=1)
+
+        self.years.append(year)
+        step = {'BIRTHS': births,
+                'DEATHS': self.reduce(ledgers['deaths']),
+                'IMMIGRATION': self.reduce(ledgers['immigration']),
+                'INMIG': self.reduce(ledgers['inmig']),
+                'OUTMIG': self.reduce(ledgers['outmig']),
+                'ROUNDING': self.reduce(rounding),
+                'POPULATION': self.reduce(pop)}
+        for name, arr in step.items():
+            self.arrays[name].append(arr)
+
+    def frame(self):
+        '''
+        Long YEAR, GEOID, (age,) components, POPULATION table.
+        '''
+        n_geoids = len(self.index.geoids)
+        n_ages = len(self.index.ages) if self.by_age else 1
+        rows = len(self.years) * n_geoids * n_ages
+
+        columns = {'YEAR': np.repeat(self.years, n_geoids * n_ages),
+                   'GEOID': pl.Series(self.index.geoids).gather(np.tile(np.repeat(np.arange(n_geoids), n_ages), len(self.years)))}
+        if self.by_age:
+            columns[self.index.age_col] = pl.Series(self.index.ages).gather(np.tile(np.arange(n_ages), rows // n_ages))
+        for name, arrays in self.arrays.items():
+            columns[name] = np.concatenate([np.ravel(arr) for arr in arrays]) if arrays else np.zeros(0)
+
+        return pl.DataFrame(columns)
+
+    def write(self, path):
+        '''
+        Write the cube to a parquet file.
+        '''
+        self.frame().write_parquet(path)
+
+
+def read_attribution(path, years=None, geoids=None, states=False, by_age=True):
+    '''
+    Read an AttributionCube parquet file, reading only the requested years
+    and GEOIDs.
+
+    Parameters:
+        years (list): years to read (default all).
+        geoids (list): GEOIDs to read, before any state rollup (default all).
+        states (bool): sum the GEOIDs to states (first two characters).
+        by_age (bool): keep the age column if the cube has one.
+
+    Returns:
+        DataFrame: YEAR, GEOID, (age,) components, POPULATION.
+    '''
+    cube = pl.scan_parquet(path)
+    if years is not None:
+        cube = cube.filter(pl.col('YEAR').is_in(list(years)))
+    if geoids is not None:
+        cube = cube.filter(pl.col('GEOID').is_in(list(geoids)))
+    if states:
+        cube = cube.with_columns(pl.col('GEOID').str.slice(0, 2))
+
+    keys = [col for col in cube.collect_schema().names()
+            if col in ('YEAR', 'GEOID') or (by_age and col in ('AGE', 'AGE_GROUP'))]
+    values = ATTRIBUTION_COMPONENTS + ['POPULATION']
+
+    return cube.group_by(keys).agg(pl.col(values).sum()).sort(keys).collect()
+
+
+def group_geoids(geoids, width):
+    '''
+    Group GEOIDs by their first width characters (2 for states), as
+    {prefix: [GEOID, ...]}.
+    '''
+    groups = {}
+    for geoid in geoids:
+        groups.setdefault(geoid[:width], []).append(geoid)
+
+    return groups
+
+
+def geoid_totals(index, arr):
+    '''
+    Sum an array laid out on index (with any leading batch axes) over age,
+    sex and race, leaving [..., GEOID].
+    '''
+    arr = np.asarray(arr).sum(axis=(-2, -1), dtype=np.float64)
+    if index.races is not None:
+        arr = arr.sum(axis=-2)
+
+    return arr
+
+
+def tangent_step(engine, pop, tangent, year, masks):
+    '''
+    One unrounded DenseEngine step of pop together with its forward-mode
+    derivatives. Every rate family is scaled by (1 + theta * mask), and
+    tangent holds d(pop)/d(theta) of every direction along a leading axis.
+    The step is linear in the population and in each rate family, so the
+    derivative of every component is the component applied to the tangent
+    plus the component applied to the masked population.
+
+    Parameters:
+        masks (dict): family -> [DIRECTION, ..., GEOID, 1, 1] scale of the
+            family's rates in every direction (migration rates are scaled
+            by origin).
+
+    Returns:
+        ndarray: the population after the step.
+        ndarray: its tangent.
+    '''
+    deaths = engine.rates.deaths(pop, year)
+    d_deaths = engine.rates.deaths(tangent + masks['mortality'] * pop, year)
+    pop = pop - deaths
+    tangent = tangent - d_deaths
+
+    immigrants = engine.immigrants(year)
+    pop = pop + immigrants
+    tangent = tangent + masks['immigration'] * immigrants
+
+    inflows, outflows = engine.migration_flows(pop, year)
+    d_inflows, d_outflows = engine.migration_flows(tangent + masks['migration'] * pop, year)
+    pop = pop + (inflows - outflows)
+    tangent = tangent + (d_inflows - d_outflows)
+
+    births = engine.births(pop, year)
+    d_births = engine.births(tangent + masks['fertility'] * pop, year)
+
+    return engine.advance_ages(pop, births), engine.advance_ages(tangent, d_births)
+
+
+def elasticities(engine, launch_pop, years, families=SENSITIVITY_FAMILIES, scopes=None, outputs=None,
+                 report_years=None, batch=8):
+    '''
+    Elasticities of total population with respect to each rate family,
+    computed in one forward-mode pass per batch of directions instead of one
+    perturbed run per direction. A direction scales one family's rates
+    (fertility, mortality, net immigration or out-migration) in one scope of
+    GEOIDs; the elasticity of an output is d(log output)/d(log rates), the
+    percent change of the output per percent change of the rates.
+
+    The population is not rounded, so the derivatives are exact for the
+    unrounded projection.
+
+    Parameters:
+        engine (DenseEngine): the engine to differentiate.
+        launch_pop (ndarray): unrounded launch population on engine.index.
+        years (list): projection years.
+        families (list): rate families to perturb.
+        scopes (dict): label -> GEOIDs whose rates are scaled together
+            (default {'ALL': every GEOID}; see group_geoids).
+        outputs (dict): label -> GEOIDs summed into each output (default one
+            output per GEOID).
+        report_years (list): years to report (default every year).
+        batch (int): directions projected at once; memory grows with it.
+
+    Returns:
+        DataFrame: YEAR, OUTPUT, FAMILY, SCOPE, POPULATION, DERIVATIVE and
+            ELASTICITY.
+    '''
+    index = engine.index
+    position = {geoid: i for i, geoid in enumerate(index.geoids)}
+    scopes = scopes or {'ALL': index.geoids}
+    outputs = outputs or {geoid: [geoid] for geoid in index.geoids}
+    report_years = list(years) if report_years is None else list(report_years)
+    assert set(families) <= set(SENSITIVITY_FAMILIES), f"Unknown rate families: {set(families) - set(SENSITIVITY_FAMILIES)}"
+
+    directions = [(family, scope) for family in families for scope in scopes]
+    print(f"Differentiating {len(outputs):,} outputs along {len(directions):,} directions")
+
+    # GEOID -> output sums
+    aggregate = np.zeros((len(index.geoids), len(outputs)))
+    for j, members in enumerate(outputs.values()):
+        aggregate[[position[geoid] for geoid in members], j] = 1.0
+
+    launch_pop = np.asarray(launch_pop, dtype=np.float64)
+    frames = []
+    for start in range(0, len(directions), batch):
+        chunk = directions[start:start + batch]
+        masks = {family: np.zeros((len(chunk),) + (1,) * (launch_pop.ndim - 3) + (len(index.geoids), 1, 1))
+                 for family in SENSITIVITY_FAMILIES}
+        for d, (family, scope) in enumerate(chunk):
+            masks[family][d, ..., [position[geoid] for geoid in scopes[scope]], :, :] = 1.0
+
+        pop = launch_pop
+        tangent = np.zeros((len(chunk),) + launch_pop.shape)
+        for year in years:
+            pop, tangent = tangent_step(engine, pop, tangent, year, masks)
+            if year not in report_years:
+                continue
+
+            totals = geoid_totals(index, pop) @ aggregate
+            derivatives = geoid_totals(index, tangent) @ aggregate
+            frames.append(pl.DataFrame({'YEAR': year,
+                                        'OUTPUT': np.tile(list(outputs), len(chunk)),
+                                        'FAMILY': np.repeat([family for family, _ in chunk], len(outputs)),
+                                        'SCOPE': np.repeat([scope for _, scope in chunk], len(outputs)),
+                                        'POPULATION': np.tile(totals, len(chunk)),
+                                        'DERIVATIVE': derivatives.ravel()}))
+
+    report = pl.concat(frames)
+    report = report.with_columns(pl.when(pl.col('POPULATION') > 0)
+                                   .then(pl.col('DERIVATIVE') / pl.col('POPULATION'))
+                                   .otherwise(None)
+                                   .alias('ELASTICITY'))
+
+    return report.sort(['YEAR', 'FAMILY', 'SCOPE', 'OUTPUT'])
+
+
+def plan_state_shards(geoids, n_shards, weights=None):
+    '''
+    Partition sorted GEOIDs into at most n_shards contiguous ranges that
+    never split a state (the first two characters of the GEOID), balanced
+    by weights (one per GEOID, e.g. population; default one each).
+
+    Returns:
+        list: (start, stop) GEOID positions of every shard.
+    '''
+    geoids = list(geoids)
+    assert geoids == sorted(geoids), "GEOIDs must be sorted"
+    weights = np.ones(len(geoids)) if weights is None else np.asarray(weights, dtype=np.float64)
+
+    state_starts = GeographyIndex(geoids, {'STATE': [geoid[:2] for geoid in geoids]}).levels['STATE']['starts']
+    state_starts = state_starts.tolist() + [len(geoids)]
+    cumulative = np.concatenate([[0.0], np.cumsum(weights)])
+    target = cumulative[-1] / max(n_shards, 1)
+
+    shards = []
+    start = 0
+    for stop in state_starts[1:]:
+        remaining = n_shards - len(shards) - 1
+        last_state = stop == len(geoids)
+        if last_state or (remaining > 0 and cumulative[stop] - cumulative[start] >= target):
+            shards.append((start, stop))
+            start = stop
+
+    return shards
+
+
+class ShardMigration():
+    '''
+    The part of a MigrationOperator whose origins are in one shard, as seen
+    by that shard's worker. flows() computes the shard's outflows locally
+    and exchanges inflows with the other shards like a reduce-scatter: the
+    migrants bound for every other shard are summed by destination and sent
+    to that shard's inbox, and the shard's own inflows are the sum of what
+    every shard sent to it. Messages are tagged with the step so a shard
+    that runs ahead does not mix up steps.
+
+    Parameters:
+        operator (MigrationOperator): the full operator.
+        shards (list): (start, stop) GEOID positions of every shard.
+        shard (int): this shard.
+        inboxes (list): one queue per shard.
+    '''
+    def __init__(self, operator, shards, shard, inboxes):
+        start, stop = shards[shard]
+        self.index = operator.index.with_geoids(operator.index.geoids[start:stop])
+        self.shards = shards
+        self.shard = shard
+        self.inboxes = inboxes
+        self.step = 0
+        self.pending = {}
+
+        local = (operator.origins >= start) & (operator.origins < stop)
+        self.local = MigrationOperator(index=self.index,
+                                       origins=operator.origins[local] - start,
+                                       destinations=np.full(local.sum(), -1),
+                                       rates=np.ascontiguousarray(operator.rates[local]))
+
+        # pairs bound for every shard, ordered by destination for the sums
+        destinations = operator.destinations[local]
+        self.routes = []
+        for first, last in shards:
+            pairs = np.flatnonzero((destinations >= first) & (destinations < last))
+            pairs = pairs[np.argsort(destinations[pairs], kind='stable')]
+            geos, starts = np.unique(destinations[pairs] - first, return_index=True)
+            self.routes.append((pairs, geos, starts))
+
+    def flows(self, pop):
+        '''
+        Return (inflows, outflows) of this shard, both laid out like pop.
+        '''
+        inflows = np.zeros(pop.shape)
+        outflows = np.zeros(pop.shape)
+        flow = np.empty(pop.shape[:-3] + (0,) + pop.shape[-2:])
+        if self.local.n_pairs > 0:
+            flow = self.local.pair_flows(pop)
+            outflows[..., self.local._out_geos, :, :] = np.add.reduceat(flow, self.local._out_starts, axis=-3, dtype=np.float64)
+
+        for target, (pairs, geos, starts) in enumerate(self.routes):
+            sums = None
+            if pairs.size > 0:
+                sums = np.add.reduceat(np.take(flow, pairs, axis=-3), starts, axis=-3, dtype=np.float64)
+            if target == self.shard:
+                if sums is not None:
+                    inflows[..., geos, :, :] += sums
+            else:
+                self.inboxes[target].put((self.step, geos, sums))
+
+        received = self.pending.pop(self.step, [])
+        while len(received) < len(self.shards) - 1:
+            try:
+                step, geos, sums = self.inboxes[self.shard].get(timeout=SHARD_EXCHANGE_TIMEOUT)
+            except queue.Empty:
+                raise RuntimeError(f"Shard {self.shard} received migrants from {len(received)} of "
+                                   f"{len(self.shards) - 1} shards within {SHARD_EXCHANGE_TIMEOUT:.0f} seconds")
+            if step == self.step:
+                received.append((geos, sums))
+            else:
+                self.pending.setdefault(step, []).append((geos, sums))
+
+        for geos, sums in received:
+            if sums is not None:
+                inflows[..., geos, :, :] += sums
+
+        self.step += 1
+
+        return inflows, outflows
+
+
+def slice_geoids(arr, start, stop):
+    '''
+    GEOID positions start:stop of an array (or OuterProduct) whose GEOID
+    axis is third from last.
+    '''
+    if isinstance(arr, OuterProduct):
+        return OuterProduct(base=np.ascontiguousarray(arr.base[..., start:stop, :, :]),
+                            factors=arr.factors,
+                            scale=arr.scale,
+                            dtype=arr.dtype)
+
+    return np.ascontiguousarray(np.asarray(arr)[..., start:stop, :, :])
+
+
+def run_shard(shard, engine, launch_pop, launch_remainder, years, results):
+    '''
+    Worker process of a ShardedEngine: project one shard's DenseEngine and
+    send (year, shard, population, ledgers) down the results pipe after
+    every step, or ('error', shard, traceback) if anything fails.
+    '''
+    try:
+        for year, pop, ledgers in engine.iterate(launch_pop, launch_remainder, years):
+            results.send((year, shard, pop, ledgers))
+    except Exception:
+        results.send(('error', shard, traceback.format_exc()))
+    finally:
+        results.close()
+
+
+class ShardedEngine(DenseEngine):
+    '''
+    A DenseEngine that partitions the GEOIDs into contiguous shards (whole
+    states, see plan_state_shards) and projects every shard in its own
+    worker process. Mortality, immigration, fertility, aging and rounding
+    are local to a shard; the only exchange is the migrants every shard
+    sends to the others each step (see ShardMigration). The main process
+    gathers every shard's results and yields them as DenseEngine.iterate()
+    does, so run(), LedgerStore output and ledger_frames() are unchanged.
+
+    The inbox queues are the only transport between shards, so the workers
+    could be moved to other machines by swapping them for a networked
+    queue. Each worker sends its results to the main process down its own
+    pipe, so a worker that dies mid-run raises RuntimeError in iterate()
+    instead of blocking it.
+
+    Parameters:
+        engine (DenseEngine): the engine to shard; its migration must be a
+            MigrationOperator.
+        shards (list): (start, stop) GEOID positions of every shard.
+    '''
+    def __init__(self, engine, shards):
+        assert isinstance(engine.migration, MigrationOperator) and not isinstance(engine.migration, ReplicateMigrationOperator), \
+            "Sharding needs an in-memory MigrationOperator"
+        assert shards[0][0] == 0 and shards[-1][1] == len(engine.index.geoids)
+        assert all(a[1] == b[0] for a, b in zip(shards[:-1], shards[1:])), "Shards must be contiguous"
+
+        super().__init__(rates=engine.rates,
+                         immigration=engine.immigration,
+                         immigration_years=engine.immigration_years,
+                         migration=engine.migration,
+                         male_birth_fraction=engine.male_birth_fraction,
+                         remainder_mode=engine.remainder_mode,
+                         races=engine.index.races,
+                         immigration_shares=engine.immigration_shares,
+                         migration_scaling=engine.migration_scaling,
+                         migration_scaling_years=engine.migration_scaling_years,
+                         dtype=engine.dtype)
+        self.shards = shards
+
+    def shard_engine(self, shard, inboxes):
+        '''
+        The DenseEngine of one shard: its slices of the rates, immigration
+        and race shares, and its ShardMigration.
+        '''
+        start, stop = self.shards[shard]
+        shares = self.immigration_shares
+        return DenseEngine(rates=self.rates.subset(self.rates.index.geoids[start:stop]),
+                           immigration=slice_geoids(self.immigration, start, stop),
+                           immigration_years=self.immigration_years,
+                           migration=ShardMigration(self.migration, self.shards, shard, inboxes),
+                           male_birth_fraction=self.male_birth_fraction,
+                           remainder_mode=self.remainder_mode,
+                           races=self.index.races,
+                           immigration_shares=None if shares is None else slice_geoids(shares, start, stop),
+                           migration_scaling=self.migration_scaling,
+                           migration_scaling_years=self.migration_scaling_years,
+                           dtype=self.dtype)
+
+    def iterate(self, launch_pop, launch_remainder, years):
+        # spawn works the same on Windows and Linux; every worker is sent
+        # only its own shard
+        context = multiprocessing.get_context('spawn')
+        inboxes = [context.Queue() for _ in self.shards]
+        # one pipe per worker: when a worker dies, however it dies, its end
+        # of the pipe closes and the parent reads EOF instead of blocking
+        pipes = [context.Pipe(duplex=False) for _ in self.shards]
+        workers = [context.Process(target=run_shard,
+                                   args=(shard,
+                                         self.shard_engine(shard, inboxes),
+                                         slice_geoids(launch_pop, start, stop),
+                                         slice_geoids(launch_remainder, start, stop),
+                                         years,
+                                         pipes[shard][1]),
+                                   daemon=True)
+                   for shard, (start, stop) in enumerate(self.shards)]
+        for worker in workers:
+            worker.start()
+        for _, sender in pipes:
+            sender.close()
+
+        try:
+            readers = {reader: shard for shard, (reader, _) in enumerate(pipes)}
+            received = {}
+            reported = [0] * len(self.shards)
+            for year in years:
+                while len(received.get(year, {})) < len(self.shards):
+                    if not readers:
+                        raise RuntimeError(f"Every shard exited before reporting {year}")
+                    for reader in multiprocessing.connection.wait(list(readers)):
+                        shard = readers[reader]
+                        try:
+                            message = reader.recv()
+                        except (EOFError, OSError):
+                            # OSError: the worker died part way through a message
+                            del readers[reader]
+                            if reported[shard] < len(years):
+                                workers[shard].join(SHARD_EXIT_SECONDS)
+                                raise RuntimeError(f"Shard {shard} exited with code {workers[shard].exitcode} "
+                                                   f"after reporting {reported[shard]} of {len(years)} years")
+                            continue
+                        if message[0] == 'error':
+                            raise RuntimeError(f"Shard {message[1]} failed:\n{message[2]}")
+                        step_year, shard, pop, ledgers = message
+                        reported[shard] += 1
+                        received.setdefault(step_year, {})[shard] = (pop, ledgers)
+
+                parts = received.pop(year)
+                parts = [parts[shard] for shard in range(len(self.shards))]
+                pop = np.concatenate([part[0] for part in parts], axis=-3)
+                ledgers = {name: np.concatenate([part[1][name] for part in parts], axis=-2 if name == 'births' else -3)
+                           for name in parts[0][1]}
+                yield year, pop, ledgers
+
+            for worker in workers:
+                worker.join()
+        finally:
+            for worker in workers:
+                if worker.is_alive():
+                    worker.terminate()
+                    worker.join()
+
+
+def survival_kernel(pop, mortality, immigrants, deaths, survivors, negative):
+    '''
+    Deaths and net immigration of every [BATCH, GEOID, AGE, SEX] cell in
+    one pass; survivors receives the population after both.
+    '''
+    n_batch, n_geo, n_age, n_sex = pop.shape
+    for g in numba.prange(n_geo):
+        for b in range(n_batch):
+            bi = b if immigrants.shape[0] > 1 else 0
+            for a in range(n_age):
+                for s in range(n_sex):
+                    d = pop[b, g, a, s] * mortality[g, a, s]
+                    deaths[b, g, a, s] = d
+                    x = pop[b, g, a, s] - d
+                    if x < 0:
+                        negative[0] = 1
+                    x = x + immigrants[bi, g, a, s]
+                    if x < 0:
+                        negative[1] = 1
+                    survivors[b, g, a, s] = x
+
+
+def outflow_kernel(pop, scale, rates, multipliers, age_groups, out_geos, out_starts, outflows):
+    '''
+    Outflows of every origin: the segment sum of its pairs' flows. The
+    rate of a pair is rates[pair, age, sex] * multipliers[batch, pair,
+    age_groups[age]], where multipliers of shape [1, 1, 1] leave the rates
+    unchanged.
+    '''
+    n_batch, n_geo, n_age, n_sex = pop.shape
+    n_pairs = rates.shape[0]
+    for k in numba.prange(out_geos.size):
+        o = out_geos[k]
+        stop = out_starts[k + 1] if k + 1 < out_geos.size else n_pairs
+        for b in range(n_batch):
+            bm = b if multipliers.shape[0] > 1 else 0
+            for p in range(out_starts[k], stop):
+                pm = p if multipliers.shape[1] > 1 else 0
+                for a in range(n_age):
+                    m = multipliers[bm, pm, age_groups[a]]
+                    for s in range(n_sex):
+                        outflows[b, o, a, s] += (rates[p, a, s] * m) * (pop[b, o, a, s] * scale[a, s])
+
+
+def inflow_kernel(pop, scale, rates, multipliers, age_groups, origins, in_order, in_geos, in_starts, inflows):
+    '''
+    Inflows of every destination, visiting its pairs in destination order
+    so that every destination is written by one thread.
+    '''
+    n_batch, n_geo, n_age, n_sex = pop.shape
+    for k in numba.prange(in_geos.size):
+        d = in_geos[k]
+        stop = in_starts[k + 1] if k + 1 < in_geos.size else in_order.size
+        for b in range(n_batch):
+            bm = b if multipliers.shape[0] > 1 else 0
+            for j in range(in_starts[k], stop):
+                p = in_order[j]
+                o = origins[p]
+                pm = p if multipliers.shape[1] > 1 else 0
+                for a in range(n_age):
+                    m = multipliers[bm, pm, age_groups[a]]
+                    for s in range(n_sex):
+                        inflows[b, d, a, s] += (rates[p, a, s] * m) * (pop[b, o, a, s] * scale[a, s])
+
+
+def aging_kernel(survivors, inflows, outflows, fertility, remainder, add_remainder, male_fraction, male, female,
+                 births, rounded, fractions, negative):
+    '''
+    Net migration, births, aging (the last age is open-ended), the
+    remainders and rounding of every GEOID in one pass.
+    '''
+    n_batch, n_geo, n_age, n_sex = survivors.shape
+    for g in numba.prange(n_geo):
+        for b in range(n_batch):
+            br = b if remainder.shape[0] > 1 else 0
+            total = 0.0
+            for a in range(n_age):
+                for s in range(n_sex):
+                    x = survivors[b, g, a, s] + (inflows[b, g, a, s] - outflows[b, g, a, s])
+                    if x < 0:
+                        negative[2] = 1
+                    survivors[b, g, a, s] = x
+                    total += x * fertility[g, a, s]
+            births[b, g, male] = total * male_fraction
+            births[b, g, female] = total - births[b, g, male]
+
+            for a in range(n_age):
+                for s in range(n_sex):
+                    if a == 0:
+                        x = births[b, g, s]
+                    elif a == n_age - 1:
+                        x = survivors[b, g, a - 1, s] + survivors[b, g, a, s]
+                    else:
+                        x = survivors[b, g, a - 1, s]
+                    if add_remainder:
+                        x = x + remainder[br, g, a, s]
+                    r = np.rint(x)
+                    rounded[b, g, a, s] = r
+                    fractions[b, g, a, s] = x - r
+
+
+if numba is not None:
+    survival_kernel = numba.njit(parallel=True, cache=True)(survival_kernel)
+    outflow_kernel = numba.njit(parallel=True, cache=True)(outflow_kernel)
+    inflow_kernel = numba.njit(parallel=True, cache=True)(inflow_kernel)
+    aging_kernel = numba.njit(parallel=True, cache=True)(aging_kernel)
+
+
+class CompiledEngine(DenseEngine):
+    '''
+    A DenseEngine whose step runs as Numba-compiled kernels instead of a
+    chain of NumPy expressions: deaths and immigration in one pass over the
+    cells, domestic migration as sparse sums over the origin-destination
+    pairs (by origin for outflows, by destination for inflows), and net
+    migration, births, aging, remainders and rounding in a second pass.
+    Every kernel runs in parallel over GEOIDs (prange) and the only arrays
+    allocated per step are one scratch population and the results, so
+    batched runs (replicates, scenarios on a leading axis) are bound by
+    arithmetic instead of temporaries.
+
+    Without Numba, and for engines the kernels do not cover (races,
+    chunked, low-rank or sharded migration, GEOID-specific migration
+    scaling), step() is DenseEngine.step(). The two agree up to the order
+    of floating-point sums.
+
+    Parameters:
+        engine (DenseEngine): the engine to compile.
+    '''
+    def __init__(self, engine):
+        super().__init__(rates=engine.rates,
+                         immigration=engine.immigration,
+                         immigration_years=engine.immigration_years,
+                         migration=engine.migration,
+                         male_birth_fraction=engine.male_birth_fraction,
+                         remainder_mode=engine.remainder_mode,
+                         races=engine.index.races,
+                         immigration_shares=engine.immigration_shares,
+                         migration_scaling=engine.migration_scaling,
+                         migration_scaling_years=engine.migration_scaling_years,
+                         dtype=engine.dtype)
+
+        self.compiled = self.fallback_reason() is None
+        if not self.compiled:
+            print(f"Using the NumPy step: {self.fallback_reason()}")
+            return
+
+        n_age, n_sex = len(self.index.ages), len(self.index.sexes)
+        migration = self.migration
+        if isinstance(migration, ReplicateMigrationOperator):
+            self.multipliers = migration.multipliers
+            self.age_groups = migration.age_groups
+        else:
+            self.multipliers = np.ones((1, 1, 1))
+            self.age_groups = np.zeros(n_age, dtype=np.int64)
+        self.unscaled = np.ones((n_age, n_sex))
+
+    def fallback_reason(self):
+        '''
+        Why the kernels cannot run this engine, or None.
+        '''
+        if numba is None:
+            return "Numba is not installed"
+        if self.index.races is not None:
+            return "the population has a RACE axis"
+        if not isinstance(self.migration, MigrationOperator):
+            return f"{type(self.migration).__name__} migration is not compiled"
+        if self.migration_scaling is not None and self.migration_scaling[0].size != len(self.index.ages) * len(self.index.sexes):
+            return "migration scaling varies by GEOID"
+
+        return None
+
+    def step(self, pop, year, remainder, first_step):
+        if not self.compiled:
+            return super().step(pop, year, remainder, first_step)
+
+        shape = pop.shape
+        cells = self.index.shape
+        lead = shape[:-3]
+        pop = np.ascontiguousarray(pop, dtype=self.dtype).reshape((-1,) + cells)
+
+        t = self.rates.year_position(year)
+        mortality = np.ascontiguousarray(self.rates.mortality[t])
+        fertility = np.ascontiguousarray(self.rates.fertility[t])
+        immigrants = self.immigrants(year)
+        batched = np.ascontiguousarray(immigrants).reshape((-1,) + cells)
+        remainder = np.ascontiguousarray(remainder, dtype=self.dtype).reshape((-1,) + cells)
+        scale = self.unscaled
+        if self.migration_scaling is not None:
+            scale = np.ascontiguousarray(self.migration_scaling[self.migration_scaling_years.index(year)],
+                                         dtype=np.float64).reshape(cells[-2:])
+
+        negative = np.zeros(3, dtype=np.int64)
+        deaths = np.empty_like(pop)
+        survivors = np.empty_like(pop)
+        survival_kernel(pop, mortality, batched, deaths, survivors, negative)
+        assert not negative[0], f"Negative population after mortality in {year}"
+        assert not negative[1], f"Negative population after immigration in {year}"
+
+        # flows and births are accumulated in float64 whatever the storage dtype
+        migration = self.migration
+        inflows = np.zeros(pop.shape)
+        outflows = np.zeros(pop.shape)
+        if migration.n_pairs > 0:
+            outflow_kernel(survivors, scale, migration.rates, self.multipliers, self.age_groups,
+                           migration._out_geos, migration._out_starts, outflows)
+            inflow_kernel(survivors, scale, migration.rates, self.multipliers, self.age_groups,
+                          migration.origins, migration._in_order, migration._in_geos, migration._in_starts, inflows)
+
+        births = np.empty(pop.shape[:-2] + (cells[-1],))
+        rounded = np.empty_like(pop)
+        fractions = np.empty_like(pop)
+        aging_kernel(survivors, inflows, outflows, fertility, remainder,
+                     self.remainder_mode == 'carry' or not first_step, self.male_birth_fraction,
+                     self.index.sexes.index('MALE'), self.index.sexes.index('FEMALE'),
+                     births, rounded, fractions, negative)
+        assert not negative[2], f"Negative population after migration in {year}"
+
+        ledgers = {'deaths': deaths.reshape(shape),
+                   'immigration': immigrants,
+                   'inmig': inflows.astype(self.dtype, copy=False).reshape(shape),
+                   'outmig': outflows.astype(self.dtype, copy=False).reshape(shape),
+                   'births': births.astype(self.dtype, copy=False).reshape(lead + births.shape[-2:])}
+
+        return rounded.reshape(shape), fractions.reshape(shape), ledgers
+
+
+def precision_report(reference, candidate, launch_pop, launch_remainder, years):
+    '''
+    Run a reduced-precision engine (e.g. dtype=float32) next to a float64
+    reference one year at a time and compare every ledger, so the error
+    of the cheaper storage is known before its results are used. Only one
+    year of each run is held in memory.
+
+    Parameters:
+        reference (DenseEngine): float64 engine.
+        candidate (DenseEngine): the same model at lower precision.
+
+    Returns:
+        DataFrame: one row per YEAR and LEDGER with the reference total,
+            the relative error of the national total, the relative L1
+            error over cells, the largest cell error and the largest
+            relative error of a GEOID total (GEOIDs with a reference total
+            of at least one person), plus the bytes of one year of the
+            ledger and the seconds of each run.
+    '''
+    index = reference.index
+    runs = [reference.iterate(launch_pop, launch_remainder, years),
+            candidate.iterate(launch_pop, launch_remainder, years)]
+
+    rows = []
+    for year in years:
+        results = []
+        for run in runs:
+            start = time.perf_counter()
+            _, pop, ledgers = next(run)
+            results.append(({'population': pop, **ledgers}, time.perf_counter() - start))
+        (ref, ref_seconds), (cand, cand_seconds) = results
+
+        for name, expected in ref.items():
+            expected = np.asarray(expected, dtype=np.float64)
+            actual = np.asarray(cand[name], dtype=np.float64)
+            total = expected.sum()
+            if name == 'births':
+                geo_expected, geo_actual = expected.sum(axis=-1), actual.sum(axis=-1)
+            else:
+                geo_expected, geo_actual = geoid_totals(index, expected), geoid_totals(index, actual)
+            populated = np.abs(geo_expected) >= 1.0
+            geo_error = np.abs(geo_actual - geo_expected)[populated] / np.abs(geo_expected[populated])
+            rows.append({'YEAR': year,
+                         'LEDGER': name,
+                         'TOTAL': float(total),
+                         'REL_TOTAL': float(abs(actual.sum() - total) / max(abs(total), 1e-12)),
+                         'REL_L1': float(np.abs(actual - expected).sum() / max(np.abs(expected).sum(), 1e-12)),
+                         'MAX_ABS_CELL': float(np.abs(actual - expected).max()),
+                         'MAX_REL_GEOID': float(geo_error.max()) if geo_error.size else 0.0,
+                         'REFERENCE_MB': np.asarray(ref[name]).nbytes / 1024 ** 2,
+                         'CANDIDATE_MB': np.asarray(cand[name]).nbytes / 1024 ** 2,
+                         'REFERENCE_SECONDS': ref_seconds,
+                         'CANDIDATE_SECONDS': cand_seconds})
+
+    return pl.DataFrame(rows)
+
+
+def coarsen_results(index, results, years, age_groups, age_starts, milestone_years):
+    '''
+    Post-aggregate [YEAR, ...] results on a single-year, annual-step index
+    to wider age groups and milestone years. Population is the snapshot in
+    each milestone year; component ledgers are summed over the annual steps
+    since the previous milestone (the first milestone sums every step from
+    the start of the run), and over the single years of age in each group.
+
+    Parameters:
+        index (CohortIndex): single-year layout of the results.
+        results (dict): DenseEngine.run() results.
+        years (list): years of the results' first axis.
+        age_groups (list): labels of the coarse age groups.
+        age_starts (list): position in index.ages of each group's first age.
+        milestone_years (list): years to keep, a subset of years.
+
+    Returns:
+        CohortIndex: the age-group layout.
+        dict: coarse [MILESTONE, ...] arrays keyed like results.
+    '''
+    assert len(age_groups) == len(age_starts)
+    group_index = CohortIndex(geoids=index.geoids,
+                              ages=age_groups,
+                              age_col='AGE_GROUP',
+                              sexes=index.sexes,
+                              races=index.races)
+
+    positions = [list(years).index(year) for year in milestone_years]
+    bounds = [0] + [t + 1 for t in positions[:-1]]
+
+    coarse = {}
+    for name, arr in results.items():
+        arr = np.asarray(arr)
+        if name == 'population':
+            arr = arr[positions]
+        else:
+            arr = np.add.reduceat(arr[:positions[-1] + 1], bounds, axis=0)
+        # births are already [..., GEOID, SEX]
+        if name != 'births':
+            arr = np.add.reduceat(arr, age_starts, axis=-2)
+        coarse[name] = arr
+
+    return group_index, coarse
+
+
+class LedgerStore():
+    '''
+    Population and component ledgers for every projection year, kept on
+    local disk as one preallocated [YEAR, ...] .npy file per ledger. Each
+    year's slices are written in place through a short-lived memory map, so
+    a run's resident memory does not grow with the horizon; readers
+    memory-map the files and only page in what they touch.
+
+    Use LedgerStore.create() for a new run and LedgerStore.open() to read.
+
+    Parameters:
+        folder (str): location of the .npy files and manifest.
+        index (CohortIndex): layout of the GEOID, AGE, SEX axes.
+        years (list): projection years, in the order of the first axis.
+        shapes (dict): ledger name -> shape of one year's slice.
+        dtype: storage dtype.
+    '''
+    def __init__(self, folder, index, years, shapes, dtype=np.float64):
+        self.folder = folder
+        self.index = index
+        self.years = list(years)
+        self.shapes = {name: tuple(shape) for name, shape in shapes.items()}
+        self.dtype = np.dtype(dtype)
+
+    @classmethod
+    def create(cls, folder, index, years, dtype=np.float64):
+        '''
+        Preallocate the ledger files of a DenseEngine run over years.
+        '''
+        shapes = {name: index.shape for name in ('population', 'deaths', 'immigration', 'inmig', 'outmig')}
+        shapes['births'] = index.shape[:-2] + (len(index.sexes),)
+        store = cls(folder, index, years, shapes, dtype)
+
+        os.makedirs(folder, exist_ok=True)
+        for name, shape in store.shapes.items():
+            arr = np.lib.format.open_memmap(store.path(name), mode='w+', dtype=store.dtype, shape=(len(store.years),) + shape)
+            del arr
+        np.save(store.path('written'), np.zeros(len(store.years), dtype=bool))
+
+        manifest = {'geoids': index.geoids,
+                    'ages': index.ages,
+                    'age_col': index.age_col,
+                    'sexes': index.sexes,
+                    'races': index.races,
+                    'years': store.years,
+                    'shapes': store.shapes,
+                    'dtype': str(store.dtype)}
+        with open(os.path.join(folder, LEDGER_STORE_MANIFEST), 'w') as f:
+            json.dump(manifest, f, indent=2)
+
+        return store
+
+    @classmethod
+    def open(cls, folder):
+        with open(os.path.join(folder, LEDGER_STORE_MANIFEST)) as f:
+            manifest = json.load(f)
+
+        index = CohortIndex(geoids=manifest['geoids'],
+                            ages=manifest['ages'],
+                            age_col=manifest['age_col'],
+                            sexes=manifest['sexes'],
+                            races=manifest.get('races'))
+
+        return cls(folder, index, manifest['years'], manifest['shapes'], manifest['dtype'])
+
+    def path(self, name):
+        return os.path.join(self.folder, f'{name}.npy')
+
+    def write(self, year, arrays):
+        '''
+        Write one year's slice of every ledger in arrays (name -> array).
+        '''
+        t = self.years.index(year)
+        for name, arr in arrays.items():
+            mm = np.load(self.path(name), mmap_mode='r+')
+            mm[t] = arr
+            mm.flush()
+            del mm
+
+        written = np.load(self.path('written'), mmap_mode='r+')
+        written[t] = True
+        written.flush()
+        del written
+
+    @property
+    def written_years(self):
+        written = np.load(self.path('written'))
+        return [year for year, done in zip(self.years, written) if done]
+
+    def array(self, name):
+        '''
+        Read-only memory map of a ledger, [YEAR, ...].
+        '''
+        return np.load(self.path(name), mmap_mode='r')
+
+    def frame_batches(self, geoids_per_batch=1000, years=None):
+        '''
+        Yield the wide ledger tables (see ledger_frames) for consecutive
+        batches of GEOIDs, reading only those rows of every ledger. Defaults
+        to the years written so far.
+        '''
+        if years is None:
+            years = self.written_years
+        t = [self.years.index(year) for year in years]
+        arrays = {name: self.array(name) for name in self.shapes}
+        n_race = 0 if self.index.races is None else 1
+
+        for start in range(0, len(self.index.geoids), geoids_per_batch):
+            stop = start + geoids_per_batch
+            batch = self.index.with_geoids(self.index.geoids[start:stop])
+            rows = (t,) + (slice(None),) * n_race + (slice(start, stop),)
+            results = {name: arr[rows] for name, arr in arrays.items()}
+            yield ledger_frames(batch, results, years)
+
+
+def file_sha256(path, block_size=1 << 20):
+    '''
+    SHA-256 of a file, read in blocks.
+    '''
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+
+class InputBundle():
+    '''
+    A model's processed inputs compiled into one folder: every array as a
+    typed .npy file, and a manifest with the bundle format, the key
+    dictionaries of the array axes (CohortIndex layouts and year lists),
+    the build parameters and the SHA-256 of every source file. open()
+    memory-maps the arrays, so a Projector starts without parsing a CSV
+    and every process that opens the same bundle shares its pages through
+    the OS page cache.
+
+    Use InputBundle.write() to build one and InputBundle.open() to read.
+
+    Parameters:
+        folder (str): location of the .npy files and manifest.
+        manifest (dict): the parsed manifest.
+        mmap (bool): memory-map the arrays read-only (or read them).
+    '''
+    def __init__(self, folder, manifest, mmap=True):
+        self.folder = folder
+        self.manifest = manifest
+        self.mmap = mmap
+        self.arrays = {}
+
+    @classmethod
+    def write(cls, folder, arrays, indexes, keys, sources, params=None):
+        '''
+        Write a bundle. It is built in a temporary folder next to folder
+        and moved into place, so readers never see a partial bundle.
+
+        Parameters:
+            arrays (dict): name -> ndarray (or OuterProduct, materialized).
+            indexes (dict): name -> CohortIndex of the arrays' cohort axes.
+            keys (dict): name -> list labelling another axis (e.g. years).
+            sources (list): paths of the files the inputs were built from.
+            params (dict): build parameters.
+        '''
+        temp = folder.rstrip(os.sep) + '.tmp'
+        shutil.rmtree(temp, ignore_errors=True)
+        os.makedirs(temp)
+
+        shapes = {}
+        for name, arr in arrays.items():
+            arr = np.ascontiguousarray(np.asarray(arr))
+            np.save(os.path.join(temp, f'{name}.npy'), arr)
+            shapes[name] = {'shape': list(arr.shape), 'dtype': str(arr.dtype)}
+
+        manifest = {'format': BUNDLE_FORMAT,
+                    'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+                    'arrays': shapes,
+                    'indexes': {name: {'geoids': index.geoids,
+                                       'ages': index.ages,
+                                       'age_col': index.age_col,
+                                       'sexes': index.sexes,
+                                       'races': index.races}
+                                for name, index in indexes.items()},
+                    'keys': keys,
+                    'sources': {path: file_sha256(path) for path in sources},
+                    'params': params or {}}
+        with open(os.path.join(temp, BUNDLE_MANIFEST), 'w') as f:
+            json.dump(manifest, f, indent=2)
+
+        shutil.rmtree(folder, ignore_errors=True)
+        os.replace(temp, folder)
+
+        return cls(folder, manifest)
+
+    @classmethod
+    def open(cls, folder, mmap=True):
+        with open(os.path.join(folder, BUNDLE_MANIFEST)) as f:
+            manifest = json.load(f)
+        assert manifest['format'] == BUNDLE_FORMAT, \
+            f"{folder} has bundle format {manifest['format']}, expected {BUNDLE_FORMAT}; rebuild it"
+
+        return cls(folder, manifest, mmap)
+
+    def __contains__(self, name):
+        return name in self.manifest['arrays']
+
+    def __getitem__(self, name):
+        if name not in self.arrays:
+            assert name in self, f"No {name} in bundle {self.folder}"
+            self.arrays[name] = np.load(os.path.join(self.folder, f'{name}.npy'), mmap_mode='r' if self.mmap else None)
+
+        return self.arrays[name]
+
+    @property
+    def params(self):
+        return self.manifest['params']
+
+    def index(self, name):
+        layout = self.manifest['indexes'][name]
+        return CohortIndex(geoids=layout['geoids'],
+                           ages=layout['ages'],
+                           age_col=layout['age_col'],
+                           sexes=layout['sexes'],
+                           races=layout['races'])
+
+    def key(self, name):
+        return self.manifest['keys'][name]
+
+    def stale_sources(self):
+        '''
+        Source files that are missing or have changed since the bundle was
+        built.
+        '''
+        return [path for path, digest in self.manifest['sources'].items()
+                if not os.path.isfile(path) or file_sha256(path) != digest]
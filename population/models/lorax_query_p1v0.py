@@ -0,0 +1,235 @@
+"""
+Author:  Phil Morefield
+Purpose: Embedded SQL query layer over the projection outputs, with rollups
+         by state, HHS region, BEA region and age band
+Created: October 19th, 2026
+
+The wide output tables ({ledger}_by_{layout}_{scenario}.csv) are converted
+once to long parquet files (YEAR, GEOID, age, SEX, value columns) sorted by
+YEAR and GEOID, so every row group covers a narrow range of years and
+GEOIDs. They are then registered as lazy scans in a polars SQLContext;
+a query only reads the columns it selects and the row groups whose
+statistics can match its filters, instead of the whole CSV.
+
+Registered tables, for every ledger (population, deaths, births,
+immigration, migration):
+
+    {ledger}                  the long table, plus GEOID attributes
+    {ledger}_by_{level}       summed by YEAR, SEX, AGE_BAND and STATE,
+                              HHS_REGION, BEA_REGION, BEA_AREA or NATION
+    geographies               GEOID -> STATE, STUSPS, HHS_REGION,
+                              BEA_REGION, BEA_AREA (counties only)
+    age_bands                 age (group) -> AGE_START, AGE_BAND
+
+HHS regions and BEA economic areas (BEA10) come from
+fips_to_urb20_bea10_hhs.csv. BEA regions are the eight regions of the
+states. Age bands are defined by their first age (AGE_BANDS) so that they
+line up with both single years and five-year groups.
+
+Usage:
+    python lorax_query_p1v0.py "SELECT YEAR, SUM(POPULATION) AS POP FROM population_by_bea_region
+                                WHERE BEA_REGION = 'Southeast' AND AGE_BAND = '65+' AND YEAR = 2059 GROUP BY YEAR"
+    python lorax_query_p1v0.py --layout age_sex --folder outputs/single_year "SELECT * FROM population_by_hhs_region"
+"""
+import argparse
+import os
+import time
+
+import polars as pl
+
+
+BASE_FOLDER = 'D:\\OneDrive\\ICLUS_v3\\population'
+if os.path.isdir('C:\\Users\\philm\\OneDrive\\ICLUS_v3\\population'):
+    BASE_FOLDER = 'C:\\Users\\philm\\OneDrive\\ICLUS_v3\\population'
+OUTPUT_FOLDER = os.path.join(BASE_FOLDER, 'outputs')
+GEOGRAPHY_CSV = os.path.join(BASE_FOLDER, 'inputs', 'fips_to_urb20_bea10_hhs.csv')
+QUERY_SUBFOLDER = 'query'
+
+LEDGERS = ['population', 'deaths', 'births', 'immigration', 'migration']
+KEY_COLUMNS = ['RACE', 'GEOID', 'AGE_GROUP', 'AGE', 'SEX']
+LEVELS = ['STATE', 'HHS_REGION', 'BEA_REGION', 'BEA_AREA', 'NATION']
+
+# rows per parquet row group; small enough that a filter on YEAR (and
+# GEOID) skips most of a file
+ROW_GROUP_SIZE = 20000
+
+# (label, first age) of every age band
+AGE_BANDS = [('0-19', 0), ('20-64', 20), ('65+', 65)]
+
+BEA_REGIONS = {'New England': ['CT', 'MA', 'ME', 'NH', 'RI', 'VT'],
+               'Mideast': ['DC', 'DE', 'MD', 'NJ', 'NY', 'PA'],
+               'Great Lakes': ['IL', 'IN', 'MI', 'OH', 'WI'],
+               'Plains': ['IA', 'KS', 'MN', 'MO', 'ND', 'NE', 'SD'],
+               'Southeast': ['AL', 'AR', 'FL', 'GA', 'KY', 'LA', 'MS', 'NC', 'SC', 'TN', 'VA', 'WV'],
+               'Southwest': ['AZ', 'NM', 'OK', 'TX'],
+               'Rocky Mountain': ['CO', 'ID', 'MT', 'UT', 'WY'],
+               'Far West': ['AK', 'CA', 'HI', 'NV', 'OR', 'WA']}
+
+
+def get_geographies(csv=GEOGRAPHY_CSV):
+    '''
+    GEOID attributes for both counties (5-digit GEOIDs) and states (2-digit
+    GEOIDs): STATE, STUSPS, HHS_REGION, BEA_REGION and, for counties only,
+    BEA_AREA.
+    '''
+    regions = pl.DataFrame([(stusps, region) for region, states in BEA_REGIONS.items() for stusps in states],
+                           schema=['STUSPS', 'BEA_REGION'],
+                           orient='row')
+
+    counties = pl.read_csv(csv, schema_overrides={'COFIPS': pl.String})
+    counties = counties.select([pl.col('COFIPS').str.zfill(5).alias('GEOID'),
+                                pl.col('COFIPS').str.zfill(5).str.slice(0, 2).alias('STATE'),
+                                'STUSPS',
+                                pl.col('HHS').cast(pl.Int64).alias('HHS_REGION'),
+                                pl.col('BEA10').cast(pl.Int64).alias('BEA_AREA')])
+    counties = counties.join(regions, on='STUSPS', how='left')
+
+    states = (counties.select(['STATE', 'STUSPS', 'HHS_REGION', 'BEA_REGION'])
+                      .unique()
+                      .with_columns([pl.col('STATE').alias('GEOID'), pl.lit(None, dtype=pl.Int64).alias('BEA_AREA')]))
+
+    geographies = pl.concat([counties, states.select(counties.columns)])
+
+    return geographies.with_columns(pl.lit('US').alias('NATION')).sort('GEOID')
+
+
+def get_age_bands(ages, age_col):
+    '''
+    age (group) -> AGE_START, AGE_BAND for the ages of an output table.
+    Single years map to themselves; groups ('5-9', '85+') start at their
+    first age.
+    '''
+    df = pl.DataFrame({age_col: ages})
+    df = df.with_columns(pl.col(age_col).cast(pl.String).str.extract(r'^(\d+)').cast(pl.Int64).alias('AGE_START'))
+
+    band = pl.lit(None, dtype=pl.String)
+    for label, start in AGE_BANDS:
+        band = pl.when(pl.col('AGE_START') >= start).then(pl.lit(label)).otherwise(band)
+
+    return df.with_columns(band.alias('AGE_BAND'))
+
+
+def wide_to_long(df):
+    '''
+    Convert a wide output table (one column per year, or INMIG/OUTMIG/NETMIG
+    per year) to long rows with a YEAR column and one value column per
+    measure, named after the measure (or VALUE for plain year columns).
+    '''
+    keys = [col for col in KEY_COLUMNS if col in df.columns]
+    long = df.unpivot(index=keys, variable_name='COLUMN', value_name='VALUE')
+    long = long.with_columns([pl.col('COLUMN').str.slice(-4).cast(pl.Int32).alias('YEAR'),
+                              pl.col('COLUMN').str.head(-4).alias('MEASURE'),
+                              pl.col('VALUE').cast(pl.Float64)])
+    long = long.with_columns(pl.when(pl.col('MEASURE') == '').then(pl.lit('VALUE')).otherwise(pl.col('MEASURE')).alias('MEASURE'))
+
+    return long.pivot(on='MEASURE', index=keys + ['YEAR'], values='VALUE').sort(['YEAR', 'GEOID'] + keys[keys.index('GEOID') + 1:])
+
+
+def build_query_store(folder, scenario, layout='age_group_sex', query_folder=None):
+    '''
+    Convert the wide {ledger}_by_{layout}_{scenario}.csv outputs in folder to
+    long parquet files in query_folder (default folder/query), skipping
+    ledgers whose parquet file is newer than the CSV.
+
+    Returns:
+        dict: ledger name -> parquet path.
+    '''
+    query_folder = query_folder or os.path.join(folder, QUERY_SUBFOLDER)
+    os.makedirs(query_folder, exist_ok=True)
+
+    paths = {}
+    for ledger in LEDGERS:
+        csv = os.path.join(folder, f'{ledger}_by_{layout}_{scenario}.csv')
+        if not os.path.isfile(csv):
+            continue
+        path = os.path.join(query_folder, f'{ledger}_by_{layout}_{scenario}.parquet')
+        paths[ledger] = path
+        if os.path.isfile(path) and os.path.getmtime(path) >= os.path.getmtime(csv):
+            continue
+
+        df = pl.read_csv(csv, schema_overrides={'GEOID': pl.String, 'RACE': pl.String, 'AGE_GROUP': pl.String})
+        long = wide_to_long(df)
+        if 'VALUE' in long.columns:
+            long = long.rename({'VALUE': ledger.upper()})
+        long.write_parquet(path, row_group_size=ROW_GROUP_SIZE, statistics=True)
+        print(f"Wrote {long.height:,} rows to {path}")
+
+    return paths
+
+
+class ProjectionQuery():
+    '''
+    SQL access to one scenario's outputs through a polars SQLContext over
+    the long parquet files of build_query_store().
+
+    Parameters:
+        folder (str): folder of the wide output CSVs.
+        scenario (str): scenario name in the output file names.
+        layout (str): 'age_group_sex' (five-year tables) or 'age_sex'
+            (single years).
+        query_folder (str): folder of the parquet files (default
+            folder/query).
+        geography_csv (str): county to HHS/BEA crosswalk.
+    '''
+    def __init__(self, folder=OUTPUT_FOLDER, scenario='CBO', layout='age_group_sex', query_folder=None,
+                 geography_csv=GEOGRAPHY_CSV):
+        self.paths = build_query_store(folder, scenario, layout, query_folder)
+        assert self.paths, f"No {layout} outputs for {scenario} in {folder}"
+
+        self.geographies = get_geographies(geography_csv)
+        self.context = pl.SQLContext()
+        self.context.register('geographies', self.geographies.lazy())
+        self.age_bands = pl.DataFrame()
+
+        for ledger, path in self.paths.items():
+            scan = pl.scan_parquet(path)
+            age_col = [col for col in ('AGE_GROUP', 'AGE') if col in scan.collect_schema().names()][0]
+            ages = scan.select(pl.col(age_col).unique()).collect().get_column(age_col).to_list()
+            bands = get_age_bands(ages, age_col)
+            if len(ages) > len(self.age_bands):
+                self.age_bands = bands
+
+            table = (scan.join(self.geographies.lazy(), on='GEOID', how='left')
+                         .join(bands.lazy(), on=age_col, how='left'))
+            self.context.register(ledger, table)
+
+            values = [col for col in scan.collect_schema().names() if col not in KEY_COLUMNS + ['YEAR']]
+            for level in LEVELS:
+                keys = ['YEAR', level, 'SEX', 'AGE_BAND']
+                rollup = table.group_by(keys).agg(pl.col(values).sum())
+                self.context.register(f'{ledger}_by_{level.lower()}', rollup)
+        self.context.register('age_bands', self.age_bands.lazy())
+
+    def tables(self):
+        return self.context.tables()
+
+    def sql(self, query):
+        '''
+        Run a query and return a DataFrame.
+        '''
+        return self.context.execute(query, eager=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Query the projection outputs with SQL.')
+    parser.add_argument('query', nargs='?', default=None, help='SQL query; lists the tables if omitted')
+    parser.add_argument('--folder', default=OUTPUT_FOLDER)
+    parser.add_argument('--scenario', default='CBO')
+    parser.add_argument('--layout', default='age_group_sex', choices=['age_group_sex', 'age_sex'])
+    parser.add_argument('--query-folder', default=None)
+    parser.add_argument('--geography-csv', default=GEOGRAPHY_CSV)
+    args = parser.parse_args()
+
+    projections = ProjectionQuery(folder=args.folder,
+                                  scenario=args.scenario,
+                                  layout=args.layout,
+                                  query_folder=args.query_folder,
+                                  geography_csv=args.geography_csv)
+    if args.query is None:
+        print('\n'.join(projections.tables()))
+    else:
+        start = time.perf_counter()
+        result = projections.sql(args.query)
+        with pl.Config(tbl_rows=50, tbl_cols=-1, tbl_width_chars=200):
+            print(result)
+        print(f"{(time.perf_counter() - start) * 1000:.0f} ms")
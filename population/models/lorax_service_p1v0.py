@@ -0,0 +1,502 @@
+"""
+Author:  Phil Morefield
+Purpose: Long-lived local projection service that keeps the county model's
+         inputs warm in memory and serves scenario results from a
+         content-addressed cache
+Created: October 19th, 2026
+
+Starting a projection from scratch re-imports polars, re-reads and re-joins
+every input and builds the migration operator before the first year is
+projected. The service does that once: the RateStore, the immigration
+tensor, the migration operator and the launch population stay in memory,
+and every request only runs the DenseEngine for its scenario.
+
+A scenario is a payload of parameters (SCENARIO_DEFAULTS):
+
+    fert_calibr, mort_calibr   calibration percentages, as in Projector
+    immigration_scale          multiplier on CBO net immigration
+    migration_scaling          rescale the O-D migration rates every year
+                               by the CBO-derived factors (needs
+                               MIGRATION_SCALING_CSV or a bundle built
+                               with it)
+    final_projection_year      last year projected
+
+Calibrations are applied as ScaledArray views of the shared rates, so no
+scenario copies them. Results are kept as county totals and national
+age-sex totals of every ledger by year, and cached in memory and in
+CACHE_FOLDER under the SHA-256 of the scenario (parameters rounded to
+PARAMETER_DIGITS, without the final year) and a fingerprint of the inputs:
+
+    - a repeat of a cached scenario is served without projecting;
+    - a scenario that only differs in its final year is served from the
+      cached years, or continued from the last cached year and population;
+    - changed inputs change the fingerprint and so never hit old results.
+
+Endpoints (JSON):
+    GET  /health     inputs, years, migration scaling and cache sizes
+    GET  /scenarios  cached scenarios
+    POST /project    scenario parameters plus level ('NATION', 'STATE',
+                     'HHS_REGION', 'BEA_AREA', 'URBANICITY' or 'COUNTY')
+                     and age_sex (add national age-sex totals)
+
+ServiceClient talks to a running service over HTTP; StubClient calls a
+ProjectionService in the same process through the same routing and JSON
+encoding, for tests and notebooks.
+
+Usage:
+    python lorax_service_p1v0.py serve --port 8765 --rate-folder rates
+    python lorax_service_p1v0.py serve --bundle-folder D:\\bundles\\p1v1
+    python lorax_service_p1v0.py project --mort-calibr 1.5 --level STATE
+"""
+import argparse
+import collections
+import hashlib
+import json
+import os
+import time
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import numpy as np
+import polars as pl
+
+from county_lorax_model_p1v0 import (CBO_IMMIGRATION_CSV, DATABASE_FOLDER, GEOGRAPHY_CSV, IMMIGRATION_CSV,
+                                     MALE_BIRTH_FRACTION, MIGRATION_CSV, MIGRATION_SCALING_CSV, OUTPUT_FOLDER,
+                                     Projector)
+from lorax_engine_p1v0 import DenseEngine, GeographyIndex, ScaledArray
+
+
+SERVICE_HOST = '127.0.0.1'
+SERVICE_PORT = 8765
+CACHE_FOLDER = os.path.join(OUTPUT_FOLDER, 'service_cache')
+
+SCENARIO_DEFAULTS = {'fert_calibr': 0.0,
+                     'mort_calibr': 0.0,
+                     'immigration_scale': 1.0,
+                     'migration_scaling': False,
+                     'final_projection_year': 2098}
+QUERY_DEFAULTS = {'level': 'STATE',
+                  'age_sex': False}
+
+# parameters are rounded before hashing, so payloads that only differ past
+# this many decimals share their results
+PARAMETER_DIGITS = 6
+
+# scenarios kept in memory (each holds its final population and remainders)
+MEMORY_CACHE_ENTRIES = 16
+
+LEDGERS = ['population', 'deaths', 'immigration', 'inmig', 'outmig', 'births']
+
+
+def normalize_scenario(payload):
+    '''
+    Split a request payload into the scenario (SCENARIO_DEFAULTS, with
+    floats rounded to PARAMETER_DIGITS) and the query (QUERY_DEFAULTS).
+    Unknown keys raise a ValueError.
+    '''
+    unknown = set(payload) - set(SCENARIO_DEFAULTS) - set(QUERY_DEFAULTS)
+    if unknown:
+        raise ValueError(f"Unknown parameters: {', '.join(sorted(unknown))}")
+
+    scenario = {}
+    for key, default in SCENARIO_DEFAULTS.items():
+        value = payload.get(key, default)
+        if isinstance(default, bool):
+            scenario[key] = bool(value)
+        elif isinstance(default, int):
+            scenario[key] = int(value)
+        else:
+            scenario[key] = round(float(value), PARAMETER_DIGITS)
+    query = {key: payload.get(key, default) for key, default in QUERY_DEFAULTS.items()}
+    query['level'] = str(query['level']).upper()
+    query['age_sex'] = bool(query['age_sex'])
+
+    return scenario, query
+
+
+def scenario_key(scenario, fingerprint):
+    '''
+    Content address of a scenario's results: SHA-256 of its parameters
+    (without the final year, which only decides how many years are served)
+    and the input fingerprint.
+    '''
+    params = {key: value for key, value in scenario.items() if key != 'final_projection_year'}
+    content = json.dumps({'scenario': params, 'inputs': fingerprint}, sort_keys=True)
+
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+class ProjectionService():
+    '''
+    County DenseEngine projections of scenario payloads, with the model
+    inputs built once and results cached by scenario_key().
+
+    Parameters:
+        rate_folder (str): RateStore folder passed to Projector (rates are
+            memory-mapped from it if they were saved with the same inputs).
+        cache_folder (str): folder of the cached results (.npz per key).
+        bundle_folder (str): InputBundle to memory-map the inputs from
+            (see lorax_bundle_p1v0.py) instead of building them.
+    '''
+    def __init__(self, rate_folder=None, cache_folder=CACHE_FOLDER, bundle_folder=None):
+        start = time.perf_counter()
+        print(f"{time.ctime()} Building model inputs...")
+        model = Projector(scenario='CBO',
+                          version='p1v1',
+                          fert_calibr=0.0,
+                          mort_calibr=0.0,
+                          rate_folder=rate_folder,
+                          bundle_folder=bundle_folder)
+        self.rates = model.rates
+        self.index = model.rates.index
+        self.immigration = model.immigration_tensor
+        self.immigration_years = model.immigration_years
+        self.migration = model.build_migration_operator()
+        # the scaling factors are optional inputs; scenarios that ask for
+        # them are refused if they were not built
+        if model.bundle is None:
+            scaling_csv = os.path.join(DATABASE_FOLDER, MIGRATION_SCALING_CSV)
+            if os.path.isfile(scaling_csv):
+                model.build_migration_scaling()
+        elif 'migration_scaling' in model.bundle:
+            model.build_migration_scaling()
+        self.migration_scaling = model.migration_scaling
+        self.launch_pop, self.launch_remainder = model.dense_launch_population()
+        self.first_year = model.current_projection_year
+        self.years = [year for year in self.rates.years if year in self.immigration_years and year >= self.first_year]
+        self.geography = GeographyIndex.from_crosswalk(self.index.geoids, GEOGRAPHY_CSV)
+
+        launch = hashlib.sha256(self.launch_pop.tobytes() + self.launch_remainder.tobytes()).hexdigest()
+        if model.bundle is None:
+            sources = {csv: os.path.getmtime(os.path.join(DATABASE_FOLDER, csv))
+                       for csv in (IMMIGRATION_CSV, CBO_IMMIGRATION_CSV, MIGRATION_CSV)}
+            if self.migration_scaling is not None:
+                sources[MIGRATION_SCALING_CSV] = os.path.getmtime(scaling_csv)
+        else:
+            sources = model.bundle.manifest['sources']
+        self.fingerprint = {'rates': self.rates.params,
+                            'sources': sources,
+                            'immigration_years': self.immigration_years,
+                            'launch': launch}
+
+        self.cache_folder = cache_folder
+        os.makedirs(cache_folder, exist_ok=True)
+        self.memory = collections.OrderedDict()
+        self.startup_seconds = time.perf_counter() - start
+        print(f"{time.ctime()} Ready ({len(self.index.geoids):,} counties, {self.years[0]}-{self.years[-1]}, "
+              f"{self.startup_seconds:.1f} seconds)")
+
+    def cache_path(self, key):
+        return os.path.join(self.cache_folder, f'{key}.npz')
+
+    def cached(self, key):
+        '''
+        Cached results of key from memory or disk (moved to the front of
+        the memory cache), and where they came from.
+        '''
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            return self.memory[key], 'memory'
+
+        path = self.cache_path(key)
+        if not os.path.isfile(path):
+            return None, None
+        with np.load(path) as npz:
+            entry = {name: npz[name] for name in npz.files}
+        self.remember(key, entry)
+
+        return entry, 'disk'
+
+    def remember(self, key, entry):
+        self.memory[key] = entry
+        self.memory.move_to_end(key)
+        while len(self.memory) > MEMORY_CACHE_ENTRIES:
+            self.memory.popitem(last=False)
+
+    def store(self, key, entry):
+        '''
+        Write an entry to the disk cache (atomically, so a concurrent reader
+        never sees a partial file) and remember it.
+        '''
+        temp = self.cache_path(key) + '.tmp.npz'
+        np.savez(temp, **entry)
+        os.replace(temp, self.cache_path(key))
+        self.remember(key, entry)
+
+    def engine(self, scenario):
+        immigration = self.immigration
+        if scenario['immigration_scale'] != 1.0:
+            immigration = ScaledArray(immigration, scenario['immigration_scale'])
+
+        return DenseEngine(rates=self.rates.scaled(mortality_scale=1.0 + (0.01 * scenario['mort_calibr']),
+                                                   fertility_scale=1.0 + (0.01 * scenario['fert_calibr'])),
+                           immigration=immigration,
+                           immigration_years=self.immigration_years,
+                           migration=self.migration,
+                           male_birth_fraction=MALE_BIRTH_FRACTION,
+                           remainder_mode='carry',
+                           migration_scaling=self.migration_scaling if scenario['migration_scaling'] else None,
+                           migration_scaling_years=self.immigration_years)
+
+    def project(self, scenario, entry=None):
+        '''
+        Run the scenario through final_projection_year, continuing from the
+        last year of entry if given. Keeps the county totals ([YEAR, GEOID])
+        and national age-sex totals ([YEAR, AGE, SEX], births [YEAR, SEX])
+        of every ledger, and the final population and remainders.
+        '''
+        years = [year for year in self.years if year <= scenario['final_projection_year']]
+        pop, remainder = self.launch_pop, self.launch_remainder
+        totals = {name: [] for name in LEDGERS}
+        age_sex = {name: [] for name in LEDGERS}
+        if entry is not None:
+            years = [year for year in years if year > entry['years'][-1]]
+            pop, remainder = entry['final_population'], entry['final_remainder']
+
+        # step() rather than iterate(), to keep the remainders for extending
+        engine = self.engine(scenario)
+        for year in years:
+            pop, remainder, ledgers = engine.step(pop, year, remainder, first_step=False)
+            for name, arr in {'population': pop, **ledgers}.items():
+                totals[name].append(arr.sum(axis=-1) if name == 'births' else arr.sum(axis=(-2, -1)))
+                age_sex[name].append(arr.sum(axis=-2) if name == 'births' else arr.sum(axis=-3))
+
+        new = {'years': np.array(years, dtype=np.int64),
+               'final_population': pop,
+               'final_remainder': remainder}
+        for name in LEDGERS:
+            new[name] = np.stack(totals[name])
+            new[f'{name}_age_sex'] = np.stack(age_sex[name])
+        if entry is None:
+            return new
+
+        return {key: arr if key.startswith('final_') else np.concatenate([entry[key], arr]) for key, arr in new.items()}
+
+    def respond(self, scenario, query, entry):
+        '''
+        The requested years of entry as column lists: totals by YEAR and
+        the requested level, and optionally national totals by YEAR, AGE
+        and SEX.
+        '''
+        level = query['level']
+        t = np.flatnonzero(entry['years'] <= scenario['final_projection_year'])
+        years = entry['years'][t]
+
+        if level == 'COUNTY':
+            labels = self.index.geoids
+            rollup = lambda arr: arr  # noqa: E731
+        else:
+            labels = [str(label) for label in self.geography.labels(level)]
+            rollup = lambda arr: self.geography.rollup(arr, level, axis=-1)  # noqa: E731
+
+        columns = {'YEAR': np.repeat(years, len(labels)), level: np.tile(labels, len(years))}
+        for name in LEDGERS:
+            columns[name.upper()] = rollup(entry[name][t]).ravel()
+        totals = pl.DataFrame(columns).with_columns((pl.col('INMIG') - pl.col('OUTMIG')).alias('NETMIG'))
+        response = {'totals': totals.to_dict(as_series=False)}
+
+        if query['age_sex']:
+            ages, sexes = self.index.ages, self.index.sexes
+            columns = {'YEAR': np.repeat(years, len(ages) * len(sexes)),
+                       'AGE': np.tile(np.repeat(ages, len(sexes)), len(years)),
+                       'SEX': np.tile(sexes, len(ages) * len(years))}
+            for name in LEDGERS:
+                if name != 'births':
+                    columns[name.upper()] = entry[f'{name}_age_sex'][t].ravel()
+            response['age_sex'] = pl.DataFrame(columns).to_dict(as_series=False)
+
+        return response
+
+    def request(self, payload):
+        '''
+        Serve one /project payload from the cache, extending or running the
+        projection as needed.
+        '''
+        start = time.perf_counter()
+        scenario, query = normalize_scenario(payload)
+        if not self.years[0] <= scenario['final_projection_year'] <= self.years[-1]:
+            raise ValueError(f"final_projection_year must be between {self.years[0]} and {self.years[-1]}")
+        if query['level'] != 'COUNTY' and query['level'] not in self.geography.levels:
+            raise ValueError(f"Unknown level: {query['level']}")
+        if scenario['migration_scaling'] and self.migration_scaling is None:
+            raise ValueError(f"migration_scaling needs {MIGRATION_SCALING_CSV}, which was not loaded at startup")
+
+        key = scenario_key(scenario, self.fingerprint)
+        entry, source = self.cached(key)
+        if entry is None or entry['years'][-1] < scenario['final_projection_year']:
+            print(f"{time.ctime()} {'Extending' if entry is not None else 'Projecting'} {key[:12]} "
+                  f"to {scenario['final_projection_year']}...")
+            source = 'extended' if entry is not None else None
+            entry = self.project(scenario, entry)
+            entry['scenario'] = np.array(json.dumps(scenario))
+            self.store(key, entry)
+
+        response = self.respond(scenario, query, entry)
+        response.update({'key': key,
+                         'scenario': scenario,
+                         'cached': source,
+                         'seconds': round(time.perf_counter() - start, 4)})
+
+        return response
+
+    def scenarios(self):
+        '''
+        Every scenario in the disk cache, with its cached years.
+        '''
+        listing = []
+        for file in sorted(os.listdir(self.cache_folder)):
+            if not file.endswith('.npz') or file.endswith('.tmp.npz'):
+                continue
+            with np.load(os.path.join(self.cache_folder, file)) as npz:
+                listing.append({'key': file[:-len('.npz')],
+                                'scenario': json.loads(str(npz['scenario'])),
+                                'years': [int(npz['years'][0]), int(npz['years'][-1])]})
+
+        return listing
+
+    def handle(self, method, path, body=None):
+        '''
+        Route one request. Returns the HTTP status and a JSON-serializable
+        dict; bad payloads are a 400 with the error message.
+        '''
+        try:
+            if method == 'GET' and path == '/health':
+                return 200, {'status': 'ok',
+                             'counties': len(self.index.geoids),
+                             'years': [self.years[0], self.years[-1]],
+                             'levels': ['COUNTY'] + list(self.geography.levels),
+                             'migration_scaling': self.migration_scaling is not None,
+                             'memory_entries': len(self.memory),
+                             'startup_seconds': round(self.startup_seconds, 2)}
+            if method == 'GET' and path == '/scenarios':
+                return 200, {'scenarios': self.scenarios()}
+            if method == 'POST' and path == '/project':
+                return 200, self.request(json.loads(body or '{}'))
+        except (ValueError, TypeError) as e:
+            return 400, {'error': str(e)}
+
+        return 404, {'error': f"No route for {method} {path}"}
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    '''
+    HTTP front end of the ProjectionService attached to the server.
+    '''
+    def reply(self, status, response):
+        body = json.dumps(response).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self.reply(*self.server.service.handle('GET', self.path))
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        self.reply(*self.server.service.handle('POST', self.path, self.rfile.read(length).decode('utf-8')))
+
+    def log_message(self, format, *args):
+        print(f"{time.ctime()} {self.address_string()} {format % args}")
+
+
+def serve(host=SERVICE_HOST, port=SERVICE_PORT, rate_folder=None, cache_folder=CACHE_FOLDER, bundle_folder=None):
+    '''
+    Build the inputs once and serve requests until interrupted. Requests
+    are handled one at a time, since every projection uses all of the
+    warm arrays.
+    '''
+    server = HTTPServer((host, port), ServiceHandler)
+    server.service = ProjectionService(rate_folder=rate_folder, cache_folder=cache_folder,
+                                       bundle_folder=bundle_folder)
+    print(f"Serving on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+class ServiceClient():
+    '''
+    Client of a running service.
+    '''
+    def __init__(self, url=f'http://{SERVICE_HOST}:{SERVICE_PORT}', timeout=3600):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+
+    def call(self, method, path, payload=None):
+        data = None if payload is None else json.dumps(payload).encode('utf-8')
+        request = urllib.request.Request(self.url + path, data=data, method=method,
+                                         headers={'Content-Type': 'application/json'})
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            raise RuntimeError(f"{e.code}: {json.loads(e.read()).get('error')}") from None
+
+    def health(self):
+        return self.call('GET', '/health')
+
+    def scenarios(self):
+        return self.call('GET', '/scenarios')['scenarios']
+
+    def project(self, **payload):
+        return self.call('POST', '/project', payload)
+
+
+class StubClient(ServiceClient):
+    '''
+    ServiceClient that calls a ProjectionService in the same process, with
+    the same routing and JSON round trip but no socket.
+    '''
+    def __init__(self, service):
+        self.service = service
+
+    def call(self, method, path, payload=None):
+        body = None if payload is None else json.dumps(payload)
+        status, response = self.service.handle(method, path, body)
+        response = json.loads(json.dumps(response))
+        if status != 200:
+            raise RuntimeError(f"{status}: {response.get('error')}")
+
+        return response
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local projection service.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    serve_parser = subparsers.add_parser('serve', help='build the inputs and serve requests')
+    serve_parser.add_argument('--host', default=SERVICE_HOST)
+    serve_parser.add_argument('--port', type=int, default=SERVICE_PORT)
+    serve_parser.add_argument('--rate-folder', default=None)
+    serve_parser.add_argument('--cache-folder', default=CACHE_FOLDER)
+    serve_parser.add_argument('--bundle-folder', default=None)
+
+    project_parser = subparsers.add_parser('project', help='request a scenario from a running service')
+    project_parser.add_argument('--url', default=f'http://{SERVICE_HOST}:{SERVICE_PORT}')
+    project_parser.add_argument('--fert-calibr', type=float, default=SCENARIO_DEFAULTS['fert_calibr'])
+    project_parser.add_argument('--mort-calibr', type=float, default=SCENARIO_DEFAULTS['mort_calibr'])
+    project_parser.add_argument('--immigration-scale', type=float, default=SCENARIO_DEFAULTS['immigration_scale'])
+    project_parser.add_argument('--migration-scaling', action='store_true')
+    project_parser.add_argument('--final-projection-year', type=int, default=SCENARIO_DEFAULTS['final_projection_year'])
+    project_parser.add_argument('--level', default=QUERY_DEFAULTS['level'])
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        serve(host=args.host, port=args.port, rate_folder=args.rate_folder, cache_folder=args.cache_folder,
+              bundle_folder=args.bundle_folder)
+    else:
+        response = ServiceClient(args.url).project(fert_calibr=args.fert_calibr,
+                                                   mort_calibr=args.mort_calibr,
+                                                   immigration_scale=args.immigration_scale,
+                                                   migration_scaling=args.migration_scaling,
+                                                   final_projection_year=args.final_projection_year,
+                                                   level=args.level)
+        with pl.Config(tbl_rows=25, tbl_cols=-1, tbl_width_chars=200):
+            print(pl.DataFrame(response['totals']))
+        print(f"{response['key'][:12]}: {response['cached'] or 'projected'} in {response['seconds']:.2f} seconds")
@@ -9,8 +9,12 @@ Created: November 10th, 2025
 import os
 import time
 
+import numpy as np
 import polars as pl
 
+from lorax_engine_p1v0 import (CohortIndex, DenseEngine, LedgerStore, RateStore, build_immigration_tensor,
+                               build_migration_operator, build_rate_store)
+
 
 BASE_FOLDER = 'D:\\OneDrive\\lorax_p1v0\\population'
 if os.path.isdir('C:\\Users\\philm\\OneDrive\\lorax_p1v0\\population'):
@@ -30,6 +34,26 @@ AGE_GROUPS = ['0-4', '5-9', '10-14', '15-19', '20-24', '25-29', '30-34',
               '35-39', '40-44', '45-49', '50-54', '55-59', '60-64', '65-69',
               '70-74', '75-79', '80-84', '85+']
 
+# Define fertile age groups (15-44 converted to five-year groups)
+FERTILE_AGE_GROUPS = ['15-19', '20-24', '25-29', '30-34', '35-39', '40-44']
+
+MALE_BIRTH_FRACTION = 0.512195122  # from Mathews, et al. (2005)
+
+# sort order of the output tables (columns that are present)
+LEDGER_SORT = ('GEOID', 'RACE', 'SEX', 'AGE_GROUP')
+
+# Race/Hispanic origin groups for run_dense(by_race=True) and the Census
+# cc-est2024-alldata column prefixes that make them up (non-Hispanic Asian
+# and NHPI are combined)
+RACES = ['HISPANIC', 'NH_WHITE', 'NH_BLACK', 'NH_AIAN', 'NH_API', 'NH_TOM']
+CENSUS_RACE_COLUMNS = {'HISPANIC': ['H'],
+                       'NH_WHITE': ['NHWA'],
+                       'NH_BLACK': ['NHBA'],
+                       'NH_AIAN': ['NHIA'],
+                       'NH_API': ['NHAA', 'NHNA'],
+                       'NH_TOM': ['NHTOM']}
+
+
 def age_to_age_group(age):
     """Convert single year age to five-year age group."""
     if age >= 85:
@@ -168,6 +192,48 @@ def set_launch_population():
     return df
 
 
+def get_launch_race_shares():
+    '''
+    Share of each GEOID x AGE_GROUP x SEX cohort in each race/Hispanic origin
+    group, from the 2024 U.S. Census county characteristics (cc-est2024-alldata)
+    files summed to states. Cohorts with no population get the national
+    shares for their age group and sex.
+    '''
+    census_alldata_folder = os.path.join(CENSUS_CSV_FOLDER, '2024', 'intercensal', 'alldata')
+    if not os.path.isdir(census_alldata_folder):
+        raise FileNotFoundError(f"Race/Hispanic origin estimates (cc-est2024-alldata) not found in {census_alldata_folder}")
+
+    df_list = []
+    for csv in os.listdir(census_alldata_folder):
+        if csv.endswith('.csv'):
+            temp = pl.read_csv(source=os.path.join(census_alldata_folder, csv),
+                               encoding='latin1').filter((pl.col('YEAR') == 6) & (pl.col('AGEGRP') > 0))
+            temp = temp.with_columns([pl.col('STATE').cast(pl.String).str.zfill(2).alias('GEOID'),
+                                      pl.col('AGEGRP').map_elements(lambda x: AGE_GROUPS[x - 1], return_dtype=pl.String).alias('AGE_GROUP')])
+            temp = temp.select(['GEOID', 'AGE_GROUP'] +
+                               [pl.sum_horizontal([f'{prefix}_{sex}' for prefix in prefixes]).alias(f'{race}|{sex}')
+                                for race, prefixes in CENSUS_RACE_COLUMNS.items()
+                                for sex in ('MALE', 'FEMALE')])
+            temp = temp.unpivot(index=['GEOID', 'AGE_GROUP'], variable_name='RACE_SEX', value_name='POPULATION')
+            df_list.append(temp)
+    df = pl.concat(items=df_list, how='vertical')
+
+    df = df.with_columns(pl.col('RACE_SEX').str.split_exact('|', 1).struct.rename_fields(['RACE', 'SEX'])).unnest('RACE_SEX')
+    df = df.group_by(['RACE', 'GEOID', 'AGE_GROUP', 'SEX']).agg(pl.col('POPULATION').sum())
+
+    national = (df.group_by(['RACE', 'AGE_GROUP', 'SEX']).agg(pl.col('POPULATION').sum())
+                  .with_columns((pl.col('POPULATION') / pl.col('POPULATION').sum().over(['AGE_GROUP', 'SEX'])).alias('NATIONAL_SHARE'))
+                  .drop('POPULATION'))
+    df = df.join(other=national, on=['RACE', 'AGE_GROUP', 'SEX'], how='left', coalesce=True)
+    df = df.with_columns(pl.col('POPULATION').sum().over(['GEOID', 'AGE_GROUP', 'SEX']).alias('TOTAL'))
+    df = df.with_columns(pl.when(pl.col('TOTAL') > 0)
+                         .then(pl.col('POPULATION') / pl.col('TOTAL'))
+                         .otherwise(pl.col('NATIONAL_SHARE'))
+                         .alias('RACE_SHARE'))
+
+    return df.select(['RACE', 'GEOID', 'AGE_GROUP', 'SEX', 'RACE_SHARE'])
+
+
 def main(scenario, version):
     '''
     TODO: Add docstring
@@ -181,7 +247,7 @@ class Projector():
     '''
     TODO: Add docstring
     '''
-    def __init__(self, scenario, version):
+    def __init__(self, scenario, version, rate_folder=None, rate_dtype='float64'):
 
         # time-related attributes
         self.launch_year = 2024
@@ -197,6 +263,10 @@ class Projector():
 
         # immigration-related attributes
         self.immigrants = None
+        self.immigration_index = None
+        self.immigration_years = None
+        self.immigration_tensor = None
+        self.build_immigration()
 
         # mortality-related attributes
         self.deaths = None
@@ -207,6 +277,13 @@ class Projector():
         # fertility-related attributes
         self.births = None
 
+        # mortality and fertility rates for every time step; optionally
+        # saved to and memory-mapped from rate_folder
+        self.rate_folder = rate_folder
+        self.rate_dtype = rate_dtype
+        self.rates = None
+        self.build_rates()
+
 
     def run(self, final_projection_year=2098):
         '''
@@ -344,6 +421,139 @@ class Projector():
             del temp
 
 
+    def build_dense_engine(self, geoids, by_race=False):
+        '''
+        Assemble a DenseEngine over the given states from the precomputed
+        rates and immigration allocation plus the migration rates. With
+        by_race, the engine's population has a leading RACE axis and net
+        immigration is split by the launch race shares.
+        '''
+        missing = set(geoids) - set(self.rates.index.geoids)
+        assert not missing, f"No mortality or fertility rates for {sorted(missing)}"
+
+        rates = self.rates.subset(geoids)
+        immigration = self.immigration_index.take_geoids(self.immigration_tensor, geoids)
+
+        migration_rates = pl.read_csv(os.path.join(PROCESSED_FILES, 'migration', 'state_adjusted_acs_gross_migration_age_sex_fractions_2011_2015.csv'))
+        migration_rates = migration_rates.with_columns([pl.col('ORIGIN_FIPS').cast(pl.String).str.zfill(2).alias('ORIGIN_FIPS'),
+                                                        pl.col('DESTINATION_FIPS').cast(pl.String).str.zfill(2).alias('DESTINATION_FIPS')])
+
+        # migration flows are over a 5-year period (multiply by 5)
+        migration = build_migration_operator(index=rates.index, rates=migration_rates, scale=5.0)
+
+        races = None
+        shares = None
+        if by_race:
+            races = RACES
+            shares = rates.index.with_races(RACES).to_array(get_launch_race_shares(), 'RACE_SHARE')
+
+        # run() adds the launch population remainders from the second time
+        # step on, so the dense engine does the same
+        return DenseEngine(rates=rates,
+                           immigration=immigration,
+                           immigration_years=self.immigration_years,
+                           migration=migration,
+                           male_birth_fraction=MALE_BIRTH_FRACTION,
+                           remainder_mode='launch',
+                           races=races,
+                           immigration_shares=shares)
+
+    def run_dense(self, final_projection_year=2098, ledger_folder=None, by_race=False):
+        '''
+        Run the same projection as run() on dense arrays and write the same
+        output tables once at the end. With ledger_folder, every year is
+        written to a memory-mapped LedgerStore there as it is projected and
+        the output tables are exported from it a few states at a time, so
+        memory does not grow with the horizon.
+
+        With by_race, the population also carries race/Hispanic origin
+        (RACES). The launch population and net immigration are split by the
+        2024 Census race shares of each cohort, births take the race of the
+        mother, and the output tables are written as
+        {ledger}_by_race_age_group_sex_{scenario}.csv with a RACE column.
+        The current rate inputs have no race detail, so every race gets the
+        same mortality, fertility and migration rates.
+        '''
+        self.current_pop = set_launch_population()
+        launch_r = (pl.read_csv(os.path.join(OUTPUT_FOLDER, f'population_by_age_group_sex_{self.scenario}_r'))
+                      .with_columns(pl.col('GEOID').cast(pl.String).str.zfill(2)))
+
+        engine = self.build_dense_engine(sorted(self.current_pop.get_column('GEOID').unique().to_list()), by_race=by_race)
+        index = engine.index
+        years = list(range(self.current_projection_year, final_projection_year + 1, 5))
+
+        print(f"{time.ctime()}")
+        print(f"Total population (start): {int(self.current_pop.select('POPULATION').sum().item()):,}\n")
+
+        launch_pop = engine.rates.index.to_array(self.current_pop, 'POPULATION')
+        launch_remainder = engine.rates.index.to_array(launch_r, 'POPULATION_REMAINDER')
+        if by_race:
+            # split the unrounded launch population by race and re-round
+            # every race cohort
+            launch_pop = engine.immigration_shares * (launch_pop + launch_remainder)
+            launch_remainder = launch_pop - np.round(launch_pop)
+            launch_pop = np.round(launch_pop)
+
+        store = None
+        if ledger_folder is not None:
+            store = LedgerStore.create(ledger_folder, index, years)
+
+        results = engine.run(launch_pop=launch_pop,
+                             launch_remainder=launch_remainder,
+                             years=years,
+                             store=store)
+        if store is None:
+            self.write_ledgers(engine.ledger_frames(results, years))
+            final_pop = results['population'][-1]
+        else:
+            self.export_ledgers(store)
+            final_pop = store.array('population')[-1]
+
+        self.current_pop = index.to_frame(final_pop, 'POPULATION')
+        self.current_projection_year = years[-1] + 5
+
+        print(f"{time.ctime()}")
+        print(f"Total population (end): {int(self.current_pop.select('POPULATION').sum().item()):,}\n")
+
+        return results
+
+    def write_ledgers(self, frames):
+        '''
+        Write ledger tables in the layout of the run() outputs.
+        '''
+        for name, df in frames.items():
+            df = df.sort(by=[col for col in LEDGER_SORT if col in df.columns])
+            df.write_csv(self.ledger_csv(name, df))
+
+    def ledger_csv(self, name, df):
+        '''
+        Output file of a ledger table; tables with a RACE column are
+        written as {ledger}_by_race_age_group_sex_{scenario}.csv.
+        '''
+        table = 'race_age_group_sex' if 'RACE' in df.columns else 'age_group_sex'
+        return os.path.join(OUTPUT_FOLDER, f'{name}_by_{table}_{self.scenario}.csv')
+
+    def export_ledgers(self, store, geoids_per_batch=10):
+        '''
+        Write the ledger tables of a LedgerStore in the layout of the run()
+        outputs, reading geoids_per_batch states at a time. Batches follow
+        the sorted GEOIDs, so the files come out in the same order as
+        write_ledgers().
+        '''
+        files = {}
+        try:
+            for frames in store.frame_batches(geoids_per_batch):
+                for name, df in frames.items():
+                    df = df.sort(by=[col for col in LEDGER_SORT if col in df.columns])
+                    if name not in files:
+                        files[name] = open(self.ledger_csv(name, df), 'w')
+                        df.write_csv(files[name])
+                    else:
+                        df.write_csv(files[name], include_header=False)
+        finally:
+            for f in files.values():
+                f.close()
+
     def advance_age_groups(self):
         """
         Advance population from one five-year age group to the next.
@@ -389,6 +599,63 @@ class Projector():
         print("finished!")
 
 
+    def build_rates(self):
+        '''
+        Materialize the final mortality and fertility rates for every
+        five-year time step: CDC base rates x CBO multipliers x calibration
+        parameters x 5 years. If rate_folder is set the rates are written
+        there and memory-mapped, and later runs with the same parameters and
+        inputs open them without rebuilding.
+        '''
+        mort_csv = os.path.join(PROCESSED_FILES, 'mortality', 'state_adjusted_cdc_mortality_2023_p1v0.csv')
+        cbo_mort_csv = os.path.join(PROCESSED_FILES, 'mortality', 'cbo_mortality_p1v0.csv')
+        fert_csv = os.path.join(PROCESSED_FILES, 'fertility', 'state_adjusted_cdc_fertility_2024_p1v0.csv')
+        cbo_fert_csv = os.path.join(PROCESSED_FILES, 'fertility', 'national_cbo_fertility_p1v0.csv')
+
+        params = {'geography': 'state',
+                  'launch_year': self.launch_year,
+                  'mort_mult_param': MORT_MULT_PARAM,
+                  'fert_mult_param': FERT_MULT_PARAM,
+                  'dtype': self.rate_dtype,
+                  'inputs': {os.path.basename(csv): os.path.getmtime(csv)
+                             for csv in (mort_csv, cbo_mort_csv, fert_csv, cbo_fert_csv)}}
+
+        if self.rate_folder is not None and RateStore.saved_params(self.rate_folder) == params:
+            self.rates = RateStore.load(self.rate_folder, mmap=True)
+            return
+
+        state_mort_rates = (pl.read_csv(source=mort_csv)
+                              .with_columns(pl.col('GEOID').cast(pl.String).str.zfill(2).alias('GEOID')))
+        cbo_mort_multiply = pl.read_csv(source=cbo_mort_csv)
+        state_fert_rates = (pl.read_csv(source=fert_csv)
+                              .with_columns(pl.col('GEOID').cast(pl.String).str.zfill(2).alias('GEOID')))
+        fert_multiply = pl.read_csv(source=cbo_fert_csv)
+
+        # projection years covered by both CBO adjustment files
+        years = [year for year in range(self.launch_year + 5, 2100, 5)
+                 if f'ASMR_{year}' in cbo_mort_multiply.columns and f'ASFR_{year}' in fert_multiply.columns]
+
+        index = CohortIndex(geoids=sorted(state_mort_rates.get_column('GEOID').unique().to_list()),
+                            ages=AGE_GROUPS,
+                            age_col='AGE_GROUP')
+
+        # deaths and births are calculated over a 5-year period (multiply by 5)
+        self.rates = build_rate_store(index=index,
+                                      years=years,
+                                      base_mortality=state_mort_rates,
+                                      mortality_multipliers=cbo_mort_multiply,
+                                      base_fertility=state_fert_rates,
+                                      fertility_multipliers=fert_multiply,
+                                      fertile_ages=FERTILE_AGE_GROUPS,
+                                      mortality_scale=5.0 * MORT_MULT_PARAM,
+                                      fertility_scale=5.0 * FERT_MULT_PARAM,
+                                      dtype=self.rate_dtype,
+                                      params=params)
+
+        if self.rate_folder is not None:
+            self.rates.save(self.rate_folder)
+            self.rates = RateStore.load(self.rate_folder, mmap=True)
+
     def mortality(self):
         '''
         Calculate mortality for five-year age groups
@@ -396,34 +663,14 @@ class Projector():
 
         print("Calculating mortality...", end='')
 
-        # Read single-year mortality rates and convert to age groups
-        mort_rates = os.path.join(PROCESSED_FILES, 'mortality', 'state_adjusted_cdc_mortality_2023_p1v0.csv')
-        state_mort_rates = (pl.read_csv(source=mort_rates)
-                             .with_columns(pl.col('GEOID').cast(pl.String).str.zfill(2).alias('GEOID')))
-
-        df = self.current_pop.clone()
-        df = df.join(other=state_mort_rates,
-                        on=['GEOID', 'AGE_GROUP', 'SEX'],
-                        how='left',
-                        coalesce=True)
-
-        # Read CBO mortality adjustments
-        cbo_mort_csv = os.path.join(PROCESSED_FILES, 'mortality', 'cbo_mortality_p1v0.csv')
-        cbo_mort_multiply = (pl.read_csv(source=cbo_mort_csv)
-                               .select(['AGE_GROUP', 'SEX', f'ASMR_{self.current_projection_year}'])
-                               .rename({f'ASMR_{self.current_projection_year}': 'MORT_MULTIPLY'}))
-
-        # join CBO mortality rate adjustments
-        df = df.join(other=cbo_mort_multiply,
-                     on=['AGE_GROUP', 'SEX'],
-                     how='left',
-                     coalesce=True)
-
-        df = df.with_columns(((pl.col('MORTALITY_RATE_100K') * pl.col('MORT_MULTIPLY')) / 100000.0).alias('MORT_PROJ'))
-
-        # calculate deaths over 5-year period (multiply by 5)
-        df = df.with_columns((pl.col('MORT_PROJ') * pl.col('POPULATION') * 5.0 * MORT_MULT_PARAM).alias('DEATHS'))
-        df = df.select(['GEOID', 'AGE_GROUP', 'SEX', 'DEATHS'])
+        # deaths over the 5-year period are the population times the
+        # precomputed rates for this time step
+        pop = self.rates.index.to_array(self.current_pop, 'POPULATION')
+        df = self.rates.index.to_frame(arr=self.rates.deaths(pop, self.current_projection_year),
+                                       value_col='DEATHS')
+        df = df.join(other=self.current_pop.select(['GEOID', 'AGE_GROUP', 'SEX']),
+                     on=['GEOID', 'AGE_GROUP', 'SEX'],
+                     how='semi')
 
         # store deaths
         self.deaths = df.clone()
@@ -444,47 +691,53 @@ class Projector():
 
         print(f"finished! ({total_deaths_this_year:,} deaths this period)")
 
-    def immigration(self):
+    def build_immigration(self):
         '''
-        Calculate net immigration for five-year age groups
+        Allocate CBO net immigration to states for every five-year time step
+        up front. Neither the ACS weights nor the CBO totals depend on the
+        projected population, so the full [TIME_STEP, GEOID, AGE_GROUP, SEX]
+        array is built once and sliced by immigration().
         '''
-        print("Calculating net immigration...", end='')
-        # get the County level age-sex proportions
-        county_weights_csv = os.path.join(PROCESSED_FILES, 'immigration', 'state_acs_immigration_age_sex_fractions_2011_2015.csv')
-        county_weights = pl.read_csv(source=county_weights_csv)
-        county_weights = county_weights.with_columns(pl.col('GEOID').cast(pl.String).str.zfill(2).alias('GEOID'))
+        # get the state level age-sex proportions
+        weights_csv = os.path.join(PROCESSED_FILES, 'immigration', 'state_acs_immigration_age_sex_fractions_2011_2015.csv')
+        weights = pl.read_csv(source=weights_csv)
+        weights = weights.with_columns(pl.col('GEOID').cast(pl.String).str.zfill(2).alias('GEOID'))
 
-        # this is the net migrants for each age-sex combination
-        time_step = f'{self.current_projection_year - 4}-{self.current_projection_year}'
+        # this is the net migrants for each time step and age-sex combination
         df_cbo = pl.read_csv(source=os.path.join(PROCESSED_FILES, 'immigration', 'national_cbo_net_migration_by_year_age_sex.csv'))
-        df_cbo = (df_cbo.filter(pl.col('TIME_STEP') == time_step)
-                        .select(['AGE_GROUP', 'SEX', 'NET_IMMIGRATION']))
+        df_cbo = df_cbo.filter(pl.col('TIME_STEP').is_not_null())
+
+        # keep the time steps that end in a projection year
+        step_ends = sorted(int(time_step[-4:]) for time_step in df_cbo.get_column('TIME_STEP').unique().to_list())
+        self.immigration_years = [year for year in step_ends
+                                  if year > self.launch_year and (year - self.launch_year) % 5 == 0]
+        time_steps = [f'{year - 4}-{year}' for year in self.immigration_years]
+
+        self.immigration_index = CohortIndex(geoids=sorted(weights.get_column('GEOID').unique().to_list()),
+                                             ages=AGE_GROUPS,
+                                             age_col='AGE_GROUP')
+        self.immigration_tensor = build_immigration_tensor(index=self.immigration_index,
+                                                           weights=weights,
+                                                           national=df_cbo,
+                                                           time_col='TIME_STEP',
+                                                           times=time_steps)
 
-        df_cbo = df_cbo.group_by(['AGE_GROUP', 'SEX']).agg(pl.col('NET_IMMIGRATION').sum())
-
-        df = (county_weights.join(other=df_cbo,
-                                  on=['AGE_GROUP', 'SEX'],
-                                  how='left',
-                                  coalesce=True)
-                            .with_columns((pl.col('NET_IMMIGRATION') * pl.col('PERCENT_OF_AGE_SEX_COHORT'))
-                            .alias('NET_IMMIGRATION'))
-                            .drop('PERCENT_OF_AGE_SEX_COHORT'))
-
-        self.immigrants = df.clone()
+    def immigration(self):
+        '''
+        Calculate net immigration for five-year age groups
+        '''
+        print("Calculating net immigration...", end='')
 
-        # store time series of immigration in sqlite3
-        if self.current_projection_year == self.launch_year + 5:
-            immigration = self.immigrants.rename({'NET_IMMIGRATION': str(self.current_projection_year)}).clone()
-        else:
-            immigration = (pl.read_csv(os.path.join(OUTPUT_FOLDER, f'immigration_by_age_group_sex_{self.scenario}.csv'))
-                           .with_columns(pl.col('GEOID').cast(pl.String).str.zfill(2)))
-            current_immigration = self.immigrants.clone()
-            current_immigration = current_immigration.rename({'NET_IMMIGRATION': str(self.current_projection_year)}).clone()
-            immigration = pl.concat(items=[immigration, current_immigration], how='align')
+        t = self.immigration_years.index(self.current_projection_year)
+        self.immigrants = self.immigration_index.to_frame(arr=self.immigration_tensor[t],
+                                                          value_col='NET_IMMIGRATION')
 
+        # store time series of immigration
+        immigration = self.immigration_index.ledger_frame(arr=self.immigration_tensor[:t + 1],
+                                                          labels=self.immigration_years[:t + 1])
         immigration.write_csv(file=os.path.join(OUTPUT_FOLDER, f'immigration_by_age_group_sex_{self.scenario}.csv'))
 
-        total_immigrants_this_year = round(immigration.select(f'{self.current_projection_year}').sum().item())
+        total_immigrants_this_year = round(self.immigration_tensor[t].sum())
         print(f"finished! ({total_immigrants_this_year:,} net immigrants this period)")
 
     def migration(self):
@@ -558,40 +811,19 @@ class Projector():
         '''
         print("Calculating fertility...", end='')
 
-        # Define fertile age groups (15-44 converted to five-year groups)
-        fertile_age_groups = ['15-19', '20-24', '25-29', '30-34', '35-39', '40-44']
-
-        # get CDC fertility rates by AGE and COUNTY, aggregate to age groups
-        state_fert_rates = (pl.read_csv(source=os.path.join(PROCESSED_FILES, 'fertility', 'state_adjusted_cdc_fertility_2024_p1v0.csv'))
-                                         .with_columns(pl.col('GEOID').cast(pl.String).str.zfill(2).alias('GEOID')))
-
-
-        df = self.current_pop.filter((pl.col('SEX') == 'FEMALE') & (pl.col('AGE_GROUP').is_in(fertile_age_groups)))
-
-        # get CBO fertility rate adjustments
-        fert_multiply = (pl.read_csv(source=os.path.join(PROCESSED_FILES, 'fertility', 'national_cbo_fertility_p1v0.csv'))
-                         .select(['AGE_GROUP', f'ASFR_{self.current_projection_year}'])
-                         .rename({f'ASFR_{self.current_projection_year}': 'FERT_MULT'}))
-
-        # adjust the county fertility rates using change factors from
-        # CBO and then calculate births
-        df = df.join(other=state_fert_rates,
-                     on=['GEOID', 'AGE_GROUP'],
-                     how='left',
-                     coalesce=True)
-
-        df = df.join(other=fert_multiply,
-                     on='AGE_GROUP',
-                     how='left',
-                     coalesce=True)
-
-        # Calculate births over 5-year period (multiply by 5)
-        df = df.with_columns(((pl.col('FERTILITY') / 1000) * pl.col('FERT_MULT') * pl.col('POPULATION') * 5.0 * FERT_MULT_PARAM).alias('TOTAL_BIRTHS'))
-        df = df.with_columns((pl.col('TOTAL_BIRTHS') * 0.512195122).alias('MALE'))  # from Mathews, et al. (2005)
-        df = df.with_columns((pl.col('TOTAL_BIRTHS') - pl.col('MALE')).alias('FEMALE'))
-        df = (df.select(['GEOID', 'MALE', 'FEMALE'])
-                .unpivot(index='GEOID', variable_name='SEX', value_name='BIRTHS')
-                .group_by(['GEOID', 'SEX']).agg(pl.col('BIRTHS').sum()))
+        # births over the 5-year period are the population times the
+        # precomputed rates for this time step, summed by state
+        pop = self.rates.index.to_array(self.current_pop, 'POPULATION')
+        total_births = self.rates.births(pop, self.current_projection_year)
+        male_births = total_births * MALE_BIRTH_FRACTION
+
+        df = pl.DataFrame({'GEOID': self.rates.index.geoids,
+                           'MALE': male_births,
+                           'FEMALE': total_births - male_births})
+        df = df.join(other=self.current_pop.select('GEOID').unique(),
+                     on='GEOID',
+                     how='semi')
+        df = df.unpivot(index='GEOID', variable_name='SEX', value_name='BIRTHS')
         df = df.with_columns(pl.lit('0-4').alias('AGE_GROUP'))
 
         # store births
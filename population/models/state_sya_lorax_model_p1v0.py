@@ -0,0 +1,301 @@
+"""
+Author:  Phil Morefield
+Purpose: Create state-level population projections by single year of age
+         with annual time steps, from the county single-year inputs
+         aggregated to states
+Created: October 19th, 2026
+
+The five-year state model (state_lorax_model_p1v0.py) projects five-year age
+groups in five-year steps, multiplying deaths, births and flows by 5.0. This
+model runs the county model's annual cohort-component steps on the 51 states
+instead, so none of that approximation is needed, and writes the five-year
+tables (same layout as the state model outputs) by summing the annual
+results rather than through a separate code path.
+
+County rates are aggregated to states weighted by the 2024 county launch
+population of each cohort: mortality and migration by the cohort's
+population, fertility by its female population. Migration between two
+counties in the same state is dropped. Net immigration weights are summed.
+"""
+import os
+import time
+
+import numpy as np
+import polars as pl
+
+from county_lorax_model_p1v0 import get_launch_population
+from lorax_engine_p1v0 import (AttributionCube, CohortIndex, DenseEngine, GeographyIndex, build_immigration_tensor,
+                               build_migration_operator, build_rate_store, coarsen_results, ledger_frames)
+
+
+BASE_FOLDER = 'D:\\OneDrive\\ICLUS_v3\\population'
+if os.path.isdir('C:\\Users\\philm\\OneDrive\\ICLUS_v3\\population'):
+    BASE_FOLDER = 'C:\\Users\\philm\\OneDrive\\ICLUS_v3\\population'
+
+INPUT_FOLDER = os.path.join(BASE_FOLDER, 'inputs')
+DATABASE_FOLDER = os.path.join(INPUT_FOLDER, 'databases')
+OUTPUT_FOLDER = os.path.join(BASE_FOLDER, 'outputs', 'single_year')
+
+AGES = list(range(86))  # single years of age, 85 is 85+
+FERTILE_AGES = list(range(15, 45))
+
+# five-year age groups of the post-aggregated outputs and the position of
+# each group's first single year of age
+AGE_GROUPS = ['0-4', '5-9', '10-14', '15-19', '20-24', '25-29', '30-34',
+              '35-39', '40-44', '45-49', '50-54', '55-59', '60-64', '65-69',
+              '70-74', '75-79', '80-84', '85+']
+AGE_GROUP_STARTS = list(range(0, 86, 5))
+
+# years between the post-aggregated outputs, counted from the launch year
+OUTPUT_STEP = 5
+
+MALE_BIRTH_FRACTION = 0.512195122  # from Mathews, et al. (2005)
+
+SORT = ('GEOID', 'SEX', 'AGE', 'AGE_GROUP')
+
+
+def to_state(col):
+    return pl.col(col).str.slice(0, 2)
+
+
+def weighted_state_rates(rates, weights, keys, value_col):
+    '''
+    Aggregate county rates to states, weighting each county by weights
+    (GEOID, keys..., WEIGHT). State cohorts whose counties have no weight
+    get the unweighted mean of the county rates.
+    '''
+    df = rates.join(other=weights, on=['GEOID'] + keys, how='left', coalesce=True)
+    df = df.with_columns([to_state('GEOID').alias('GEOID'),
+                          pl.col('WEIGHT').fill_null(0.0)])
+    df = df.group_by(['GEOID'] + keys).agg([(pl.col(value_col) * pl.col('WEIGHT')).sum().alias('RATE_X_WEIGHT'),
+                                            pl.col('WEIGHT').sum(),
+                                            pl.col(value_col).mean().alias('MEAN_RATE')])
+
+    return df.select(['GEOID'] + keys +
+                     [pl.when(pl.col('WEIGHT') > 0)
+                        .then(pl.col('RATE_X_WEIGHT') / pl.col('WEIGHT'))
+                        .otherwise(pl.col('MEAN_RATE'))
+                        .alias(value_col)])
+
+
+def main(scenario, version, fert_calibr_pct, mort_calibr_pct):
+    '''
+    Run the single-year state projection and write the annual and
+    five-year output tables.
+    '''
+    model = Projector(scenario=scenario,
+                      version=version,
+                      fert_calibr=fert_calibr_pct,
+                      mort_calibr=mort_calibr_pct)
+    model.run()
+
+
+class Projector():
+    '''
+    State projections by single year of age with annual time steps, on the
+    dense engine.
+    '''
+    def __init__(self, scenario, version, fert_calibr=0.0, mort_calibr=0.0):
+
+        # time-related attributes
+        self.launch_year = 2024
+        self.current_projection_year = self.launch_year + 1
+
+        # scenario-related attributes
+        self.scenario = scenario
+        self.version = version
+        self.mort_calibr = mort_calibr
+        self.fert_calibr_pct = fert_calibr
+
+        # 2024 county population, the source of the state launch population
+        # and of the aggregation weights
+        self.county_pop = None
+        self.current_pop = None
+
+    def state_launch_population(self, index):
+        '''
+        Unrounded 2024 state population on index.
+        '''
+        county_index = index.with_geoids(self.county_pop.get_column('GEOID').unique().sort().to_list())
+        geography = GeographyIndex.from_prefixes(county_index.geoids, {'STATE': 2})
+        states = geography.rollup(county_index.to_array(self.county_pop, 'POPULATION'), 'STATE')
+
+        return geography.parent_index(county_index, 'STATE').take_geoids(states, index.geoids)
+
+    def build_rates(self, index):
+        '''
+        County CDC mortality and fertility rates aggregated to states, times
+        the CBO multipliers and calibration percentages of every projection
+        year.
+        '''
+        county_mort_rates = (pl.read_csv(source=os.path.join(DATABASE_FOLDER, 'mortality_2019_2023_county.csv'))
+                               .with_columns(pl.col('GEOID').cast(pl.String).str.zfill(5).alias('GEOID')))
+        cbo_mort_multiply = pl.read_csv(source=os.path.join(DATABASE_FOLDER, 'cbo_mortality_p1v1.csv'))
+        county_fert_rates = (pl.read_csv(source=os.path.join(DATABASE_FOLDER, 'fertility_2020_2024_county.csv'))
+                               .with_columns(pl.col('GEOID').cast(pl.String).str.zfill(5).alias('GEOID')))
+        fert_multiply = pl.read_csv(source=os.path.join(DATABASE_FOLDER, 'cbo_fertility_p1v1.csv'))
+
+        weights = self.county_pop.rename({'POPULATION': 'WEIGHT'})
+        female_weights = weights.filter(pl.col('SEX') == 'FEMALE').drop('SEX')
+        state_mort_rates = weighted_state_rates(county_mort_rates, weights, ['AGE', 'SEX'], 'MORTALITY_RATE_100K')
+        state_fert_rates = weighted_state_rates(county_fert_rates, female_weights, ['AGE'], 'FERTILITY')
+
+        # projection years covered by both CBO adjustment files
+        years = [year for year in range(self.launch_year + 1, 2100)
+                 if f'ASMR_{year}' in cbo_mort_multiply.columns and f'ASFR_{year}' in fert_multiply.columns]
+
+        return build_rate_store(index=index,
+                                years=years,
+                                base_mortality=state_mort_rates,
+                                mortality_multipliers=cbo_mort_multiply,
+                                base_fertility=state_fert_rates,
+                                fertility_multipliers=fert_multiply,
+                                fertile_ages=FERTILE_AGES,
+                                mortality_scale=1.0 + (0.01 * self.mort_calibr),
+                                fertility_scale=1.0 + (0.01 * self.fert_calibr_pct))
+
+    def build_immigration(self, index):
+        '''
+        CBO national net immigration allocated to states by the county ACS
+        weights summed to states.
+
+        Returns:
+            ndarray: [YEAR, GEOID, AGE, SEX] net immigrants.
+            list: years of the first axis.
+        '''
+        county_weights = pl.read_csv(source=os.path.join(DATABASE_FOLDER, 'acs_immigration_age_sex_fractions_2011_2015.csv'))
+        state_weights = (county_weights.with_columns(pl.col('GEOID').cast(pl.String).str.zfill(5).alias('GEOID'))
+                                       .group_by([to_state('GEOID').alias('GEOID'), 'AGE', 'SEX'])
+                                       .agg(pl.col('PERCENT_OF_AGE_SEX_COHORT').sum()))
+
+        df_cbo = pl.read_csv(source=os.path.join(DATABASE_FOLDER, 'cbo_national_net_migration_by_year_age_sex.csv'))
+        df_cbo = df_cbo.with_columns(pl.col('AGE').cast(pl.Int32))
+        years = sorted(year for year in df_cbo.get_column('YEAR').unique().to_list() if year > self.launch_year)
+
+        immigration = build_immigration_tensor(index=index,
+                                               weights=state_weights,
+                                               national=df_cbo,
+                                               time_col='YEAR',
+                                               times=years)
+
+        return immigration, years
+
+    def build_migration(self, index):
+        '''
+        State-to-state migration rates: the county flows the 2024 population
+        would produce, summed by origin and destination state and divided
+        by the origin state's population. Flows within a state are dropped.
+        '''
+        rates = pl.scan_csv(os.path.join(DATABASE_FOLDER, 'acs_gross_migration_age_sex_fractions_2011_2015.csv'),
+                            schema_overrides={'ORIGIN_FIPS': pl.String, 'DESTINATION_FIPS': pl.String})
+        rates = rates.with_columns([pl.col('ORIGIN_FIPS').str.zfill(5),
+                                    pl.col('DESTINATION_FIPS').str.zfill(5)])
+
+        # we have migration rates to/from Puerto Rico, but not currently
+        # modeling migration involving PR
+        rates = rates.filter(~pl.col('ORIGIN_FIPS').str.starts_with('7') & ~pl.col('DESTINATION_FIPS').str.starts_with('7'))
+        rates = rates.filter(to_state('ORIGIN_FIPS') != to_state('DESTINATION_FIPS'))
+
+        flows = rates.join(other=self.county_pop.lazy(),
+                           left_on=['ORIGIN_FIPS', 'AGE', 'SEX'],
+                           right_on=['GEOID', 'AGE', 'SEX'],
+                           how='inner')
+        flows = (flows.group_by([to_state('ORIGIN_FIPS').alias('ORIGIN_FIPS'),
+                                 to_state('DESTINATION_FIPS').alias('DESTINATION_FIPS'),
+                                 'AGE', 'SEX'])
+                      .agg((pl.col('MIGRATION_RATE').fill_null(0) * pl.col('POPULATION')).sum().alias('FLOW'))
+                      .collect(engine='streaming'))
+
+        origin_pop = index.to_frame(self.state_launch_population(index), 'POPULATION')
+        flows = flows.join(other=origin_pop,
+                           left_on=['ORIGIN_FIPS', 'AGE', 'SEX'],
+                           right_on=['GEOID', 'AGE', 'SEX'],
+                           how='left',
+                           coalesce=True)
+        flows = flows.with_columns(pl.when(pl.col('POPULATION') > 0)
+                                     .then(pl.col('FLOW') / pl.col('POPULATION'))
+                                     .otherwise(0.0)
+                                     .alias('MIGRATION_RATE'))
+
+        return build_migration_operator(index=index, rates=flows)
+
+    def build_engine(self):
+        '''
+        Aggregate the county inputs to states and set up the dense engine
+        with annual steps and carried remainders, as in the county model.
+        '''
+        self.county_pop = get_launch_population()
+        geoids = sorted(self.county_pop.select(to_state('GEOID')).unique().get_column('GEOID').to_list())
+        index = CohortIndex(geoids=geoids, ages=AGES, age_col='AGE')
+
+        immigration, immigration_years = self.build_immigration(index)
+
+        return DenseEngine(rates=self.build_rates(index),
+                           immigration=immigration,
+                           immigration_years=immigration_years,
+                           migration=self.build_migration(index),
+                           male_birth_fraction=MALE_BIRTH_FRACTION,
+                           remainder_mode='carry')
+
+    def run(self, final_projection_year=2098):
+        '''
+        Project the states one year at a time and write both the annual
+        single-year tables ({ledger}_by_age_sex_{scenario}.csv) and the
+        five-year tables in the state model layout
+        ({ledger}_by_age_group_sex_{scenario}.csv), plus the components of
+        change by state, year and age (components_of_change_{scenario}.parquet).
+
+        Returns:
+            dict: [YEAR, GEOID, AGE, SEX] results of every annual step.
+        '''
+        engine = self.build_engine()
+        index = engine.index
+
+        launch = self.state_launch_population(index)
+        launch_pop = np.round(launch)
+
+        years = list(range(self.current_projection_year, final_projection_year + 1))
+        print(f"{time.ctime()}")
+        print(f"Total population (start): {int(launch_pop.sum()):,}\n")
+
+        cube = AttributionCube(index, by_age=True)
+        results = engine.run(launch_pop=launch_pop,
+                             launch_remainder=launch - launch_pop,
+                             years=years,
+                             cube=cube)
+
+        os.makedirs(OUTPUT_FOLDER, exist_ok=True)
+        self.write_tables(engine.ledger_frames(results, years), 'age_sex')
+        cube.write(os.path.join(OUTPUT_FOLDER, f'components_of_change_{self.scenario}.parquet'))
+
+        milestone_years = [year for year in years if (year - self.launch_year) % OUTPUT_STEP == 0]
+        if milestone_years:
+            group_index, coarse = coarsen_results(index=index,
+                                                  results=results,
+                                                  years=years,
+                                                  age_groups=AGE_GROUPS,
+                                                  age_starts=AGE_GROUP_STARTS,
+                                                  milestone_years=milestone_years)
+            self.write_tables(ledger_frames(group_index, coarse, milestone_years), 'age_group_sex')
+
+        self.current_pop = index.to_frame(results['population'][-1], 'POPULATION')
+        self.current_projection_year = years[-1] + 1
+
+        print(f"{time.ctime()}")
+        print(f"Total population (end): {int(self.current_pop.select('POPULATION').sum().item()):,}\n")
+
+        return results
+
+    def write_tables(self, frames, table):
+        for name, df in frames.items():
+            df = df.sort(by=[col for col in SORT if col in df.columns])
+            df.write_csv(os.path.join(OUTPUT_FOLDER, f'{name}_by_{table}_{self.scenario}.csv'))
+
+
+if __name__ == '__main__':
+    print(time.ctime())
+    main(scenario='CBO',
+         version='p1v0',
+         fert_calibr_pct=0.0,
+         mort_calibr_pct=0.0)
+    print(time.ctime())
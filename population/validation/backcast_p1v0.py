@@ -0,0 +1,296 @@
+"""
+Author:  Phil Morefield
+Purpose: Backcast validation: launch the state model from historical years,
+         project to 2015-2024 and score the projections against the Census
+         estimates and components of change
+Created: October 19th, 2026
+
+Every launch year (2010-2019 by default) is projected in five-year steps
+for as many steps as end by LAST_YEAR (2015-2024). All launch years run at
+once through one DenseEngine with a leading LAUNCH axis on the population,
+so the whole backcast is a handful of array steps.
+
+The model is the state model's method with historical inputs:
+
+    launch population   Census POPESTIMATE of each state in the launch
+                        year, spread across age groups and sexes by the
+                        state's age-sex structure in the cc-est2024-syasex
+                        files (the July 1 estimate for 2020-2024, the
+                        April 2020 base for earlier years; the national
+                        structure for states without a file)
+    mortality/fertility the model's rates of its first time step
+    net immigration     the model's allocation across states, ages and
+                        sexes, scaled to the Census national total of each
+                        step (sum of INTERNATIONALMIG over the five years)
+    domestic migration  the model's migration rates
+
+Projected population at the end of each step and the step's births,
+deaths, net immigration and net domestic migration are compared with the
+Census estimates (co-est2020-alldata for 2010-2020, co-est2024-alldata for
+2021-2024; the same files read by the components of change figures). For
+every launch year, horizon, state (and the nation) and component:
+
+    ALPE = 100 * (projected - actual) / |actual|    (algebraic percent error)
+    APE  = |ALPE|
+
+The scorecard averages them over states and launch years by component and
+horizon (MAPE, MALPE, median APE), with the national ALPE alongside. The
+percent errors of net domestic migration are large wherever the actual net
+flow is close to zero.
+
+Usage:
+    python backcast_p1v0.py
+    python backcast_p1v0.py --launch-years 2010 2014 2015 2019 --out backcast
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import polars as pl
+
+
+POPULATION_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODELS_FOLDER = os.path.join(POPULATION_FOLDER, 'models')
+CENSUS_CSV_FOLDER = os.path.join(POPULATION_FOLDER, 'inputs', 'raw_files', 'Census')
+OUTPUT_FOLDER = os.path.join(POPULATION_FOLDER, 'outputs', 'backcast')
+
+sys.path.insert(0, MODELS_FOLDER)
+import state_lorax_model_p1v0 as state_model  # noqa: E402
+from compare_engines_p1v0 import configure_state_model  # noqa: E402
+from lorax_engine_p1v0 import DenseEngine, RateStore  # noqa: E402
+
+
+SCENARIO = 'CBO'
+LAUNCH_YEARS = list(range(2010, 2020))
+LAST_YEAR = 2024
+STEP = 5
+
+COMPONENTS = ['POPULATION', 'BIRTHS', 'DEATHS', 'IMMIGRATION', 'MIGRATION']
+CENSUS_COMPONENTS = {'BIRTHS': 'BIRTHS',
+                     'DEATHS': 'DEATHS',
+                     'IMMIGRATION': 'INTERNATIONALMIG',
+                     'MIGRATION': 'DOMESTICMIG'}
+
+# cc-est2024-syasex YEAR codes of the July 1 estimates; 1 is the April 1,
+# 2020 estimates base
+SYASEX_YEARS = {2020: 2, 2021: 3, 2022: 4, 2023: 5, 2024: 6}
+SYASEX_BASE = 1
+
+
+def get_historical_estimates():
+    '''
+    State POPULATION (July 1) and BIRTHS, DEATHS, IMMIGRATION and MIGRATION
+    (the year to July 1) by GEOID and YEAR: 2010-2020 from the 2010-2020
+    intercensal file, 2021-2024 from the 2024 vintage.
+    '''
+    files = {os.path.join(CENSUS_CSV_FOLDER, '2020', 'intercensal', 'co-est2020-alldata.csv'): range(2010, 2021),
+             os.path.join(CENSUS_CSV_FOLDER, '2024', 'intercensal', 'co-est2024-alldata.csv'): range(2021, LAST_YEAR + 1)}
+
+    frames = []
+    for csv, years in files.items():
+        df = pl.read_csv(csv, encoding='latin1').filter(pl.col('COUNTY') == 0)  # state-level rows
+        geoid = pl.col('STATE').cast(pl.String).str.zfill(2).alias('GEOID')
+        for year in years:
+            columns = [geoid, pl.lit(year).alias('YEAR'), pl.col(f'POPESTIMATE{year}').cast(pl.Float64).alias('POPULATION')]
+            columns += [pl.col(f'{census}{year}').cast(pl.Float64).alias(component)
+                        for component, census in CENSUS_COMPONENTS.items()]
+            frames.append(df.select(columns))
+
+    return pl.concat(frames).sort(['GEOID', 'YEAR'])
+
+
+def get_launch_structures(index, years):
+    '''
+    Age-sex shares ([YEAR, GEOID, AGE_GROUP, SEX], summing to 1 over ages
+    and sexes) of every state for every launch year, from the
+    cc-est2024-syasex files. States without a file get the national shares.
+    '''
+    folder = os.path.join(CENSUS_CSV_FOLDER, '2024', 'intercensal', 'syasex')
+    codes = sorted({SYASEX_YEARS.get(year, SYASEX_BASE) for year in years})
+
+    frames = []
+    for csv in sorted(os.listdir(folder)):
+        if csv.endswith('.csv'):
+            df = pl.read_csv(os.path.join(folder, csv), encoding='latin1').filter(pl.col('YEAR').is_in(codes))
+            frames.append(df.select([pl.col('STATE').cast(pl.String).str.zfill(2).alias('GEOID'),
+                                     'YEAR',
+                                     pl.col('AGE').map_elements(state_model.age_to_age_group, return_dtype=pl.String).alias('AGE_GROUP'),
+                                     pl.col('TOT_MALE').alias('MALE'),
+                                     pl.col('TOT_FEMALE').alias('FEMALE')]))
+    df = pl.concat(frames).unpivot(index=['GEOID', 'YEAR', 'AGE_GROUP'], variable_name='SEX', value_name='POPULATION')
+    df = df.group_by(['GEOID', 'YEAR', 'AGE_GROUP', 'SEX']).agg(pl.col('POPULATION').sum())
+
+    shares = np.empty((len(years),) + index.shape)
+    for i, year in enumerate(years):
+        pop = index.to_array(df.filter(pl.col('YEAR') == SYASEX_YEARS.get(year, SYASEX_BASE)), 'POPULATION')
+        totals = pop.sum(axis=(-2, -1), keepdims=True)
+        national = pop.sum(axis=0) / pop.sum()
+        shares[i] = np.where(totals > 0, pop / np.where(totals > 0, totals, 1.0), national)
+
+        missing = [geoid for geoid, total in zip(index.geoids, totals.ravel()) if total == 0]
+        if missing:
+            print(f"No {year} age-sex estimates for {', '.join(missing)}; using the national structure")
+
+    return shares
+
+
+def build_backcast_engine(model, geoids, launch_years, n_steps, historical):
+    '''
+    A DenseEngine over geoids whose time steps are the horizons
+    (5, 10, ...) and whose immigration has a LAUNCH axis:
+    [HORIZON, LAUNCH, GEOID, AGE_GROUP, SEX].
+    '''
+    engine = model.build_dense_engine(geoids)
+    horizons = [STEP * (k + 1) for k in range(n_steps)]
+
+    rates = RateStore(index=engine.index,
+                      years=horizons,
+                      mortality=np.stack([engine.rates.mortality[0]] * n_steps),
+                      fertility=np.stack([engine.rates.fertility[0]] * n_steps),
+                      params=engine.rates.params)
+
+    # national net immigration of every launch year and step, scaled from
+    # the model's first step allocation
+    national = historical.group_by('YEAR').agg(pl.col('IMMIGRATION').sum())
+    national = dict(zip(national.get_column('YEAR').to_list(), national.get_column('IMMIGRATION').to_list()))
+    allocation = np.asarray(engine.immigration[0])
+    immigration = np.empty((n_steps, len(launch_years)) + allocation.shape)
+    for k, horizon in enumerate(horizons):
+        for i, launch in enumerate(launch_years):
+            years = range(launch + horizon - STEP + 1, launch + horizon + 1)
+            total = sum(national[year] for year in years) if all(year in national for year in years) else allocation.sum()
+            immigration[k, i] = allocation * (total / allocation.sum())
+
+    return DenseEngine(rates=rates,
+                       immigration=immigration,
+                       immigration_years=horizons,
+                       migration=engine.migration,
+                       male_birth_fraction=state_model.MALE_BIRTH_FRACTION,
+                       remainder_mode='carry')
+
+
+def score(errors):
+    '''
+    MAPE, MALPE and median APE over states and launch years by component
+    and horizon, with the mean national ALPE.
+    '''
+    states = (errors.filter(pl.col('GEOID') != 'US')
+                    .group_by(['COMPONENT', 'HORIZON'])
+                    .agg([pl.len().alias('N'),
+                          pl.col('APE').mean().alias('MAPE'),
+                          pl.col('ALPE').mean().alias('MALPE'),
+                          pl.col('APE').median().alias('MEDAPE')]))
+    nation = (errors.filter(pl.col('GEOID') == 'US')
+                    .group_by(['COMPONENT', 'HORIZON'])
+                    .agg(pl.col('ALPE').mean().alias('NATION_ALPE')))
+    order = {component: i for i, component in enumerate(COMPONENTS)}
+
+    return (states.join(nation, on=['COMPONENT', 'HORIZON'], how='left')
+                  .sort([pl.col('COMPONENT').replace_strict(order, return_dtype=pl.Int64), 'HORIZON']))
+
+
+def main(launch_years=LAUNCH_YEARS, out=OUTPUT_FOLDER):
+    '''
+    Run the backcast of every launch year and write the per-state errors
+    (backcast_errors_{scenario}.csv), the errors by state across launch
+    years (backcast_by_geography_{scenario}.csv) and the scorecard
+    (backcast_scorecard_{scenario}.csv) to out.
+
+    Returns:
+        DataFrame: the scorecard.
+    '''
+    start = time.perf_counter()
+    launch_years = sorted(launch_years)
+    n_steps = (LAST_YEAR - launch_years[0]) // STEP
+    assert n_steps > 0, f"Launch years must be at least {STEP} years before {LAST_YEAR}"
+
+    configure_state_model(tempfile.mkdtemp(prefix='lorax_backcast_'))
+    model = state_model.Projector(scenario=SCENARIO, version='p1v0')
+    historical = get_historical_estimates()
+    geoids = sorted(set(model.rates.index.geoids) & set(historical.get_column('GEOID').to_list()))
+    historical = historical.filter(pl.col('GEOID').is_in(geoids))
+
+    engine = build_backcast_engine(model, geoids, launch_years, n_steps, historical)
+    index = engine.index
+
+    # launch populations, [LAUNCH, GEOID, AGE_GROUP, SEX]
+    totals = np.stack([historical.filter(pl.col('YEAR') == year).get_column('POPULATION').to_numpy()
+                       for year in launch_years])
+    assert totals.shape == (len(launch_years), len(geoids))
+    launch = get_launch_structures(index, launch_years) * totals[..., np.newaxis, np.newaxis]
+    launch_pop = np.round(launch)
+    print(f"Backcasting {len(launch_years)} launch years ({launch_years[0]}-{launch_years[-1]}), "
+          f"{n_steps} steps, {len(geoids)} states")
+
+    results = engine.run(launch_pop=launch_pop, launch_remainder=launch - launch_pop, years=engine.immigration_years)
+
+    # projected totals by state, [HORIZON, LAUNCH, GEOID]
+    projected = {'POPULATION': results['population'].sum(axis=(-2, -1)),
+                 'BIRTHS': results['births'].sum(axis=-1),
+                 'DEATHS': results['deaths'].sum(axis=(-2, -1)),
+                 'IMMIGRATION': results['immigration'].sum(axis=(-2, -1)),
+                 'MIGRATION': (results['inmig'] - results['outmig']).sum(axis=(-2, -1))}
+
+    rows = []
+    for k, horizon in enumerate(engine.immigration_years):
+        for i, launch_year in enumerate(launch_years):
+            target = launch_year + horizon
+            if target > LAST_YEAR:
+                continue
+            actual = (historical.filter(pl.col('YEAR').is_between(target - STEP + 1, target))
+                                .group_by('GEOID')
+                                .agg(pl.col(list(CENSUS_COMPONENTS)).sum())
+                                .join(historical.filter(pl.col('YEAR') == target).select(['GEOID', 'POPULATION']), on='GEOID')
+                                .sort('GEOID'))
+            for component in COMPONENTS:
+                rows.append(pl.DataFrame({'LAUNCH_YEAR': launch_year,
+                                          'TARGET_YEAR': target,
+                                          'HORIZON': horizon,
+                                          'GEOID': geoids,
+                                          'COMPONENT': component,
+                                          'PROJECTED': projected[component][k, i],
+                                          'ACTUAL': actual.get_column(component).to_numpy()}))
+    errors = pl.concat(rows)
+    nation = (errors.group_by(['LAUNCH_YEAR', 'TARGET_YEAR', 'HORIZON', 'COMPONENT'])
+                    .agg(pl.col(['PROJECTED', 'ACTUAL']).sum())
+                    .with_columns(pl.lit('US').alias('GEOID')))
+    errors = pl.concat([errors, nation.select(errors.columns)])
+    # undefined where the actual value is zero (e.g. national net domestic
+    # migration)
+    errors = errors.with_columns(pl.when(pl.col('ACTUAL') != 0)
+                                   .then(100.0 * (pl.col('PROJECTED') - pl.col('ACTUAL')) / pl.col('ACTUAL').abs())
+                                   .alias('ALPE'))
+    errors = errors.with_columns(pl.col('ALPE').abs().alias('APE'))
+    errors = errors.sort(['LAUNCH_YEAR', 'HORIZON', 'COMPONENT', 'GEOID'])
+
+    by_geography = (errors.group_by(['GEOID', 'COMPONENT', 'HORIZON'])
+                          .agg([pl.len().alias('N'),
+                                pl.col('APE').mean().alias('MAPE'),
+                                pl.col('ALPE').mean().alias('MALPE')])
+                          .sort(['GEOID', 'COMPONENT', 'HORIZON']))
+    scorecard = score(errors)
+
+    with pl.Config(tbl_rows=-1, tbl_cols=-1, tbl_width_chars=200, float_precision=2):
+        print(scorecard)
+
+    if out is not None:
+        os.makedirs(out, exist_ok=True)
+        errors.write_csv(os.path.join(out, f'backcast_errors_{SCENARIO}.csv'))
+        by_geography.write_csv(os.path.join(out, f'backcast_by_geography_{SCENARIO}.csv'))
+        scorecard.write_csv(os.path.join(out, f'backcast_scorecard_{SCENARIO}.csv'))
+        print(f"Wrote the errors, errors by geography and scorecard to {out}")
+    print(f"{time.perf_counter() - start:.2f} seconds")
+
+    return scorecard
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Backcast the state model and score it against Census estimates.')
+    parser.add_argument('--launch-years', type=int, nargs='+', default=LAUNCH_YEARS)
+    parser.add_argument('--out', default=OUTPUT_FOLDER, help='folder for the error tables and scorecard')
+    args = parser.parse_args()
+
+    main(launch_years=args.launch_years, out=args.out)
@@ -0,0 +1,229 @@
+"""
+Author:  Phil Morefield
+Purpose: Golden-output regression harness: run the polars model and any
+         alternative engine on the same inputs and diff every ledger
+Created: October 19th, 2026
+
+The baseline is either a fresh run of the polars model ('polars', the
+default) or the committed state model outputs (outputs/*_CBO.csv,
+'golden'). The golden outputs were projected from the Census launch files
+of every state, and migration links every state to every other, so a
+golden comparison is only meaningful with all of those files present; if
+any is missing (this tree does not ship Texas) it stops with an error
+naming them.
+
+Every ledger (population, deaths, births, immigration, migration) is
+aligned on its keys and compared cell by cell; a cell fails when
+|candidate - baseline| > atol + rtol * |baseline|. Keys present on only one
+side (e.g. ledger rows for geographies without a launch population) are
+reported as MISSING/EXTRA and only fail the comparison with --strict.
+
+Usage:
+    python compare_engines_p1v0.py                          # dense vs polars
+    python compare_engines_p1v0.py --baseline golden --engines polars dense
+    python compare_engines_p1v0.py --tolerance population=1,0 deaths=1e-6,1e-9
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import polars as pl
+
+
+POPULATION_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODELS_FOLDER = os.path.join(POPULATION_FOLDER, 'models')
+GOLDEN_FOLDER = os.path.join(POPULATION_FOLDER, 'outputs')
+CENSUS_SYA_FOLDER = os.path.join(POPULATION_FOLDER, 'inputs', 'raw_files', 'Census', '2024', 'intercensal', 'syasex')
+
+sys.path.insert(0, MODELS_FOLDER)
+import state_lorax_model_p1v0 as state_model  # noqa: E402
+
+
+SCENARIO = 'CBO'
+LEDGERS = ['population', 'deaths', 'births', 'immigration', 'migration']
+KEYS = ['GEOID', 'AGE_GROUP', 'SEX']
+
+# (atol, rtol) per ledger; population is rounded to whole persons, so a
+# remainder that lands on the other side of 0.5 moves a cell by one
+DEFAULT_TOLERANCES = {'population': (1.0, 0.0),
+                      'deaths': (1e-6, 1e-9),
+                      'births': (1e-6, 1e-9),
+                      'immigration': (1e-6, 1e-9),
+                      'migration': (1e-6, 1e-9)}
+
+
+def configure_state_model(output_folder):
+    '''
+    Point the state model at this repository's inputs and a scratch output
+    folder, so the committed outputs are never overwritten.
+    '''
+    state_model.BASE_FOLDER = POPULATION_FOLDER
+    state_model.INPUT_FOLDER = os.path.join(POPULATION_FOLDER, 'inputs')
+    state_model.CENSUS_CSV_FOLDER = os.path.join(state_model.INPUT_FOLDER, 'raw_files', 'Census')
+    state_model.PROCESSED_FILES = os.path.join(state_model.INPUT_FOLDER, 'processed_files')
+    state_model.OUTPUT_FOLDER = output_folder
+    os.makedirs(output_folder, exist_ok=True)
+
+
+def run_polars(output_folder, final_projection_year):
+    configure_state_model(output_folder)
+    state_model.Projector(scenario=SCENARIO, version='p1v0').run(final_projection_year=final_projection_year)
+
+
+def run_dense(output_folder, final_projection_year):
+    configure_state_model(output_folder)
+    state_model.Projector(scenario=SCENARIO, version='p1v0').run_dense(final_projection_year=final_projection_year)
+
+
+# engine name -> function(output_folder, final_projection_year) that writes
+# the five ledgers in the layout of outputs/*_CBO.csv
+ENGINES = {'polars': run_polars,
+           'dense': run_dense}
+
+
+def read_ledgers(folder):
+    ledgers = {}
+    for name in LEDGERS:
+        csv = os.path.join(folder, f'{name}_by_age_group_sex_{SCENARIO}.csv')
+        ledgers[name] = pl.read_csv(csv, schema_overrides={'GEOID': pl.String})
+        ledgers[name] = ledgers[name].with_columns(pl.col('GEOID').str.zfill(2))
+
+    return ledgers
+
+
+def missing_golden_states(golden):
+    '''
+    States of the golden population without a Census launch file
+    (cc-est2024-syasex-<state>.csv) in this tree.
+    '''
+    states = golden['population'].get_column('GEOID').unique().sort().to_list()
+
+    return [state for state in states
+            if not os.path.isfile(os.path.join(CENSUS_SYA_FOLDER, f'cc-est2024-syasex-{state}.csv'))]
+
+
+def to_long(df):
+    keys = [col for col in KEYS if col in df.columns]
+    return df.unpivot(index=keys, variable_name='COLUMN', value_name='VALUE').with_columns(pl.col('VALUE').cast(pl.Float64))
+
+
+def diff_ledger(baseline, candidate, atol, rtol, top=10, strict=False):
+    '''
+    Compare two wide ledgers cell by cell.
+
+    Returns:
+        dict: summary statistics.
+        DataFrame: the top worst cells.
+    '''
+    keys = [col for col in KEYS if col in baseline.columns]
+    base = to_long(baseline)
+    cand = to_long(candidate)
+
+    cells = base.join(cand, on=keys + ['COLUMN'], how='full', coalesce=True, suffix='_CANDIDATE')
+    cells = cells.rename({'VALUE': 'BASELINE', 'VALUE_CANDIDATE': 'CANDIDATE'})
+
+    missing = cells.filter(pl.col('CANDIDATE').is_null()).height
+    extra = cells.filter(pl.col('BASELINE').is_null()).height
+
+    cells = cells.drop_nulls(['BASELINE', 'CANDIDATE'])
+    cells = cells.with_columns((pl.col('CANDIDATE') - pl.col('BASELINE')).alias('DIFF'))
+    cells = cells.with_columns([pl.col('DIFF').abs().fill_nan(float('inf')).alias('ABS_DIFF'),
+                                (pl.col('DIFF').abs() / pl.col('BASELINE').abs().clip(lower_bound=1e-12))
+                                .fill_nan(float('inf')).alias('REL_DIFF')])
+    cells = cells.with_columns((pl.col('ABS_DIFF') - (atol + rtol * pl.col('BASELINE').abs())).alias('EXCESS'))
+
+    failures = cells.filter(pl.col('EXCESS') > 0).height
+    summary = {'CELLS': cells.height,
+               'MISSING': missing,
+               'EXTRA': extra,
+               'MAX_ABS_DIFF': cells.get_column('ABS_DIFF').max() if cells.height else 0.0,
+               'MAX_REL_DIFF': cells.get_column('REL_DIFF').max() if cells.height else 0.0,
+               'FAILURES': failures,
+               'PASS': failures == 0 and (not strict or missing + extra == 0)}
+    worst = cells.sort('EXCESS', descending=True).head(top).select(keys + ['COLUMN', 'BASELINE', 'CANDIDATE', 'DIFF', 'REL_DIFF'])
+
+    return summary, worst
+
+
+def main(engines=('dense',), baseline='polars', final_projection_year=2098,
+         tolerances=None, top=10, strict=False, report=None):
+    '''
+    Run each engine, diff its ledgers against the baseline and print the
+    results. Returns True if every ledger of every engine passed.
+    '''
+    tolerances = {**DEFAULT_TOLERANCES, **(tolerances or {})}
+    scratch = tempfile.mkdtemp(prefix='lorax_golden_')
+
+    if baseline == 'golden':
+        baseline_ledgers = read_ledgers(GOLDEN_FOLDER)
+        missing = missing_golden_states(baseline_ledgers)
+        if missing:
+            raise FileNotFoundError(f"The golden outputs need the Census launch file of every state, but state(s) "
+                                    f"{', '.join(missing)} have none in {CENSUS_SYA_FOLDER}; "
+                                    f"use --baseline polars")
+    else:
+        folder = os.path.join(scratch, baseline)
+        ENGINES[baseline](folder, final_projection_year)
+        baseline_ledgers = read_ledgers(folder)
+
+    rows = []
+    worst_cells = []
+    for engine in engines:
+        folder = os.path.join(scratch, engine)
+        start = time.perf_counter()
+        ENGINES[engine](folder, final_projection_year)
+        seconds = time.perf_counter() - start
+        ledgers = read_ledgers(folder)
+
+        for name in LEDGERS:
+            atol, rtol = tolerances[name]
+            summary, worst = diff_ledger(baseline_ledgers[name], ledgers[name], atol, rtol, top, strict)
+            rows.append({'ENGINE': engine, 'LEDGER': name, 'SECONDS': round(seconds, 2), **summary})
+            worst_cells.append(worst.with_columns([pl.lit(engine).alias('ENGINE'), pl.lit(name).alias('LEDGER')])
+                                    .select(['ENGINE', 'LEDGER', pl.all().exclude(['ENGINE', 'LEDGER'])])
+                                    .with_columns(pl.all().exclude(['BASELINE', 'CANDIDATE', 'DIFF', 'REL_DIFF']).cast(pl.String)))
+
+    summary = pl.DataFrame(rows)
+    with pl.Config(tbl_rows=-1, tbl_cols=-1, tbl_width_chars=200):
+        print(f"\nBaseline: {baseline}")
+        print(summary)
+        print(f"\nWorst cells (top {top} per ledger):")
+        print(pl.concat(worst_cells, how='diagonal'))
+
+    if report is not None:
+        summary.write_csv(report)
+
+    return bool(summary.get_column('PASS').all())
+
+
+def parse_tolerances(values):
+    tolerances = {}
+    for value in values or []:
+        name, tol = value.split('=')
+        atol, rtol = tol.split(',')
+        tolerances[name] = (float(atol), float(rtol))
+
+    return tolerances
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Diff projection engines against a baseline.')
+    parser.add_argument('--engines', nargs='+', default=['dense'], choices=sorted(ENGINES))
+    parser.add_argument('--baseline', default='polars', choices=['golden'] + sorted(ENGINES))
+    parser.add_argument('--final-year', type=int, default=2098)
+    parser.add_argument('--tolerance', nargs='*', help='per-ledger overrides, e.g. population=1,0')
+    parser.add_argument('--top', type=int, default=10)
+    parser.add_argument('--strict', action='store_true', help='fail on keys missing from either side')
+    parser.add_argument('--report', default=None, help='write the summary table to this CSV')
+    args = parser.parse_args()
+
+    passed = main(engines=args.engines,
+                  baseline=args.baseline,
+                  final_projection_year=args.final_year,
+                  tolerances=parse_tolerances(args.tolerance),
+                  top=args.top,
+                  strict=args.strict,
+                  report=args.report)
+    sys.exit(0 if passed else 1)
@@ -0,0 +1,265 @@
+"""
+Author:  Phil Morefield
+Purpose: Diff two projection output stores (scenarios, versions or engines)
+         without loading either one in full
+Created: October 19th, 2026
+
+Each side is a wide output table: a CSV or parquet file, a table in an
+output sqlite database, or one ledger of a LedgerStore folder. The two
+sides are aligned on their key columns (RACE, GEOID, AGE_GROUP/AGE, SEX),
+which must be the same on both sides, and streamed through in batches of
+value columns (years, or INMIG/OUTMIG/NETMIG years), so only one batch of
+both sides is in memory at a time. For every batch the cells are
+differenced and folded into running results:
+
+    by_column     totals, absolute and relative differences per column (year)
+    by_geography  totals per GEOID prefix (--geography-width 2 for states)
+                  and column
+    by_age        totals per age (group) and column
+    top_cells     the --top cells with the largest absolute (or relative)
+                  difference
+
+Cells present on only one side are counted as MISSING/EXTRA and treated as
+zero in the totals.
+
+Usage:
+    python diff_scenarios_p1v0.py outputs/population_by_age_group_sex_CBO.csv other/population_by_age_group_sex_CBO.csv
+    python diff_scenarios_p1v0.py a.sqlite::population_by_age_sex_CBO b.sqlite::population_by_age_sex_CBO --out diffs
+    python diff_scenarios_p1v0.py ledgers_a::population ledgers_b::population --geography-width 5 --rank relative
+"""
+import argparse
+import itertools
+import os
+import sys
+import time
+
+import numpy as np
+import polars as pl
+
+
+POPULATION_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODELS_FOLDER = os.path.join(POPULATION_FOLDER, 'models')
+
+sys.path.insert(0, MODELS_FOLDER)
+from lorax_engine_p1v0 import LEDGER_STORE_MANIFEST, LedgerStore  # noqa: E402
+
+
+KEY_COLUMNS = ['RACE', 'GEOID', 'AGE_GROUP', 'AGE', 'SEX']
+BATCH_COLUMNS = 16
+TOP_CELLS = 20
+
+
+class TableSource():
+    '''
+    A wide CSV or parquet output table, scanned lazily so that every batch
+    only parses its own columns.
+    '''
+    def __init__(self, path):
+        self.name = path
+        if path.endswith('.parquet'):
+            self.frame = pl.scan_parquet(path)
+        else:
+            self.frame = pl.scan_csv(path, schema_overrides={'GEOID': pl.String, 'RACE': pl.String})
+        self.columns = self.frame.collect_schema().names()
+
+    def read(self, columns):
+        return self.frame.select(columns).collect()
+
+
+class DatabaseSource():
+    '''
+    A wide table in an output sqlite database, read a batch of columns at a
+    time.
+    '''
+    def __init__(self, database, table):
+        self.name = f'{database}::{table}'
+        self.uri = f'sqlite:{database}'
+        self.table = table
+        self.columns = pl.read_database_uri(query=f'SELECT * FROM "{table}" LIMIT 1', uri=self.uri).columns
+
+    def read(self, columns):
+        select = ', '.join(f'"{col}"' for col in columns)
+        return pl.read_database_uri(query=f'SELECT {select} FROM "{self.table}"', uri=self.uri)
+
+
+class LedgerSource():
+    '''
+    One ledger of a LedgerStore, in the wide layout of the output tables
+    (one column per year). Only the years of a batch are paged in.
+    '''
+    def __init__(self, folder, ledger):
+        self.name = f'{folder}::{ledger}'
+        self.store = LedgerStore.open(folder)
+        self.ledger = ledger
+        index = self.store.index
+
+        if ledger == 'births':
+            # births are [(RACE,) GEOID, SEX]
+            keys = ['GEOID', 'SEX'] if index.races is None else ['RACE', 'GEOID', 'SEX']
+            self.keys = pl.DataFrame(data=list(itertools.product(*(index.levels()[col] for col in keys))),
+                                     schema=keys,
+                                     orient='row')
+        else:
+            self.keys = index.key_frame()
+        self.years = self.store.written_years
+        self.columns = self.keys.columns + [str(year) for year in self.years]
+
+    def read(self, columns):
+        labels = [col for col in columns if col not in self.keys.columns]
+        t = [self.store.years.index(int(label)) for label in labels]
+        arr = np.asarray(self.store.array(self.ledger)[t]).reshape(len(t), -1)
+
+        return self.keys.with_columns([pl.Series(label, arr[i]) for i, label in enumerate(labels)]).select(columns)
+
+
+def open_source(spec):
+    '''
+    Open one side of the diff: a .csv or .parquet path, database.sqlite::table
+    or ledger_store_folder::ledger.
+    '''
+    if '::' in spec:
+        path, name = spec.rsplit('::', 1)
+        if os.path.isfile(os.path.join(path, LEDGER_STORE_MANIFEST)):
+            return LedgerSource(path, name)
+        return DatabaseSource(path, name)
+
+    return TableSource(spec)
+
+
+def column_year(col):
+    '''
+    The year of a value column ('2029', 'NETMIG2029'), or None.
+    '''
+    return int(col[-4:]) if col[-4:].isdigit() else None
+
+
+def diff_batch(baseline, candidate, keys):
+    '''
+    Align one batch of columns of both sides as long cells with BASELINE,
+    CANDIDATE, DIFF, ABS_DIFF and REL_DIFF.
+    '''
+    def to_long(df, value_name):
+        return (df.unpivot(index=keys, variable_name='COLUMN', value_name=value_name)
+                  .with_columns(pl.col(value_name).cast(pl.Float64)))
+
+    cells = to_long(baseline, 'BASELINE').join(to_long(candidate, 'CANDIDATE'),
+                                               on=keys + ['COLUMN'],
+                                               how='full',
+                                               coalesce=True)
+    cells = cells.with_columns([pl.col('BASELINE').is_null().alias('EXTRA'),
+                                pl.col('CANDIDATE').is_null().alias('MISSING')])
+    cells = cells.with_columns([pl.col('BASELINE').fill_null(0.0),
+                                pl.col('CANDIDATE').fill_null(0.0)])
+    cells = cells.with_columns((pl.col('CANDIDATE') - pl.col('BASELINE')).alias('DIFF'))
+
+    return cells.with_columns([pl.col('DIFF').abs().alias('ABS_DIFF'),
+                               (pl.col('DIFF').abs() / pl.col('BASELINE').abs().clip(lower_bound=1e-12)).alias('REL_DIFF')])
+
+
+def relative(df):
+    return df.with_columns((pl.col('DIFF') / pl.col('BASELINE').abs().clip(lower_bound=1e-12)).alias('REL_DIFF'))
+
+
+def main(baseline, candidate, batch_columns=BATCH_COLUMNS, top=TOP_CELLS, geography_width=2, rank='absolute',
+         out=None):
+    '''
+    Stream both sides through in column batches and print (and optionally
+    write to the out folder) the by_column, by_geography, by_age and
+    top_cells tables.
+
+    Returns:
+        dict: table name -> DataFrame.
+    '''
+    start = time.perf_counter()
+    base = open_source(baseline)
+    cand = open_source(candidate)
+
+    # both sides must have the same keys: joining on a shared subset (e.g.
+    # AGE on one side and AGE_GROUP on the other) would join many to many
+    base_keys = [col for col in KEY_COLUMNS if col in base.columns]
+    cand_keys = [col for col in KEY_COLUMNS if col in cand.columns]
+    assert base_keys == cand_keys, \
+        f"Baseline is keyed on {', '.join(base_keys)} but candidate on {', '.join(cand_keys)}"
+    keys = base_keys
+    assert 'GEOID' in keys, "Both sides need a GEOID column"
+    ages = [col for col in keys if col in ('AGE_GROUP', 'AGE')]
+    values = [col for col in base.columns if col in cand.columns and col not in KEY_COLUMNS]
+    only = sorted((set(base.columns) ^ set(cand.columns)) - set(KEY_COLUMNS))
+    assert values, f"No value columns on both sides; columns on only one side: {', '.join(only)}"
+    print(f"Diffing {len(values):,} columns on {', '.join(keys)} in batches of {batch_columns}")
+    if only:
+        print(f"Skipping {len(only):,} columns on only one side: {', '.join(only[:10])}{' ...' if len(only) > 10 else ''}")
+
+    rank_col = 'ABS_DIFF' if rank == 'absolute' else 'REL_DIFF'
+    by_column, by_geography, by_age = [], [], []
+    top_cells = None
+    for i in range(0, len(values), batch_columns):
+        columns = values[i:i + batch_columns]
+        cells = diff_batch(base.read(keys + columns), cand.read(keys + columns), keys)
+
+        by_column.append(cells.group_by('COLUMN').agg([pl.len().alias('CELLS'),
+                                                       pl.col('MISSING').sum(),
+                                                       pl.col('EXTRA').sum(),
+                                                       pl.col('BASELINE').sum(),
+                                                       pl.col('CANDIDATE').sum(),
+                                                       pl.col('DIFF').sum(),
+                                                       pl.col('ABS_DIFF').sum().alias('SUM_ABS_DIFF'),
+                                                       pl.col('ABS_DIFF').max().alias('MAX_ABS_DIFF'),
+                                                       pl.col('REL_DIFF').max().alias('MAX_REL_DIFF')]))
+        by_geography.append(cells.group_by([pl.col('GEOID').str.slice(0, geography_width), 'COLUMN'])
+                                 .agg(pl.col(['BASELINE', 'CANDIDATE', 'DIFF']).sum()))
+        if ages:
+            by_age.append(cells.group_by(ages + ['COLUMN']).agg(pl.col(['BASELINE', 'CANDIDATE', 'DIFF']).sum()))
+
+        batch_top = cells.drop(['MISSING', 'EXTRA']).sort(rank_col, descending=True).head(top)
+        top_cells = batch_top if top_cells is None else pl.concat([top_cells, batch_top]).sort(rank_col, descending=True).head(top)
+
+    order = {col: i for i, col in enumerate(values)}
+
+    def finish(frames, by):
+        df = pl.concat(frames).with_columns(pl.col('COLUMN').map_elements(column_year, return_dtype=pl.Int64).alias('YEAR'))
+        df = df.with_columns(pl.col('COLUMN').replace_strict(order, return_dtype=pl.Int64).alias('_ORDER'))
+        return df.sort(by + ['_ORDER']).drop('_ORDER').select(by + ['COLUMN', 'YEAR', pl.all().exclude(by + ['COLUMN', 'YEAR'])])
+
+    tables = {'by_column': relative(finish(by_column, [])),
+              'by_geography': relative(finish(by_geography, ['GEOID'])),
+              'top_cells': top_cells.sort(rank_col, descending=True)}
+    if by_age:
+        tables['by_age'] = relative(finish(by_age, ages))
+
+    with pl.Config(tbl_rows=25, tbl_cols=-1, tbl_width_chars=200):
+        print(f"\nBaseline:  {base.name}\nCandidate: {cand.name}")
+        print("\nBy column:")
+        print(tables['by_column'])
+        print(f"\nTop {top} cells by {rank} difference:")
+        print(tables['top_cells'])
+
+    if out is not None:
+        os.makedirs(out, exist_ok=True)
+        for name, df in tables.items():
+            df.write_csv(os.path.join(out, f'{name}.csv'))
+        print(f"\nWrote {', '.join(tables)} to {out}")
+
+    print(f"\n{time.perf_counter() - start:.2f} seconds")
+
+    return tables
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Diff two projection output stores.')
+    parser.add_argument('baseline', help='.csv/.parquet path, database.sqlite::table or ledger_folder::ledger')
+    parser.add_argument('candidate', help='same forms as baseline')
+    parser.add_argument('--batch-columns', type=int, default=BATCH_COLUMNS)
+    parser.add_argument('--top', type=int, default=TOP_CELLS)
+    parser.add_argument('--geography-width', type=int, default=2, help='GEOID prefix of by_geography (2 = state)')
+    parser.add_argument('--rank', choices=['absolute', 'relative'], default='absolute')
+    parser.add_argument('--out', default=None, help='folder for the CSV tables')
+    args = parser.parse_args()
+
+    main(baseline=args.baseline,
+         candidate=args.candidate,
+         batch_columns=args.batch_columns,
+         top=args.top,
+         geography_width=args.geography_width,
+         rank=args.rank,
+         out=args.out)